@@ -1,6 +1,5 @@
 from datetime import timedelta
 
-from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 from django.http import HttpResponseForbidden
@@ -12,7 +11,7 @@ from django.views.generic import DetailView, ListView
 from django.views.generic.edit import DeleteView
 
 from history.models import QueryHistory
-from search.encryptor import CellEncryptor
+from search.encryptor import KeyRing
 
 __all__ = ()
 
@@ -22,9 +21,8 @@ class HistoryView(LoginRequiredMixin, ListView):
     model = QueryHistory
     template_name = "history/history.html"
     context_object_name = "queries"
-    key = settings.ENCRYPTION_KEY
     paginate_by = 9
-    encryptor = CellEncryptor(key)
+    keyring = KeyRing.from_settings()
 
     def get_queryset(self):
         queryset = (
@@ -33,9 +31,12 @@ class HistoryView(LoginRequiredMixin, ListView):
             .filter(user=self.request.user)
             .order_by(f"-{QueryHistory.created_at.field.name}")
         )
-        for query in queryset:
+        decrypted_queries = self.keyring.decrypt_tokens(
+            query.query for query in queryset
+        )
+        for query, decrypted_query in zip(queryset, decrypted_queries):
             query.can_repeat = (now() - query.created_at) >= timedelta(days=1)
-            query.query = self.encryptor.decrypt(query.query)
+            query.query = decrypted_query
 
         return queryset
 
@@ -60,8 +61,7 @@ class HistoryView(LoginRequiredMixin, ListView):
 
 class HistoryDetailView(DetailView):
 
-    key = settings.ENCRYPTION_KEY
-    encryptor = CellEncryptor(key)
+    keyring = KeyRing.from_settings()
     model = QueryHistory
     template_name = "history/history_detail.html"
     context_object_name = "query"
@@ -71,7 +71,9 @@ class HistoryDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["query"].query = self.encryptor.decrypt(context["query"].query)
+        context["query"].query = self.keyring.decrypt_token(
+            context["query"].query,
+        )
         return context
 
 
@@ -20,6 +20,12 @@ ENCRYPTION_KEY = os.getenv(
     "DJANGO_ENCRYPTION_KEY",
     "dsEa3e6lF983WPH88NsSS9A0HGCIK5xA",
 ).encode()
+# Version of ENCRYPTION_KEY. When rotating, the old key is kept
+# as PREVIOUS_ENCRYPTION_KEY until rotate_keys re-encrypts all data
+ENCRYPTION_KEY_VERSION = int(os.getenv("DJANGO_ENCRYPTION_KEY_VERSION", "1"))
+PREVIOUS_ENCRYPTION_KEY = (
+    os.getenv("DJANGO_PREVIOUS_ENCRYPTION_KEY", "").encode() or None
+)
 
 DEBUG = utils.get_bool_env(os.getenv("DJANGO_DEBUG", "true"))
 
@@ -246,6 +252,37 @@ CACHES = {
 }
 
 BATCH_SIZE = 5000  # Batch size for reading and writing data
+SQLITE_FETCH_SIZE = 5000  # Rows fetched per fetchmany from SQLite sources
+# Load new leaks into an unindexed staging table. When the load is
+# complete, PostgreSQL builds the leak's partition with its indexes and
+# attaches it to Data; other backends merge it with INSERT ... SELECT
+DEFERRED_INDEX_BUILD = True
+# CSV files larger than this have their row count estimated from samples
+ROW_COUNT_SAMPLE_THRESHOLD = 1024 * 1024 * 1024
+# Failed ingestion is retried from the last checkpoint
+ENCRYPTION_MAX_RETRIES = 3
+ENCRYPTION_RETRY_DELAY = 60  # seconds
+
+# Live task progress is kept in the cache, updated at most once per
+# interval or number of rows; only the final state goes to TaskResult
+PROGRESS_UPDATE_INTERVAL = 1.0  # seconds
+PROGRESS_UPDATE_ROWS = 50_000
+PROGRESS_CACHE_TIMEOUT = 24 * 60 * 60  # seconds
+
+# Search results are cached per encrypted query until the set of active
+# leaks changes (activation, end of encryption, deletion)
+SEARCH_CACHE_TIMEOUT = 60 * 60  # seconds
+# Each leak keeps a Bloom filter of its lookup keys, searches skip leaks
+# whose filter rules the key out
+BLOOM_FILTER_FALSE_POSITIVE_RATE = 0.01
+# Row counts shown before a leak is deleted are planner estimates on
+# PostgreSQL; other backends count at most this many rows per table
+ROW_COUNT_ESTIMATE_LIMIT = 1_000_000
+
+# Number of processes encrypting cells during ingestion (1 - no pool)
+ENCRYPTION_WORKERS = int(
+    os.getenv("DJANGO_ENCRYPTION_WORKERS", str(os.cpu_count() or 1)),
+)
 
 PROTECTED_MEDIA_ROOT = MEDIA_ROOT / "protected"
 TEMP_UPLOAD_DIR = PROTECTED_MEDIA_ROOT / "temp_uploads"
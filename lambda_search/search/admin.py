@@ -1,12 +1,14 @@
 from django.contrib import admin
-from django.contrib.admin.utils import NestedObjects
 from django.core.cache import cache
-from django.db import router
+from django.db.models.functions import Length
 from django.http import JsonResponse
+from django.template.defaultfilters import filesizeformat
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 
-from search.models import Data, ManagedDatabase, models
+from search.deletion import estimate_row_count
+from search.models import Data, DomainOwnership, ManagedDatabase, models
+from search.progress import get_task_progress
 from search.widgets import ProgressBarFileInput
 
 __all__ = ()
@@ -36,10 +38,16 @@ class ManagedDatabaseAdmin(admin.ModelAdmin):
         ManagedDatabase.file.field.name,
         ManagedDatabase.active.field.name,
         "progress_bar",
+        "bloom_filter_size",
     )
     list_editable = (ManagedDatabase.active.field.name,)
     search_fields = (ManagedDatabase.name.field.name,)
-    list_filter = (ManagedDatabase.active.field.name,)
+    list_filter = (
+        ManagedDatabase.active.field.name,
+        ManagedDatabase.storage.field.name,
+        ManagedDatabase.key_version.field.name,
+        ManagedDatabase.is_deleting.field.name,
+    )
     readonly_fields = (
         ManagedDatabase.created_at.field.name,
         ManagedDatabase.updated_at.field.name,
@@ -54,25 +62,39 @@ class ManagedDatabaseAdmin(admin.ModelAdmin):
         ManagedDatabase.updated_at.field.name,
     )
 
+    def get_queryset(self, request):
+        # Сам фильтр в списке не нужен, только его размер
+        return (
+            super()
+            .get_queryset(request)
+            .defer(ManagedDatabase.bloom_filter.field.name)
+            .annotate(
+                bloom_filter_bytes=Length(
+                    ManagedDatabase.bloom_filter.field.name,
+                ),
+            )
+        )
+
+    def bloom_filter_size(self, obj):
+        if obj.bloom_filter_bytes is None:
+            return "-"
+
+        return filesizeformat(obj.bloom_filter_bytes)
+
+    bloom_filter_size.short_description = _("Фильтр Блума в памяти")
+
     def progress_bar(self, obj):
         if not obj.progress_task_id:
             return _("Не начато")
 
-        from django_celery_results.models import TaskResult
-
         try:
-            task_result = TaskResult.objects.get(task_id=obj.progress_task_id)
-            result_data = task_result.result
+            progress_data = get_task_progress(obj.progress_task_id)
+            if progress_data is None:
+                return _("Задача не найдена")
 
-            if not result_data:
+            if not progress_data:
                 return _("Ожидание...")
 
-            progress_data = task_result.result
-            if isinstance(progress_data, str):
-                import json
-
-                progress_data = json.loads(progress_data)
-
             progress = progress_data.get("percent", 0)
             current = progress_data.get("current", 0)
             total = progress_data.get("total", 0)
@@ -106,24 +128,29 @@ class ManagedDatabaseAdmin(admin.ModelAdmin):
                 total,
                 description,
             )
-        except TaskResult.DoesNotExist:
-            return _("Задача не найдена")
-        except (ValueError, KeyError, json.JSONDecodeError) as e:
+        except (ValueError, KeyError) as e:
             return _("Ошибка данных") + str(e)
 
     progress_bar.short_description = _("Прогресс")
     progress_bar.allow_tags = True
 
     def get_deleted_objects(self, objs, request):
-        collector = NestedObjects(using=router.db_for_write(self.model))
-        collector.collect(objs)
-        related_objects_count = sum(len(v) for v in collector.data.values())
-        return (
-            [],
-            {_("Количество связанных объектов"): related_objects_count},
-            set(),
-            [],
-        )
+        # Оценка без сбора связанных строк: утечка может содержать
+        # миллионы ячеек
+        model_count = {}
+        for database in objs:
+            for model, count in estimate_row_count(database).items():
+                name = model._meta.verbose_name_plural
+                model_count[name] = model_count.get(name, 0) + count
+
+        return [], model_count, set(), []
+
+    def delete_model(self, request, obj):
+        obj.schedule_deletion()
+
+    def delete_queryset(self, request, queryset):
+        for database in queryset:
+            database.schedule_deletion()
 
     def response_add(self, request, obj, form=None, post_url_continue=None):
         """Переопределяем метод для возврата JSON при AJAX запросе"""
@@ -223,10 +250,28 @@ class DataDatabaseAdmin(admin.ModelAdmin):
     list_display = (
         Data.user_index.field.name,
         Data.database.field.name,
-        Data.column_name.field.name,
-        Data.value.field.name,
+        "column_name",
+        "value_hex",
     )
+    list_select_related = (Data.database.field.name,)
     ordering = (
         Data.database.field.name,
         Data.user_index.field.name,
     )
+
+    def value_hex(self, obj):
+        return bytes(obj.value).hex()
+
+    value_hex.short_description = Data.value.field.verbose_name
+
+
+@admin.register(DomainOwnership)
+class DomainOwnershipAdmin(admin.ModelAdmin):
+    list_display = (
+        DomainOwnership.domain.field.name,
+        DomainOwnership.user.field.name,
+        DomainOwnership.verified.field.name,
+    )
+    list_editable = (DomainOwnership.verified.field.name,)
+    list_filter = (DomainOwnership.verified.field.name,)
+    search_fields = (DomainOwnership.domain.field.name,)
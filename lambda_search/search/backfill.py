@@ -0,0 +1,284 @@
+from django.conf import settings
+from django.db import models, transaction
+
+from search.deletion import delete_in_chunks
+from search.encryptor import CellEncryptor, KeyRing
+from search.forms import get_email_domain
+from search.result_cache import bump_generation
+from search.summaries import (
+    pack_cells,
+    RecordSummary,
+    save_record_summaries,
+)
+
+__all__ = ()
+
+
+def backfill_lookups(database_id=None, batch_size=None, keyring=None):
+    """
+    Заполняет ключи поиска (по значению и по домену email) у строк Data,
+    загруженных до их появления: значение расшифровывается, и от него
+    считается HMAC на ключе версии утечки. Строки обходятся по первичному
+    ключу порциями, каждая порция — отдельная транзакция, поэтому
+    прерванное заполнение можно запустить заново. Шифротексты, усечённые
+    при загрузке до перехода на двоичное хранение, расшифровать нельзя,
+    они остаются без ключа. Ротируемые утечки пропускаются: ключи
+    их строк пересчитывает ротация. Возвращает число обновлённых строк.
+    """
+    from search.models import Data, ManagedDatabase
+
+    batch_size = batch_size or settings.BATCH_SIZE
+    keyring = keyring or KeyRing.from_settings()
+
+    database = Data.database.field.name
+    queryset = (
+        Data.objects.filter(
+            **{
+                f"{Data.lookup.field.name}__isnull": True,
+                f"{database}__"
+                f"{ManagedDatabase.rotation_checkpoint.field.name}__isnull": (
+                    True
+                ),
+            },
+        )
+        .select_related(database)
+        .order_by("pk")
+    )
+    if database_id is not None:
+        queryset = queryset.filter(database_id=database_id)
+
+    updated = 0
+    last_pk = 0
+    while True:
+        rows = list(
+            queryset.filter(pk__gt=last_pk).only(
+                Data.value.field.name,
+                f"{database}__{ManagedDatabase.key_version.field.name}",
+            )[:batch_size],
+        )
+        if not rows:
+            return updated
+
+        last_pk = rows[-1].pk
+        by_version = {}
+        for row in rows:
+            if row.value and len(row.value) % CellEncryptor.BLOCK_SIZE == 0:
+                by_version.setdefault(row.database.key_version, []).append(
+                    row,
+                )
+
+        for version, version_rows in by_version.items():
+            encryptor = keyring.get(version)
+            values = encryptor.decrypt_many(row.value for row in version_rows)
+            for row, value, lookup in zip(
+                version_rows,
+                values,
+                encryptor.lookup_many(values),
+            ):
+                domain = get_email_domain(value)
+                row.lookup = lookup
+                row.domain_lookup = (
+                    encryptor.domain_lookup(domain) if domain else None
+                )
+
+        rows = [
+            row for version_rows in by_version.values() for row in version_rows
+        ]
+        with transaction.atomic():
+            Data.objects.bulk_update(
+                rows,
+                [Data.lookup.field.name, Data.domain_lookup.field.name],
+            )
+
+        updated += len(rows)
+
+
+def backfill_record_summaries(database_id=None, batch_size=None):
+    """
+    Строит сводки записей (DataRecord) для утечек, загруженных до их
+    появления, по номерам столбцов ячеек Data. Ячейки обходятся
+    по user_index порциями, каждая порция — отдельная транзакция;
+    прерванное построение продолжается после последней записи, у которой
+    уже есть сводка. Возвращает число созданных сводок.
+    """
+    from search.models import Data, DataRecord, ManagedDatabase
+
+    batch_size = batch_size or settings.BATCH_SIZE
+    databases = ManagedDatabase.objects.filter(
+        **{ManagedDatabase.is_encrypted.field.name: True},
+    ).annotate(
+        summarized=models.Max(
+            f"{DataRecord.database.field.related_query_name()}__"
+            f"{DataRecord.user_index.field.name}",
+        ),
+    )
+    if database_id is not None:
+        databases = databases.filter(pk=database_id)
+
+    created = 0
+    for database in databases.only(ManagedDatabase.columns.field.name):
+        summary = RecordSummary(database.columns)
+        cells = Data.objects.filter(**{Data.database.field.name: database})
+        if database.summarized is not None:
+            cells = cells.filter(
+                **{f"{Data.user_index.field.name}__gt": database.summarized},
+            )
+
+        chunk = []
+        for cell in (
+            cells.order_by(Data.user_index.field.name)
+            .values_list(
+                Data.user_index.field.name,
+                Data.column_index.field.name,
+            )
+            .iterator(chunk_size=batch_size)
+        ):
+            # Ячейки одной записи не разделяются между порциями
+            if len(chunk) >= batch_size and chunk[-1][0] != cell[0]:
+                created += _summarize_chunk(database, summary, chunk)
+                chunk = []
+
+            chunk.append(cell)
+
+        created += _summarize_chunk(database, summary, chunk)
+
+    return created
+
+
+def _summarize_chunk(database, summary, cells) -> int:
+    with transaction.atomic():
+        return save_record_summaries(database, summary.summarize(cells))
+
+
+def pack_records(database_id, batch_size=None) -> int:
+    """
+    Переводит утечку на хранение записями: ячейки каждой записи
+    упаковываются в DataRecord.payload, ключи поиска переносятся
+    в RecordLookup, затем ячейки удаляются из Data. Записи обходятся
+    по user_index порциями, каждая порция — отдельная транзакция;
+    прерванный перевод продолжается с первой неупакованной записи.
+    Ячейки удаляются после переключения хранения: секцией целиком
+    на PostgreSQL или порциями, как при удалении утечки.
+    Возвращает число упакованных записей.
+    """
+    from search.models import Data, DataRecord, ManagedDatabase
+    from search.partitions import (
+        attach_all_partitions,
+        drop_partition,
+        is_partitioned,
+        sync_partition,
+    )
+
+    batch_size = batch_size or settings.BATCH_SIZE
+    database = ManagedDatabase.objects.get(pk=database_id)
+    cells = Data.objects.filter(**{Data.database.field.name: database})
+    if database.storage == ManagedDatabase.STORAGE_RECORDS:
+        # Ячейки могли остаться после прерванного удаления
+        for _count in delete_in_chunks(cells, batch_size):
+            pass
+
+        return 0
+
+    if not database.is_encrypted:
+        raise ValueError("Утечка ещё не загружена")
+
+    # Секция выключенной утечки отсоединена от Data
+    attach_all_partitions([database.pk])
+    if cells.filter(**{f"{Data.lookup.field.name}__isnull": True}).exists():
+        sync_partition(database)
+        raise ValueError(
+            "Не у всех ячеек есть ключ поиска, "
+            "сначала выполните backfill_lookups",
+        )
+
+    backfill_record_summaries(database_id=database.pk, batch_size=batch_size)
+    start = DataRecord.objects.filter(
+        **{
+            DataRecord.database.field.name: database,
+            f"{DataRecord.payload.field.name}__isnull": True,
+        },
+    ).aggregate(start=models.Min(DataRecord.user_index.field.name))["start"]
+
+    packed = 0
+    if start is not None:
+        rows = (
+            cells.filter(**{f"{Data.user_index.field.name}__gte": start})
+            .order_by(Data.user_index.field.name, Data.column_index.field.name)
+            .values_list(
+                Data.user_index.field.name,
+                Data.column_index.field.name,
+                Data.value.field.name,
+                Data.lookup.field.name,
+                Data.domain_lookup.field.name,
+            )
+            .iterator(chunk_size=batch_size)
+        )
+        chunk = []
+        for row in rows:
+            # Ячейки одной записи не разделяются между порциями
+            if len(chunk) >= batch_size and chunk[-1][0] != row[0]:
+                packed += _pack_chunk(database, chunk)
+                chunk = []
+
+            chunk.append(row)
+
+        packed += _pack_chunk(database, chunk)
+
+    with transaction.atomic():
+        ManagedDatabase.objects.filter(pk=database.pk).update(
+            storage=ManagedDatabase.STORAGE_RECORDS,
+        )
+        if is_partitioned():
+            drop_partition(database)
+
+        transaction.on_commit(bump_generation)
+
+    # Поиск по утечке уже идёт по сводкам
+    for _count in delete_in_chunks(cells, batch_size):
+        pass
+
+    sync_partition(database)
+    return packed
+
+
+def _pack_chunk(database, rows) -> int:
+    from search.models import DataRecord, RecordLookup
+
+    if not rows:
+        return 0
+
+    records = list(
+        DataRecord.objects.filter(
+            **{
+                DataRecord.database.field.name: database,
+                f"{DataRecord.user_index.field.name}__range": (
+                    rows[0][0],
+                    rows[-1][0],
+                ),
+            },
+        ).only(DataRecord.user_index.field.name),
+    )
+    cells = {}
+    lookups = {}
+    for user_index, column_index, value, lookup, domain_lookup in rows:
+        cells.setdefault(user_index, []).append((column_index, value))
+        keys = lookups.setdefault(user_index, set())
+        keys.add(bytes(lookup))
+        if domain_lookup is not None:
+            keys.add(bytes(domain_lookup))
+
+    for record in records:
+        record.payload = pack_cells(cells.get(record.user_index, []))
+
+    with transaction.atomic():
+        DataRecord.objects.bulk_update(
+            records,
+            [DataRecord.payload.field.name],
+        )
+        RecordLookup.objects.bulk_create(
+            RecordLookup(record=record, lookup=lookup)
+            for record in records
+            for lookup in lookups.get(record.user_index, ())
+        )
+
+    return len({record.user_index for record in records})
@@ -0,0 +1,236 @@
+import math
+import struct
+
+from django.conf import settings
+
+from search.encryptor import as_lookups
+from search.result_cache import aget_generation, get_generation
+
+__all__ = ()
+
+
+class BloomFilter:
+    """
+    Фильтр Блума над ключами поиска одной утечки. Ключи — HMAC,
+    поэтому их байты уже равномерно распределены: позиции битов
+    получаются из двух половин ключа (двойное хеширование)
+    без дополнительных хеш-функций.
+    """
+
+    HEADER = struct.Struct(">QB")
+
+    def __init__(self, num_bits: int, num_hashes: int, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(bits or (num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, false_positive_rate: float):
+        capacity = max(capacity, 1)
+        num_bits = max(
+            math.ceil(
+                -capacity * math.log(false_positive_rate) / math.log(2) ** 2,
+            ),
+            8,
+        )
+        num_hashes = max(round(num_bits / capacity * math.log(2)), 1)
+        return cls(num_bits, num_hashes)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        num_bits, num_hashes = cls.HEADER.unpack_from(data)
+        return cls(num_bits, num_hashes, data[cls.HEADER.size :])
+
+    def to_bytes(self) -> bytes:
+        return self.HEADER.pack(self.num_bits, self.num_hashes) + self.bits
+
+    def _positions(self, lookup: bytes):
+        digest = bytes(lookup)
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:16], "big") | 1
+        for index in range(self.num_hashes):
+            yield (first + index * second) % self.num_bits
+
+    def add(self, lookup: bytes):
+        for position in self._positions(lookup):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, lookup: bytes) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(lookup)
+        )
+
+    def __len__(self) -> int:
+        return len(self.bits)
+
+    def fold(self, num_bits: int):
+        """
+        Тот же набор ключей в фильтре из num_bits битов: позиция бита
+        берётся по модулю размера, поэтому при num_bits, кратном 8 и
+        делящем текущий размер, части фильтра объединяются по ИЛИ
+        """
+        if num_bits >= self.num_bits or self.num_bits % num_bits:
+            return self
+
+        size = num_bits // 8
+        bits = 0
+        for offset in range(0, len(self.bits), size):
+            bits |= int.from_bytes(self.bits[offset : offset + size], "little")
+
+        return BloomFilter(
+            num_bits,
+            self.num_hashes,
+            bits.to_bytes(size, "little"),
+        )
+
+
+class IngestionBloomFilter:
+    """
+    Фильтр Блума, который собирается из ключей порций по ходу загрузки,
+    пока точное число ключей ещё неизвестно. Фильтр заводится с запасом:
+    по оценке числа строк и числу ключей на строку в первой порции.
+    Размеры — степени двойки, поэтому build() сворачивает его до размера
+    под фактическое число ключей без повторного чтения утечки.
+    Если оценка занижена больше, чем в HEADROOM раз, фильтр остаётся
+    верным, но даёт больше ложных срабатываний.
+    """
+
+    HEADROOM = 2
+
+    def __init__(self, estimated_rows: int, false_positive_rate=None):
+        self.estimated_rows = estimated_rows
+        self.false_positive_rate = (
+            false_positive_rate or settings.BLOOM_FILTER_FALSE_POSITIVE_RATE
+        )
+        self.bloom_filter = None
+        self.count = 0
+
+    def _sized(self, capacity) -> BloomFilter:
+        sized = BloomFilter.for_capacity(
+            math.ceil(capacity),
+            self.false_positive_rate,
+        )
+        return BloomFilter(
+            1 << (sized.num_bits - 1).bit_length(),
+            sized.num_hashes,
+        )
+
+    def add_chunk(self, rows_count: int, cells):
+        """Ключи порции ячеек (user_index, column_index, value, lookup, ...)"""
+        lookups = [cell[3] for cell in cells if cell[3] is not None]
+        if self.bloom_filter is None:
+            self.bloom_filter = self._sized(
+                max(self.estimated_rows, rows_count)
+                * len(lookups)
+                / max(rows_count, 1)
+                * self.HEADROOM,
+            )
+
+        for lookup in lookups:
+            self.bloom_filter.add(lookup)
+
+        self.count += len(lookups)
+
+    def build(self) -> BloomFilter:
+        if self.bloom_filter is None:
+            return self._sized(0)
+
+        return self.bloom_filter.fold(self._sized(self.count).num_bits)
+
+
+def build_bloom_filter(database_id) -> BloomFilter:
+    """
+    Строит фильтр по ключам поиска уже загруженной утечки: из ячеек
+    Data или из RecordLookup, если записи утечки упакованы
+    """
+    from search.models import Data, DataRecord, RecordLookup
+
+    lookups = Data.objects.filter(
+        **{
+            Data.database.field.attname: database_id,
+            f"{Data.lookup.field.name}__isnull": False,
+        },
+    ).values_list(Data.lookup.field.name, flat=True)
+    if not lookups.exists():
+        lookups = RecordLookup.objects.filter(
+            **{
+                f"{RecordLookup.record.field.name}__"
+                f"{DataRecord.database.field.attname}": database_id,
+            },
+        ).values_list(RecordLookup.lookup.field.name, flat=True)
+
+    bloom_filter = BloomFilter.for_capacity(
+        lookups.count(),
+        settings.BLOOM_FILTER_FALSE_POSITIVE_RATE,
+    )
+    for lookup in lookups.iterator(chunk_size=settings.BATCH_SIZE):
+        bloom_filter.add(lookup)
+
+    return bloom_filter
+
+
+_loaded_filters = {"generation": None, "filters": {}}
+
+
+def _active_filters_queryset():
+    from search.models import ManagedDatabase
+
+    return ManagedDatabase.objects.filter(
+        **{
+            ManagedDatabase.active.field.name: True,
+            ManagedDatabase.is_encrypted.field.name: True,
+        },
+    ).values_list(
+        ManagedDatabase._meta.pk.name,
+        ManagedDatabase.bloom_filter.field.name,
+    )
+
+
+def _load_filters(generation, rows):
+    _loaded_filters["filters"] = {
+        database_id: BloomFilter.from_bytes(bytes(data)) if data else None
+        for database_id, data in rows
+    }
+    _loaded_filters["generation"] = generation
+
+
+def get_bloom_filters() -> dict:
+    """
+    Фильтры активных утечек {database_id: BloomFilter или None},
+    загруженные в память процесса. Перечитываются, когда меняется
+    поколение набора активных утечек.
+    """
+    generation = get_generation()
+    if _loaded_filters["generation"] != generation:
+        _load_filters(generation, _active_filters_queryset())
+
+    return _loaded_filters["filters"]
+
+
+async def aget_bloom_filters() -> dict:
+    generation = await aget_generation()
+    if _loaded_filters["generation"] != generation:
+        _load_filters(
+            generation,
+            [row async for row in _active_filters_queryset()],
+        )
+
+    return _loaded_filters["filters"]
+
+
+def get_candidate_databases(lookup, bloom_filters=None) -> list:
+    """
+    Утечки, в которых может встретиться ключ (или один из ключей
+    значения на разных версиях ключа шифрования). Утечки без фильтра
+    (загруженные до его появления или ротируемые) проверяются всегда.
+    """
+    if bloom_filters is None:
+        bloom_filters = get_bloom_filters()
+
+    lookups = as_lookups(lookup)
+    return [
+        database_id
+        for database_id, bloom_filter in bloom_filters.items()
+        if bloom_filter is None or any(key in bloom_filter for key in lookups)
+    ]
@@ -0,0 +1,103 @@
+import csv
+from pathlib import Path
+import time
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from search.encryptor import KeyRing
+from search.forms import normalize_search_query
+
+__all__ = ()
+
+
+RESULT_HEADER = ("identifier", "database", "columns")
+
+
+def count_identifiers(path: Path) -> int:
+    with path.open("rb") as file:
+        return sum(1 for line in file if line.strip())
+
+
+def iter_identifier_batches(path: Path, batch_size: int):
+    """
+    Читает файл построчно и отдаёт порции {нормализованный
+    идентификатор: исходная строка}, пустые строки пропускаются
+    """
+    batch = {}
+    with path.open(encoding="utf-8-sig", errors="replace") as file:
+        for line in file:
+            identifier = line.strip()
+            if not identifier:
+                continue
+
+            batch.setdefault(normalize_search_query(identifier), identifier)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = {}
+
+    if batch:
+        yield batch
+
+
+def run_bulk_search(job, progress_callback=None, batch_size=None):
+    """
+    Проверяет идентификаторы из файла задания порциями: ключи поиска
+    считаются пакетно, каждая порция разрешается двумя запросами
+    к Data. Совпадения дописываются в файл результатов по мере
+    обработки. Возвращает (проверено, совпадений, идентификаторов/с).
+    """
+    from search.models import BulkSearchJob, Data
+
+    batch_size = batch_size or settings.BATCH_SIZE
+    keyring = KeyRing.from_settings()
+    source = Path(job.file.path)
+
+    if not job.result:
+        job.result.save(f"{source.stem}.csv", ContentFile(b""), save=False)
+        BulkSearchJob.objects.filter(pk=job.pk).update(
+            result=job.result.name,
+        )
+
+    processed = 0
+    matches = 0
+    started = time.perf_counter()
+    with Path(job.result.path).open("w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(RESULT_HEADER)
+        for batch in iter_identifier_batches(source, batch_size):
+            # Во время ротации ключа значение ищется по ключам обеих версий
+            identifiers = {
+                lookup: identifier
+                for identifier in batch
+                for lookup in keyring.lookups(identifier)
+            }
+            found = {}
+            for lookup, databases in Data.objects.search_many(
+                list(identifiers),
+            ).items():
+                for database, columns in databases.items():
+                    found.setdefault(identifiers[lookup], {}).setdefault(
+                        database,
+                        set(),
+                    ).update(columns)
+
+            for identifier in batch:
+                databases = found.get(identifier, {})
+                for database, columns in sorted(databases.items()):
+                    writer.writerow(
+                        (
+                            batch[identifier],
+                            database,
+                            ";".join(sorted(columns)),
+                        ),
+                    )
+                    matches += 1
+
+            out.flush()
+            processed += len(batch)
+            if progress_callback:
+                progress_callback(processed, matches)
+
+    elapsed = time.perf_counter() - started
+    return processed, matches, processed / elapsed if elapsed else 0
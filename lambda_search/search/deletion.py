@@ -0,0 +1,146 @@
+import json
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from search.partitions import (
+    create_partition,
+    drop_partition,
+    estimate_partition_rows,
+    is_partitioned,
+)
+
+__all__ = ()
+
+
+def estimate_row_count(database) -> dict:
+    """
+    Примерное число строк утечки по моделям для подтверждения удаления.
+    Ячейки на PostgreSQL оцениваются по статистике секции, остальное —
+    по оценке планировщика; строки при этом не читаются.
+    """
+    from search.models import Data, DataRecord
+
+    cells = estimate_partition_rows(database)
+    if cells is None:
+        cells = _estimate_rows(
+            Data.objects.filter(**{Data.database.field.name: database}),
+        )
+
+    return {
+        Data: cells,
+        DataRecord: _estimate_rows(
+            DataRecord.objects.filter(
+                **{DataRecord.database.field.name: database},
+            ),
+        ),
+    }
+
+
+def _estimate_rows(queryset) -> int:
+    """
+    Оценка планировщика PostgreSQL (EXPLAIN) по статистике столбцов
+    или, на остальных бэкендах, COUNT не более
+    settings.ROW_COUNT_ESTIMATE_LIMIT строк
+    """
+    if connections[queryset.db].vendor == "postgresql":
+        plan = json.loads(queryset.explain(format="json"))
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    return queryset[: settings.ROW_COUNT_ESTIMATE_LIMIT].count()
+
+
+def delete_database(database_id, batch_size=None, progress_callback=None):
+    """
+    Удаляет утечку, помеченную schedule_deletion: секцию Data целиком
+    (на PostgreSQL) или строки Data порциями, затем порциями сводки
+    записей вместе с их ключами поиска и в конце саму утечку. Каждая
+    порция — отдельная транзакция, прерванное удаление можно запустить
+    заново. progress_callback(удалено, всего). Возвращает число
+    удалённых строк.
+    """
+    from search.models import Data, DataRecord, ManagedDatabase
+
+    batch_size = batch_size or settings.BATCH_SIZE
+    database = ManagedDatabase.objects.get(pk=database_id)
+    if not database.is_deleting:
+        raise ValueError("Утечка не помечена для удаления")
+
+    estimate = estimate_row_count(database)
+    total = sum(estimate.values())
+    deleted = 0
+    querysets = [
+        DataRecord.objects.filter(
+            **{DataRecord.database.field.name: database},
+        ),
+    ]
+    if is_partitioned():
+        drop_partition(database)
+        deleted += estimate[Data]
+    else:
+        querysets.insert(
+            0,
+            Data.objects.filter(**{Data.database.field.name: database}),
+        )
+
+    for queryset in querysets:
+        for count in delete_in_chunks(queryset, batch_size):
+            deleted += count
+            if progress_callback:
+                progress_callback(deleted, max(total, deleted))
+
+    with transaction.atomic():
+        database.delete()
+
+    return deleted
+
+
+def discard_loaded_rows(database, batch_size=None):
+    """
+    Удаляет строки незавершённой загрузки утечки (промежуточную
+    таблицу, ячейки, сводки) и её контрольную точку, чтобы загрузить
+    утечку заново
+    """
+    from search.models import Data, DataRecord, ManagedDatabase
+    from search.staging import StagingTable
+
+    batch_size = batch_size or settings.BATCH_SIZE
+    StagingTable(database).drop()
+    querysets = [
+        DataRecord.objects.filter(
+            **{DataRecord.database.field.name: database},
+        ),
+    ]
+    if is_partitioned():
+        drop_partition(database)
+        create_partition(database)
+    else:
+        querysets.append(
+            Data.objects.filter(**{Data.database.field.name: database}),
+        )
+
+    for queryset in querysets:
+        for _count in delete_in_chunks(queryset, batch_size):
+            pass
+
+    ManagedDatabase.objects.filter(pk=database.pk).update(
+        checkpoint=None,
+        columns=None,
+    )
+
+
+def delete_in_chunks(queryset, batch_size):
+    """
+    DELETE порциями первичных ключей, отдаёт размеры порций. У Data нет
+    зависимых строк, порция удаляется одним запросом; ключи поиска
+    сводок удаляются каскадом вместе с порцией сводок.
+    """
+    while True:
+        pks = list(queryset.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return
+
+        with transaction.atomic():
+            queryset.model.objects.filter(pk__in=pks).delete()
+
+        yield len(pks)
@@ -1,42 +1,154 @@
+import hmac
 from pathlib import Path
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import algorithms, Cipher, modes
+from django.conf import settings
 
-from search.handlers import CSVHandler, SQLiteHandler
+from search.handlers import (
+    CompressedCSVHandler,
+    CSVHandler,
+    JSONLinesHandler,
+    SQLiteHandler,
+)
 
 __all__ = ()
 
 
 class CellEncryptor:
+    BLOCK_SIZE = 16
+    LOOKUP_SIZE = 16
+
     def __init__(self, key: bytes):
         self.key = key
         self.iv = key[:16]
-
-    def encrypt(self, data: str) -> str:
-        cipher = Cipher(
+        self.lookup_key = hmac.digest(key, b"search-lookup", "sha256")
+        self.domain_lookup_key = hmac.digest(
+            key,
+            b"search-domain-lookup",
+            "sha256",
+        )
+        self.cipher = Cipher(
             algorithms.AES(self.key),
             modes.CBC(self.iv),
             backend=default_backend(),
         )
-        encryptor = cipher.encryptor()
-        padded_data = self._pad(data.encode())
-        encrypted = encryptor.update(padded_data) + encryptor.finalize()
-        return encrypted.hex()
-
-    def decrypt(self, encrypted_data: str) -> str:
-        cipher = Cipher(
+        self.block_cipher = Cipher(
             algorithms.AES(self.key),
-            modes.CBC(self.iv),
+            modes.ECB(),
             backend=default_backend(),
         )
-        decryptor = cipher.decryptor()
+
+    def encrypt(self, data: str) -> bytes:
+        encryptor = self.cipher.encryptor()
+        padded_data = self._pad(data.encode())
+        return encryptor.update(padded_data) + encryptor.finalize()
+
+    def decrypt(self, encrypted_data: bytes) -> str:
+        decryptor = self.cipher.decryptor()
         decrypted = (
-            decryptor.update(bytes.fromhex(encrypted_data))
-            + decryptor.finalize()
+            decryptor.update(bytes(encrypted_data)) + decryptor.finalize()
         )
         return self._unpad(decrypted).decode()
 
+    def encrypt_many(self, values) -> list:
+        """
+        Шифрует последовательность строк, результат побайтно совпадает
+        с [encrypt(value) for value in values].
+        CBC с общим IV шифруется «по столбцам»: i-е блоки всех значений
+        обрабатываются одним вызовом AES-ECB, а сцепление с предыдущим
+        блоком выполняется одним XOR над склеенными блоками.
+        """
+        size = self.BLOCK_SIZE
+        padded = [self._pad(value.encode()) for value in values]
+        order = sorted(
+            range(len(padded)),
+            key=lambda index: len(padded[index]),
+            reverse=True,
+        )
+        padded = [padded[index] for index in order]
+        encryptor = self.block_cipher.encryptor()
+        previous = [self.iv] * len(padded)
+        encrypted = [[] for _ in padded]
+        active = len(padded)
+
+        for offset in range(0, len(padded[0]) if padded else 0, size):
+            while len(padded[active - 1]) <= offset:
+                active -= 1
+
+            blocks = self._xor(
+                b"".join(
+                    [
+                        value[offset : offset + size]
+                        for value in padded[:active]
+                    ],
+                ),
+                b"".join(previous[:active]),
+            )
+            ciphertext = encryptor.update(blocks)
+            previous = [
+                ciphertext[position : position + size]
+                for position in range(0, len(ciphertext), size)
+            ]
+            for block, chunks in zip(previous, encrypted):
+                chunks.append(block)
+
+        result = [None] * len(padded)
+        for index, chunks in zip(order, encrypted):
+            result[index] = b"".join(chunks)
+
+        return result
+
+    def decrypt_many(self, encrypted_values) -> list:
+        """
+        Расшифровывает последовательность шифротекстов одним вызовом
+        AES-ECB: в CBC каждый блок открытого текста зависит только
+        от своего и предыдущего блоков шифротекста.
+        """
+        size = self.BLOCK_SIZE
+        encrypted = [bytes(value) for value in encrypted_values]
+        decryptor = self.block_cipher.decryptor()
+        decrypted = self._xor(
+            decryptor.update(b"".join(encrypted)),
+            b"".join(self.iv + value[:-size] for value in encrypted),
+        )
+
+        result = []
+        position = 0
+        for value in encrypted:
+            result.append(
+                self._unpad(
+                    decrypted[position : position + len(value)],
+                ).decode(),
+            )
+            position += len(value)
+
+        return result
+
+    def lookup(self, data: str) -> bytes:
+        """
+        Ключ поиска (blind index): усечённый HMAC-SHA256 нормализованного
+        значения на ключе, производном от ключа шифрования. Фиксированной
+        длины и не раскрывает значение без ключа.
+        """
+        return hmac.digest(self.lookup_key, data.encode(), "sha256")[
+            : self.LOOKUP_SIZE
+        ]
+
+    def lookup_many(self, values) -> list:
+        return [self.lookup(value) for value in values]
+
+    def domain_lookup(self, domain: str) -> bytes:
+        """Ключ поиска по домену email, на отдельном производном ключе"""
+        return hmac.digest(self.domain_lookup_key, domain.encode(), "sha256")[
+            : self.LOOKUP_SIZE
+        ]
+
+    def _xor(self, left: bytes, right: bytes) -> bytes:
+        return (
+            int.from_bytes(left, "big") ^ int.from_bytes(right, "big")
+        ).to_bytes(len(left), "big")
+
     def _pad(self, data: bytes, block_size=16):
         padding_len = block_size - len(data) % block_size
         return data + bytes([padding_len] * padding_len)
@@ -46,16 +158,137 @@ class CellEncryptor:
         return data[:-padding_len]
 
 
+class KeyRing:
+    """
+    Шифраторы по версиям ключа. Новые данные шифруются текущим ключом,
+    предыдущий нужен, пока ротация не перешифровала всё, что им
+    зашифровано.
+    """
+
+    # Токены, выданные до появления версий, зашифрованы первым ключом
+    LEGACY_VERSION = 1
+    TOKEN_SEPARATOR = "-"
+
+    def __init__(self, keys: dict, version: int):
+        self.version = version
+        self.encryptors = {
+            key_version: CellEncryptor(key)
+            for key_version, key in keys.items()
+        }
+
+    @classmethod
+    def from_settings(cls):
+        keys = {settings.ENCRYPTION_KEY_VERSION: settings.ENCRYPTION_KEY}
+        if settings.PREVIOUS_ENCRYPTION_KEY:
+            keys[settings.ENCRYPTION_KEY_VERSION - 1] = (
+                settings.PREVIOUS_ENCRYPTION_KEY
+            )
+
+        return cls(keys, settings.ENCRYPTION_KEY_VERSION)
+
+    @property
+    def current(self) -> CellEncryptor:
+        return self.encryptors[self.version]
+
+    def get(self, version: int) -> CellEncryptor:
+        try:
+            return self.encryptors[version]
+        except KeyError:
+            raise ValueError(f"Ключ шифрования версии {version} не задан")
+
+    def lookups(self, value: str) -> list:
+        """Ключи поиска значения на всех ключах, текущий — первым"""
+        return [encryptor.lookup(value) for encryptor in self._probed()]
+
+    def domain_lookups(self, domain: str) -> list:
+        return [
+            encryptor.domain_lookup(domain) for encryptor in self._probed()
+        ]
+
+    def encrypt_token(self, value: str) -> str:
+        """
+        Шифротекст для URL и истории запросов: номер версии ключа
+        и шестнадцатеричный шифротекст
+        """
+        return (
+            f"{self.version}{self.TOKEN_SEPARATOR}"
+            f"{self.current.encrypt(value).hex()}"
+        )
+
+    def decrypt_token(self, token: str) -> str:
+        return self.decrypt_tokens([token])[0]
+
+    def decrypt_tokens(self, tokens) -> list:
+        """Расшифровывает токены, по одному вызову на версию ключа"""
+        parsed = [self.token_version(token) for token in tokens]
+        by_version = {}
+        for index, (version, encrypted) in enumerate(parsed):
+            by_version.setdefault(version, []).append((index, encrypted))
+
+        result = [None] * len(parsed)
+        for version, items in by_version.items():
+            values = self.get(version).decrypt_many(
+                encrypted for _index, encrypted in items
+            )
+            for (index, _encrypted), value in zip(items, values):
+                result[index] = value
+
+        return result
+
+    def token_version(self, token: str) -> tuple:
+        """(версия ключа, шифротекст) токена; ValueError, если он испорчен"""
+        version, separator, encrypted = token.rpartition(
+            self.TOKEN_SEPARATOR,
+        )
+        encrypted = bytes.fromhex(encrypted)
+        if not encrypted or len(encrypted) % CellEncryptor.BLOCK_SIZE:
+            raise ValueError("Некорректный шифротекст")
+
+        return (int(version) if separator else self.LEGACY_VERSION), encrypted
+
+    def _probed(self):
+        yield self.current
+        for version, encryptor in self.encryptors.items():
+            if version != self.version:
+                yield encryptor
+
+
+def as_lookups(lookup) -> list:
+    """Один ключ поиска или ключи значения на всех версиях ключа"""
+    if isinstance(lookup, (bytes, memoryview)):
+        return [lookup]
+
+    return list(lookup)
+
+
+HANDLERS = {
+    ".sqlite": SQLiteHandler,
+    ".db": SQLiteHandler,
+    ".csv": CSVHandler,
+    ".csv.gz": CompressedCSVHandler,
+    ".csv.bz2": CompressedCSVHandler,
+    ".csv.xz": CompressedCSVHandler,
+    ".jsonl": JSONLinesHandler,
+    ".ndjson": JSONLinesHandler,
+}
+
+
+def get_file_extension(filename: str):
+    """
+    Возвращает поддерживаемое расширение файла с учётом составных
+    (.csv.gz) или None.
+    """
+    name = filename.lower()
+    matches = [extension for extension in HANDLERS if name.endswith(extension)]
+    return max(matches, key=len) if matches else None
+
+
 class BaseHandlerManager:
     def __init__(self):
-        self.handlers = {
-            ".sqlite": SQLiteHandler,
-            ".db": SQLiteHandler,
-            ".csv": CSVHandler,
-        }
+        self.handlers = HANDLERS
 
     def get_handler(self, file_path: Path, encryptor=None):
-        handler_class = self.handlers.get(file_path.suffix)
+        handler_class = self.handlers.get(get_file_extension(file_path.name))
         if not handler_class:
             raise ValueError("Неподдерживаемый формат файла.")
 
@@ -72,9 +305,14 @@ class UnifiedEncryptor(BaseHandlerManager):
         self.encryptor = CellEncryptor(key)
         self.handler = self.get_handler(file_path, self.encryptor)
 
-    def encrypt_database_cells(self, progress_callback=None):
+    def encrypt_database_cells(
+        self,
+        progress_callback=None,
+        table=None,
+        lookup_filter=None,
+    ):
         self.handler.validate()
-        self.handler.encrypt(progress_callback)
+        return self.handler.encrypt(progress_callback, table, lookup_filter)
 
 
 class DbsReader(BaseHandlerManager):
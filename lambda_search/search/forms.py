@@ -3,9 +3,10 @@ import re
 from django import forms
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.validators import FileExtensionValidator
 from django.utils.translation import gettext_lazy as _
 
-__all__ = ("SearchForm",)
+__all__ = ("BulkSearchForm", "DomainSearchForm", "SearchForm")
 
 
 def normalize_search_query(value: str) -> str:
@@ -24,6 +25,18 @@ def normalize_search_query(value: str) -> str:
     return value.lower()
 
 
+def get_email_domain(value: str):
+    """Домен email-подобного значения в нижнем регистре или None"""
+    if "@" not in value:
+        return None
+
+    domain = value.rsplit("@", 1)[1].strip().lower()
+    if "." not in domain or not re.fullmatch(r"[\w.-]+", domain):
+        return None
+
+    return domain
+
+
 def validate_length(value):
     if not (8 <= len(value) <= 100):
         raise ValidationError(
@@ -54,3 +67,35 @@ class SearchForm(forms.Form):
     def clean_search_query(self):
         data = self.cleaned_data["search_query"]
         return normalize_search_query(data)
+
+
+class BulkSearchForm(forms.Form):
+    file = forms.FileField(
+        label=_("Список идентификаторов"),
+        help_text=_("По одному email или номеру телефона в строке"),
+        validators=[FileExtensionValidator(["txt", "csv"])],
+        widget=forms.ClearableFileInput(
+            attrs={"class": "form-control", "accept": ".txt,.csv"},
+        ),
+    )
+
+
+class DomainSearchForm(forms.Form):
+    domain = forms.CharField(
+        required=True,
+        label=_("Домен"),
+        max_length=255,
+        widget=forms.TextInput(
+            attrs={
+                "placeholder": _("example.com"),
+                "class": "form-control rounded-end-0",
+            },
+        ),
+    )
+
+    def clean_domain(self):
+        domain = get_email_domain(f"@{self.cleaned_data['domain']}")
+        if not domain:
+            raise ValidationError(_("Введите корректный домен."))
+
+        return domain
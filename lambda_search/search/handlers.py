@@ -1,11 +1,22 @@
 from abc import ABC, abstractmethod
+import bz2
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import csv
+import gzip
+import io
+import json
+import lzma
+import mmap
+import multiprocessing
 from pathlib import Path
 import sqlite3
 
 from django.conf import settings
+from django.db import transaction
 
-from search.forms import normalize_search_query
+from search.forms import get_email_domain, normalize_search_query
+from search.summaries import RecordSummary, save_record_summaries
 
 __all__ = ()
 
@@ -20,36 +31,246 @@ def filter_system_tables(all_tables: list) -> list:
     return [table[0] for table in all_tables if table[0] not in system_tables]
 
 
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def encrypt_rows(encryptor, rows) -> list:
+    """
+    Нормализует и шифрует ячейки порции строк, возвращает
+    [(user_index, column_name, encrypted_value, lookup, domain_lookup), ...];
+    domain_lookup заполняется только у email-подобных значений
+    """
+    cells = [
+        (user_index, column_name, normalize_search_query(value))
+        for user_index, row_cells in rows
+        for column_name, value in row_cells
+    ]
+    values = [value for *_, value in cells]
+    domains = map(get_email_domain, values)
+    return [
+        (
+            user_index,
+            column_name,
+            encrypted_value,
+            lookup,
+            encryptor.domain_lookup(domain) if domain else None,
+        )
+        for (
+            user_index,
+            column_name,
+            _,
+        ), encrypted_value, lookup, domain in zip(
+            cells,
+            encryptor.encrypt_many(values),
+            encryptor.lookup_many(values),
+            domains,
+        )
+    ]
+
+
+_worker_state = {}
+
+
+def _init_pipeline_worker(key: bytes):
+    import django
+
+    django.setup()
+
+    from search.encryptor import CellEncryptor
+
+    _worker_state["encryptor"] = CellEncryptor(key)
+
+
+def _encrypt_rows_in_worker(rows) -> list:
+    return encrypt_rows(_worker_state["encryptor"], rows)
+
+
 class DatabaseHandler(ABC):
-    def __init__(self, encryptor):
+    def __init__(self, encryptor, workers=None):
         self.encryptor = encryptor
+        self.workers = workers or settings.ENCRYPTION_WORKERS
 
     @abstractmethod
     def validate(self):
         pass
 
     @abstractmethod
-    def count_rows(self) -> int:
-        """Возвращает общее количество строк для обработки"""
+    def count_rows(self, exact=False) -> int:
+        """
+        Возвращает количество строк для обработки.
+        По умолчанию — быструю оценку без полного разбора источника,
+        точное значение уточняется по ходу загрузки.
+        """
+        pass
+
+    @abstractmethod
+    def get_managed_database(self):
+        """Возвращает ManagedDatabase, в которую загружаются данные"""
         pass
 
     @abstractmethod
-    def encrypt(self, progress_callback):
+    def iter_rows(self, checkpoint=None):
+        """
+        Лениво отдаёт строки источника в виде
+        (user_index, [(column_name, value), ...], checkpoint),
+        не загружая источник в память целиком.
+        checkpoint — JSON-совместимая позиция сразу после строки:
+        iter_rows(checkpoint) продолжает чтение со следующей строки.
+        """
+        pass
+
+    def iter_chunks(self, checkpoint=None):
+        """
+        Группирует строки в порции (rows, checkpoint) по settings.BATCH_SIZE
+        ячеек, чтобы память и размер вставки оставались ограниченными.
+        """
+        chunk = []
+        cells_count = 0
+        for user_index, cells, row_checkpoint in self.iter_rows(checkpoint):
+            chunk.append((user_index, cells))
+            cells_count += len(cells)
+            if cells_count >= settings.BATCH_SIZE:
+                yield chunk, row_checkpoint
+                chunk = []
+                cells_count = 0
+
+        if chunk:
+            yield chunk, row_checkpoint
+
+    def iter_encrypted_chunks(self, checkpoint=None):
+        """
+        Отдаёт (rows_count, encrypted_cells, checkpoint) для каждой порции
+        в исходном порядке. При workers > 1 шифрование выполняется в пуле
+        процессов, а в работе одновременно находится не более
+        2 * workers порций.
+        """
+        if self.workers <= 1:
+            for chunk, chunk_checkpoint in self.iter_chunks(checkpoint):
+                yield (
+                    len(chunk),
+                    encrypt_rows(self.encryptor, chunk),
+                    chunk_checkpoint,
+                )
+
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_pipeline_worker,
+            initargs=(self.encryptor.key,),
+        ) as executor:
+            pending = deque()
+            for chunk, chunk_checkpoint in self.iter_chunks(checkpoint):
+                pending.append(
+                    (
+                        len(chunk),
+                        executor.submit(_encrypt_rows_in_worker, chunk),
+                        chunk_checkpoint,
+                    ),
+                )
+                if len(pending) >= 2 * self.workers:
+                    rows_count, future, chunk_checkpoint = pending.popleft()
+                    yield rows_count, future.result(), chunk_checkpoint
+
+            while pending:
+                rows_count, future, chunk_checkpoint = pending.popleft()
+                yield rows_count, future.result(), chunk_checkpoint
+
+    def encrypt(self, progress_callback=None, table=None, lookup_filter=None):
         """
         Шифрует данные, вызывая progress_callback(processed_rows)
         после обработки каждой строки.
+        Вставку в Data выполняет только текущий процесс: каждая порция
+        записывается в одной транзакции вместе с контрольной точкой
+        ManagedDatabase.checkpoint, поэтому после сбоя загрузка
+        продолжается с последней порции без дублирования строк.
+        Если задана table, ячейки пишутся в неё вместо Data.
+        Вместе с ячейками пишутся сводки записей (DataRecord), имена
+        столбцов заменяются номерами в словаре ManagedDatabase.columns.
+        Ключи каждой порции добавляются в lookup_filter
+        (IngestionBloomFilter), если он задан.
+        Возвращает точное число обработанных строк.
         """
-        pass
+        from search.loaders import get_data_loader
+        from search.models import ManagedDatabase
+
+        managed_database = self.get_managed_database()
+        loader = get_data_loader(managed_database, table)
+        summary = RecordSummary(managed_database.columns)
+        resume_from = managed_database.checkpoint or {}
+        processed = resume_from.pop("processed", 0)
+
+        for rows_count, cells, checkpoint in self.iter_encrypted_chunks(
+            resume_from or None,
+        ):
+            cells = summary.index_cells(cells)
+            with transaction.atomic():
+                loader.load(cells)
+                save_record_summaries(
+                    managed_database,
+                    summary.summarize(cells),
+                )
+                ManagedDatabase.objects.filter(
+                    pk=managed_database.pk,
+                ).update(
+                    columns=summary.columns,
+                    checkpoint={
+                        **checkpoint,
+                        "processed": processed + rows_count,
+                    },
+                )
+
+            if lookup_filter is not None:
+                lookup_filter.add_chunk(rows_count, cells)
+
+            for _ in range(rows_count):
+                processed += 1
+                if progress_callback:
+                    progress_callback(processed)
+
+        return processed
 
 
 class SQLiteHandler(DatabaseHandler):
-    def __init__(self, db_path: Path, encryptor=None):
-        super().__init__(encryptor)
+    # Источник читается последовательно один раз: отображаем файл в память
+    # целиком и держим небольшой страничный кэш вместо копирования страниц.
+    MMAP_SIZE = 1024 * 1024 * 1024
+    CACHE_SIZE_KIB = 8 * 1024
+
+    def __init__(
+        self,
+        db_path: Path,
+        encryptor=None,
+        workers=None,
+        fetch_size=None,
+    ):
+        super().__init__(encryptor, workers)
         self.db_path = db_path
+        self.fetch_size = fetch_size or settings.SQLITE_FETCH_SIZE
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Открывает источник только для чтения (mode=ro&immutable=1),
+        настраивая pragmas под последовательное сканирование.
+        """
+        conn = sqlite3.connect(
+            f"{self.db_path.resolve().as_uri()}?mode=ro&immutable=1",
+            uri=True,
+        )
+        conn.execute("PRAGMA query_only = 1;")
+        conn.execute(f"PRAGMA mmap_size = {self.MMAP_SIZE};")
+        conn.execute(f"PRAGMA cache_size = -{self.CACHE_SIZE_KIB};")
+        return conn
+
+    def get_tables(self, cursor) -> list:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        return filter_system_tables(cursor.fetchall())
 
     def validate(self):
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self.connect()
             conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
             conn.close()
         except sqlite3.Error:
@@ -57,128 +278,321 @@ class SQLiteHandler(DatabaseHandler):
                 "Файл не является корректной SQLite базой данных.",
             )
 
-    def count_rows(self) -> int:
-        conn = sqlite3.connect(self.db_path)
+    def count_rows(self, exact=False) -> int:
+        conn = self.connect()
         cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = filter_system_tables(cursor.fetchall())
+        tables = self.get_tables(cursor)
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1';",
+        )
+        has_stat = bool(cursor.fetchone()[0])
         total = 0
         for table in tables:
-            cursor.execute(f"SELECT COUNT(*) FROM {table}")
-            total += cursor.fetchone()[0]
+            total += (
+                self._count_table(cursor, table)
+                if exact
+                else self._estimate_table(cursor, table, has_stat)
+            )
 
         conn.close()
         return total
 
-    def encrypt(self, progress_callback):
-        from search.models import Data, ManagedDatabase
+    def _count_table(self, cursor, table) -> int:
+        cursor.execute(f"SELECT COUNT(*) FROM {quote_identifier(table)}")
+        return cursor.fetchone()[0]
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = filter_system_tables(cursor.fetchall())
-        processed = 0
+    def _estimate_table(self, cursor, table, has_stat) -> int:
+        """
+        Берёт число строк из статистики ANALYZE (sqlite_stat1), а без неё —
+        MAX(rowid), который читается по одному пути в B-дереве.
+        """
+        if has_stat:
+            cursor.execute(
+                "SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1;",
+                (table,),
+            )
+            stat = cursor.fetchone()
+            if stat and stat[0]:
+                return int(stat[0].split()[0])
+
+        try:
+            cursor.execute(f"SELECT MAX(rowid) FROM {quote_identifier(table)}")
+        except sqlite3.OperationalError:
+            # WITHOUT ROWID таблица
+            return self._count_table(cursor, table)
 
-        managed_database = ManagedDatabase.objects.get(
+        return cursor.fetchone()[0] or 0
+
+    def get_managed_database(self):
+        from search.models import ManagedDatabase
+
+        return ManagedDatabase.objects.get(
             file__endswith=self.db_path.name,
         )
-        batch = []
 
-        for table in tables:
-            cursor.execute(f"PRAGMA table_info({table});")
-            columns = [col[1] for col in cursor.fetchall()]
-            cursor.execute(f"SELECT rowid, * FROM {table};")
-            rows = cursor.fetchall()
-
-            for row in rows:
-                row_id = row[0]
-                for idx, value in enumerate(row[1:]):
-                    if isinstance(value, str):
-                        encrypted_value = self.encryptor.encrypt(
-                            normalize_search_query(value),
-                        )
-                        batch.append(
-                            Data(
-                                database=managed_database,
-                                user_index=row_id,
-                                column_name=columns[idx],
-                                value=encrypted_value[:255],
-                            ),
-                        )
-
-                if len(batch) >= settings.BATCH_SIZE:
-                    Data.objects.bulk_create(batch)
-                    batch.clear()
+    def iter_rows(self, checkpoint=None):
+        conn = self.connect()
+        cursor = conn.cursor()
+        tables = self.get_tables(cursor)
+        last_rowid = 0
+        if checkpoint:
+            tables = tables[tables.index(checkpoint["table"]) :]
+            last_rowid = checkpoint["rowid"]
 
-                processed += 1
-                progress_callback(processed)
+        try:
+            for table in tables:
+                name = quote_identifier(table)
+                cursor.execute(f"PRAGMA table_info({name});")
+                columns = [col[1] for col in cursor.fetchall()]
+                cursor.execute(
+                    f"SELECT rowid, * FROM {name} "
+                    "WHERE rowid > ? ORDER BY rowid;",
+                    (last_rowid,),
+                )
+                last_rowid = 0
+
+                while rows := cursor.fetchmany(self.fetch_size):
+                    for row in rows:
+                        yield row[0], [
+                            (columns[idx], value)
+                            for idx, value in enumerate(row[1:])
+                            if isinstance(value, str)
+                        ], {"table": table, "rowid": row[0]}
+        finally:
+            conn.close()
 
-        if batch:
-            Data.objects.bulk_create(batch)
-            batch.clear()
 
-        conn.close()
+class LineFileHandler(DatabaseHandler):
+    """
+    Основа для построчных текстовых форматов. Файл читается потоково
+    в бинарном режиме, чтобы tell() давал смещение конца каждой записи
+    для контрольной точки; сжатые файлы распаковываются на лету.
+    """
+
+    # Распаковщики по последнему расширению файла
+    OPENERS = {}
+    # Блок, которым считаются переводы строк в отображённом файле
+    COUNT_BLOCK_SIZE = 4 * 1024 * 1024
+    # Размер и число участков, по которым оценивается большой файл
+    SAMPLE_SIZE = 4 * 1024 * 1024
+    SAMPLES = 8
+
+    def __init__(self, path: Path, encryptor=None, workers=None):
+        super().__init__(encryptor, workers)
+        self.path = path
+
+    def open_source(self):
+        opener = self.OPENERS.get(self.path.suffix.lower())
+        return opener(self.path, "rb") if opener else self.path.open("rb")
+
+    def get_managed_database(self):
+        from search.models import ManagedDatabase
+
+        return ManagedDatabase.objects.get(
+            file__endswith=self.path.name,
+        )
+
+    def count_lines(self) -> int:
+        """Быстро считает или оценивает число строк в файле"""
+        size = self.path.stat().st_size
+        if not size:
+            return 0
+
+        if self.OPENERS.get(self.path.suffix.lower()):
+            return self._estimate_compressed_lines(size)
+
+        with (
+            self.path.open("rb") as file,
+            mmap.mmap(
+                file.fileno(),
+                0,
+                access=mmap.ACCESS_READ,
+            ) as mapped,
+        ):
+            if size > max(
+                settings.ROW_COUNT_SAMPLE_THRESHOLD,
+                self.SAMPLE_SIZE * self.SAMPLES,
+            ):
+                return self._estimate_lines(mapped, size)
+
+            return self._count_lines(mapped, size)
+
+    def _count_lines(self, mapped, size) -> int:
+        """
+        Считает переводы строк в отображённом файле блоками. Прочитанные
+        страницы сразу отдаются ядру, чтобы RSS не рос с размером файла.
+        """
+        lines = 0
+        for start in range(0, size, self.COUNT_BLOCK_SIZE):
+            length = min(self.COUNT_BLOCK_SIZE, size - start)
+            lines += mapped[start : start + length].count(b"\n")
+            if hasattr(mmap, "MADV_DONTNEED"):
+                mapped.madvise(mmap.MADV_DONTNEED, start, length)
+
+        if mapped[size - 1 : size] != b"\n":
+            lines += 1
+
+        return lines
+
+    def _estimate_lines(self, mapped, size) -> int:
+        """
+        Оценивает число строк по средней длине строки
+        в равномерно расположенных участках файла.
+        """
+        step = (size - self.SAMPLE_SIZE) // (self.SAMPLES - 1)
+        newlines = sum(
+            mapped[start : start + self.SAMPLE_SIZE].count(b"\n")
+            for start in range(0, step * self.SAMPLES, step)
+        )
+        sampled = self.SAMPLE_SIZE * self.SAMPLES
+        return max(round(newlines * size / sampled), 1)
+
+    def _estimate_compressed_lines(self, size) -> int:
+        """
+        Распаковывает начало сжатого файла и экстраполирует число строк
+        по доле прочитанных сжатых байт.
+        """
+        sample_size = self.SAMPLE_SIZE * self.SAMPLES
+        with self.path.open("rb") as raw:
+            with self.OPENERS[self.path.suffix.lower()](raw, "rb") as stream:
+                sample = stream.read(sample_size)
+                exhausted = not stream.read(1)
+
+            consumed = raw.tell()
+
+        lines = sample.count(b"\n")
+        if sample and not sample.endswith(b"\n"):
+            lines += 1
 
+        if exhausted or not consumed:
+            return lines
 
-class CSVHandler(DatabaseHandler):
-    def __init__(self, csv_path: Path, encryptor=None):
-        super().__init__(encryptor)
+        return max(round(lines * size / consumed), 1)
+
+
+class CSVHandler(LineFileHandler):
+    def __init__(self, csv_path: Path, encryptor=None, workers=None):
+        super().__init__(csv_path, encryptor, workers)
         self.csv_path = csv_path
 
     def validate(self):
         try:
-            with self.csv_path.open("r", newline="", encoding="utf-8") as file:
-                csv.reader(file)
+            with self.open_source() as file:
+                file.readline().decode("utf-8")
         except Exception as e:
             raise ValueError("Файл не является корректным CSV: " + str(e))
 
-    def count_rows(self) -> int:
-        with self.csv_path.open("r", newline="", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            rows = list(reader)
+    def count_rows(self, exact=False) -> int:
+        if not exact:
+            return max(self.count_lines() - 1, 0)
+
+        with io.TextIOWrapper(
+            self.open_source(),
+            encoding="utf-8",
+            newline="",
+        ) as file:
+            total = sum(1 for _ in csv.reader(file))
+
+        return total - 1 if total else 0
+
+    def iter_rows(self, checkpoint=None):
+        with self.open_source() as infile:
+            reader = csv.reader(line.decode("utf-8") for line in infile)
+            headers = next(reader, [])
+            row_index = 0
+            if checkpoint:
+                infile.seek(checkpoint["offset"])
+                row_index = checkpoint["row"]
+
+            for row in reader:
+                row_index += 1
+                yield row_index, [
+                    (
+                        (
+                            headers[col_index]
+                            if col_index < len(headers)
+                            else f"Column {col_index + 1}"
+                        ),
+                        value,
+                    )
+                    for col_index, value in enumerate(row)
+                    if value
+                ], {"offset": infile.tell(), "row": row_index}
+
 
-        return len(rows) - 1 if rows else 0
+class CompressedCSVHandler(CSVHandler):
+    """CSV, сжатый gzip, bzip2 или xz, распаковывается без временных файлов"""
 
-    def encrypt(self, progress_callback):
-        from search.models import Data, ManagedDatabase
+    OPENERS = {
+        ".gz": gzip.open,
+        ".bz2": bz2.open,
+        ".xz": lzma.open,
+    }
 
-        with self.csv_path.open("r", newline="", encoding="utf-8") as infile:
-            reader = csv.reader(infile)
-            rows = list(reader)
 
-        headers = rows[0] if rows else []
-        processed = 0
-        batch = []
-        managed_database = ManagedDatabase.objects.get(
-            file__endswith=self.csv_path.name,
-        )
+def flatten_record(record: dict, prefix=""):
+    """
+    Разворачивает JSON-объект в пары (column_name, value): вложенные
+    объекты дают имена через точку, из списков берутся скалярные элементы.
+    """
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten_record(value, f"{name}.")
+            continue
+
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, str):
+                if item:
+                    yield name, item
+            elif isinstance(item, (int, float)) and not isinstance(
+                item,
+                bool,
+            ):
+                yield name, str(item)
 
-        for row_index, row in enumerate(rows[1:], start=1):
-            for col_index, value in enumerate(row):
-                if value:
-                    encrypted_value = self.encryptor.encrypt(
-                        normalize_search_query(value),
-                    )
-                    batch.append(
-                        Data(
-                            database=managed_database,
-                            user_index=row_index,
-                            column_name=(
-                                headers[col_index]
-                                if headers
-                                else f"Column {col_index + 1}"
-                            ),
-                            value=encrypted_value[:255],
-                        ),
-                    )
 
-            if len(batch) >= settings.BATCH_SIZE:
-                Data.objects.bulk_create(batch)
-                batch.clear()
+class JSONLinesHandler(LineFileHandler):
+    """JSON Lines / NDJSON: одна запись-объект на строку"""
 
-            processed += 1
-            progress_callback(processed)
+    def validate(self):
+        try:
+            with self.open_source() as file:
+                for line in file:
+                    if line.strip():
+                        json.loads(line)
+                        break
+        except Exception as e:
+            raise ValueError(
+                "Файл не является корректным JSON Lines: " + str(e),
+            )
 
-        if batch:
-            Data.objects.bulk_create(batch)
-            batch.clear()
+    def count_rows(self, exact=False) -> int:
+        if not exact:
+            return self.count_lines()
+
+        with self.open_source() as file:
+            return sum(1 for line in file if line.strip())
+
+    def iter_rows(self, checkpoint=None):
+        with self.open_source() as infile:
+            row_index = 0
+            if checkpoint:
+                infile.seek(checkpoint["offset"])
+                row_index = checkpoint["row"]
+
+            for line in infile:
+                if not line.strip():
+                    continue
+
+                row_index += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+
+                yield row_index, (
+                    list(flatten_record(record))
+                    if isinstance(record, dict)
+                    else []
+                ), {"offset": infile.tell(), "row": row_index}
@@ -0,0 +1,147 @@
+import io
+
+from django.db import connections, router, transaction
+
+__all__ = ()
+
+
+COPY_ESCAPES = str.maketrans(
+    {
+        "\\": "\\\\",
+        "\t": "\\t",
+        "\n": "\\n",
+        "\r": "\\r",
+    },
+)
+
+
+def copy_escape(value) -> str:
+    """Экранирует значение для текстового формата COPY"""
+    if value is None:
+        return "\\N"
+
+    if isinstance(value, (bytes, memoryview)):
+        # bytea в шестнадцатеричном виде, обратная косая черта удваивается
+        return "\\\\x" + bytes(value).hex()
+
+    return str(value).translate(COPY_ESCAPES)
+
+
+def get_loaded_fields() -> list:
+    """Поля Data, которые заполняются при загрузке, в порядке столбцов"""
+    from search.models import Data
+
+    return [
+        Data._meta.get_field(name)
+        for name in (
+            Data.database.field.name,
+            Data.user_index.field.name,
+            Data.column_index.field.name,
+            Data.value.field.name,
+            Data.lookup.field.name,
+            Data.domain_lookup.field.name,
+        )
+    ]
+
+
+def get_loaded_columns(connection) -> str:
+    return ", ".join(
+        connection.ops.quote_name(field.column)
+        for field in get_loaded_fields()
+    )
+
+
+class BulkCreateDataLoader:
+    """
+    Загружает зашифрованные ячейки через Data.objects.bulk_create.
+    Ячейка — кортеж значений get_loaded_fields() без database.
+    """
+
+    def __init__(self, managed_database, using, table=None):
+        self.managed_database = managed_database
+        self.using = using
+        self.table = table
+
+    def get_rows(self, cells):
+        database_id = self.managed_database.pk
+        return ((database_id, *cell) for cell in cells)
+
+    def load(self, cells):
+        from search.models import Data
+
+        attnames = [field.attname for field in get_loaded_fields()]
+        Data.objects.using(self.using).bulk_create(
+            Data(**dict(zip(attnames, row))) for row in self.get_rows(cells)
+        )
+
+
+class InsertDataLoader(BulkCreateDataLoader):
+    """
+    Загружает зашифрованные ячейки в произвольную таблицу
+    со столбцами Data (например, промежуточную) через executemany.
+    """
+
+    def __init__(self, managed_database, using, table):
+        super().__init__(managed_database, using, table)
+        connection = connections[using]
+        placeholders = ", ".join(["%s"] * len(get_loaded_fields()))
+        self.sql = (
+            f"INSERT INTO {connection.ops.quote_name(table)} "
+            f"({get_loaded_columns(connection)}) "
+            f"VALUES ({placeholders})"
+        )
+
+    def load(self, cells):
+        with connections[self.using].cursor() as cursor:
+            cursor.executemany(self.sql, list(self.get_rows(cells)))
+
+
+class CopyDataLoader(BulkCreateDataLoader):
+    """
+    Загружает зашифрованные ячейки в таблицу Data (или промежуточную
+    таблицу с теми же столбцами) через COPY ... FROM STDIN,
+    по одной транзакции на порцию.
+    Не создаёт экземпляры модели и не строит INSERT.
+    """
+
+    def __init__(self, managed_database, using, table):
+        super().__init__(managed_database, using, table)
+        connection = connections[using]
+        self.sql = (
+            f"COPY {connection.ops.quote_name(table)} "
+            f"({get_loaded_columns(connection)}) FROM STDIN"
+        )
+
+    def load(self, cells):
+        buffer = io.StringIO()
+        buffer.writelines(
+            "\t".join(map(copy_escape, row)) + "\n"
+            for row in self.get_rows(cells)
+        )
+        buffer.seek(0)
+
+        with transaction.atomic(using=self.using):
+            with connections[self.using].cursor() as cursor:
+                cursor.copy_expert(self.sql, buffer)
+
+
+def get_data_loader(managed_database, table=None, copy=True):
+    """
+    Возвращает загрузчик для базы, в которую пишется Data:
+    COPY на PostgreSQL, bulk_create на остальных бэкендах.
+    Если задана table, ячейки пишутся в неё, а не в Data.
+    """
+    from search.models import Data
+
+    using = router.db_for_write(Data)
+    if copy and connections[using].vendor == "postgresql":
+        return CopyDataLoader(
+            managed_database,
+            using,
+            table or Data._meta.db_table,
+        )
+
+    if table:
+        return InsertDataLoader(managed_database, using, table)
+
+    return BulkCreateDataLoader(managed_database, using)
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from search.backfill import backfill_lookups
+from search.tasks import backfill_lookups_task
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = "Заполняет ключи поиска у ранее загруженных утечек"  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", type=int, default=None)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.BATCH_SIZE,
+        )
+        parser.add_argument(
+            "--async",
+            action="store_true",
+            dest="use_celery",
+            help="Поставить задачу в очередь Celery",
+        )
+
+    def handle(self, *args, **options):
+        if options["use_celery"]:
+            result = backfill_lookups_task.delay(options["database"])
+            self.stdout.write(f"Queued task {result.id}")
+            return
+
+        updated = backfill_lookups(
+            database_id=options["database"],
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} rows"))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from search.backfill import backfill_record_summaries
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = "Строит сводки записей для ранее загруженных утечек"  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", type=int, default=None)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        created = backfill_record_summaries(
+            database_id=options["database"],
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Created {created} records"))
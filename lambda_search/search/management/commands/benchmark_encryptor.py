@@ -0,0 +1,63 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from search.encryptor import CellEncryptor
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = "Сравнивает поячеечное и пакетное шифрование"  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument("--values", type=int, default=1_000_000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        count = options["values"]
+        batch_size = options["batch_size"]
+        encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        values = [f"user{index}@mail.ru" for index in range(count)]
+
+        started = time.perf_counter()
+        encrypted = [encryptor.encrypt(value) for value in values]
+        per_cell = time.perf_counter() - started
+
+        started = time.perf_counter()
+        encrypted_many = []
+        for start in range(0, count, batch_size):
+            encrypted_many.extend(
+                encryptor.encrypt_many(values[start : start + batch_size]),
+            )
+
+        batched = time.perf_counter() - started
+
+        started = time.perf_counter()
+        decrypted = [encryptor.decrypt(value) for value in encrypted]
+        per_cell_decrypt = time.perf_counter() - started
+
+        started = time.perf_counter()
+        decrypted_many = []
+        for start in range(0, count, batch_size):
+            decrypted_many.extend(
+                encryptor.decrypt_many(encrypted[start : start + batch_size]),
+            )
+
+        batched_decrypt = time.perf_counter() - started
+
+        if encrypted != encrypted_many or decrypted != decrypted_many:
+            self.stderr.write(self.style.ERROR("Outputs differ"))
+            return
+
+        for name, elapsed, base in (
+            ("encrypt", per_cell, per_cell),
+            ("encrypt_many", batched, per_cell),
+            ("decrypt", per_cell_decrypt, per_cell_decrypt),
+            ("decrypt_many", batched_decrypt, per_cell_decrypt),
+        ):
+            self.stdout.write(
+                f"{name}: {count / elapsed:.0f} values/s "
+                f"({base / elapsed:.1f}x)",
+            )
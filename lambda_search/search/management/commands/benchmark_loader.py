@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from search.loaders import BulkCreateDataLoader, get_data_loader
+from search.models import Data, ManagedDatabase
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = "Сравнивает скорость загрузки Data: bulk_create и COPY"  # noqa
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200_000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        batch_size = options["batch_size"]
+        cells = [
+            (
+                index,
+                0,
+                index.to_bytes(32, "big"),
+                index.to_bytes(16, "big"),
+                None,
+            )
+            for index in range(rows)
+        ]
+
+        results = {}
+        loaders = {
+            "bulk_create": lambda db: BulkCreateDataLoader(db, "default"),
+            "copy": get_data_loader,
+        }
+        for name, make_loader in loaders.items():
+            database = ManagedDatabase.objects.create(
+                name=f"benchmark-loader-{name}-{time.time_ns()}",
+                columns=["email"],
+            )
+            loader = make_loader(database)
+            if name == "copy" and type(loader) is BulkCreateDataLoader:
+                self.stdout.write(
+                    self.style.WARNING(
+                        "COPY is only available on PostgreSQL, skipping",
+                    ),
+                )
+                database.delete()
+                continue
+
+            started = time.perf_counter()
+            for start in range(0, rows, batch_size):
+                loader.load(cells[start : start + batch_size])
+
+            elapsed = time.perf_counter() - started
+            results[name] = rows / elapsed
+            self.stdout.write(
+                f"{name}: {rows} rows in {elapsed:.2f}s "
+                f"({results[name]:.0f} rows/s)",
+            )
+
+            with transaction.atomic():
+                Data.objects.filter(database=database).delete()
+                database.delete()
+
+        if len(results) == 2:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    "copy speedup: "
+                    f"{results['copy'] / results['bulk_create']:.1f}x",
+                ),
+            )
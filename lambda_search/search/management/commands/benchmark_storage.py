@@ -0,0 +1,159 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+
+from search.backfill import backfill_record_summaries, pack_records
+from search.encryptor import CellEncryptor
+from search.loaders import get_data_loader
+from search.models import Data, DataRecord, ManagedDatabase, RecordLookup
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = "Сравнивает хранение ячейками и упакованными записями"  # noqa
+
+    def add_arguments(self, parser):
+        parser.add_argument("--records", type=int, default=50_000)
+        parser.add_argument("--columns", type=int, default=5)
+        parser.add_argument("--searches", type=int, default=200)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        records = options["records"]
+        columns = [f"column{index}" for index in range(options["columns"])]
+        batch_size = options["batch_size"]
+        encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        connection = connections[router.db_for_write(Data)]
+
+        database = ManagedDatabase.objects.create(
+            name=f"benchmark-storage-{time.time_ns()}",
+            columns=columns,
+            active=True,
+            is_encrypted=True,
+        )
+        try:
+            data_size = self._table_size(connection, Data)
+            loader = get_data_loader(database)
+            for start in range(0, records, batch_size):
+                keys = [
+                    (user_index, column_index)
+                    for user_index in range(
+                        start,
+                        min(start + batch_size, records),
+                    )
+                    for column_index in range(len(columns))
+                ]
+                values = [
+                    self._value(user_index, columns[column_index])
+                    for user_index, column_index in keys
+                ]
+                loader.load(
+                    [
+                        (*key, encrypted, lookup, None)
+                        for key, encrypted, lookup in zip(
+                            keys,
+                            encryptor.encrypt_many(values),
+                            encryptor.lookup_many(values),
+                        )
+                    ],
+                )
+
+            backfill_record_summaries(database.pk, batch_size)
+            if data_size is not None:
+                data_size = self._table_size(connection, Data) - data_size
+
+            probes = [
+                encryptor.lookup(
+                    self._value(
+                        random.randrange(records),
+                        random.choice(columns),
+                    ),
+                )
+                for _ in range(options["searches"])
+            ]
+            cells_latency = self._search_latency(probes)
+
+            lookup_size = self._table_size(connection, RecordLookup)
+            pack_records(database.pk, batch_size)
+            packed_size = None
+            if lookup_size is not None:
+                packed_size = (
+                    self._table_size(connection, RecordLookup)
+                    - lookup_size
+                    + self._payload_size(connection, database)
+                )
+
+            records_latency = self._search_latency(probes)
+        finally:
+            with transaction.atomic():
+                database.delete()
+
+        for name, size, latency in (
+            ("cells", data_size, cells_latency),
+            ("records", packed_size, records_latency),
+        ):
+            self.stdout.write(
+                f"{name}: "
+                + (
+                    f"{size / 1024 / 1024:.1f} MiB, "
+                    if size is not None
+                    else "size n/a (PostgreSQL only), "
+                )
+                + f"search {statistics.mean(latency):.2f} ms avg, "
+                f"{statistics.quantiles(latency, n=20)[-1]:.2f} ms p95",
+            )
+
+        if data_size and packed_size:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"records take {packed_size / data_size:.0%} of cells",
+                ),
+            )
+
+    def _value(self, user_index, column):
+        return f"user{user_index}-{column}"
+
+    def _table_size(self, connection, model):
+        """Размер таблицы со всеми секциями, индексами и TOAST"""
+        if connection.vendor != "postgresql":
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COALESCE(SUM(pg_total_relation_size(relid)), 0) "
+                "FROM pg_partition_tree(%s::regclass)",
+                [model._meta.db_table],
+            )
+            return cursor.fetchone()[0]
+
+    def _payload_size(self, connection, database):
+        # Сводки записей есть при обоих способах хранения,
+        # упаковка добавляет к ним только payload
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COALESCE(SUM(pg_column_size("
+                f"{quote(DataRecord.payload.field.column)})), 0) "
+                f"FROM {quote(DataRecord._meta.db_table)} "
+                f"WHERE {quote(DataRecord.database.field.column)} = %s",
+                [database.pk],
+            )
+            return cursor.fetchone()[0]
+
+    def _search_latency(self, probes) -> list:
+        latency = []
+        for lookup in probes:
+            started = time.perf_counter()
+            list(DataRecord.objects.search(lookup))
+            latency.append((time.perf_counter() - started) * 1000)
+
+        return latency
@@ -0,0 +1,128 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.utils.crypto import get_random_string
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный тест эндпоинта поиска (WSGI или ASGI)"  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            default="http://127.0.0.1:8000/search/api/",
+        )
+        parser.add_argument("--username", required=True)
+        parser.add_argument("--query", default="user@mail.ru")
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=64)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Число процессов сервера, для пересчёта на один процесс",
+        )
+
+    def handle(self, *args, **options):
+        user = (
+            get_user_model()
+            .objects.filter(
+                username=options["username"],
+            )
+            .first()
+        )
+        if not user:
+            raise CommandError(f"User {options['username']} not found")
+
+        # Сессия создаётся в общем с сервером хранилище сессий
+        client = Client()
+        client.force_login(user)
+        session_id = client.cookies[settings.SESSION_COOKIE_NAME].value
+        csrf_token = get_random_string(32)
+
+        url = urlsplit(options["url"])
+        body = urlencode({"search_query": options["query"]}).encode()
+        request = (
+            f"POST {url.path or '/'} HTTP/1.1\r\n"
+            f"Host: {url.netloc}\r\n"
+            "Content-Type: application/x-www-form-urlencoded\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Cookie: {settings.SESSION_COOKIE_NAME}={session_id}; "
+            f"{settings.CSRF_COOKIE_NAME}={csrf_token}\r\n"
+            f"X-CSRFToken: {csrf_token}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode() + body
+
+        latencies, errors, elapsed = asyncio.run(
+            self.run(
+                url,
+                request,
+                options["requests"],
+                options["concurrency"],
+            ),
+        )
+
+        completed = len(latencies)
+        rate = completed / elapsed if elapsed else 0
+        self.stdout.write(
+            f"{completed} requests, {errors} errors, "
+            f"concurrency {options['concurrency']}, {elapsed:.2f}s",
+        )
+        self.stdout.write(
+            f"{rate:.1f} req/s, "
+            f"{rate / options['workers']:.1f} req/s per worker",
+        )
+        if completed > 1:
+            quantiles = statistics.quantiles(latencies, n=100)
+            self.stdout.write(
+                f"latency p50 {quantiles[49] * 1000:.0f}ms, "
+                f"p95 {quantiles[94] * 1000:.0f}ms, "
+                f"p99 {quantiles[98] * 1000:.0f}ms",
+            )
+
+    async def run(self, url, request, total, concurrency):
+        latencies = []
+        errors = 0
+        remaining = iter(range(total))
+
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    status = await self.send(url, request)
+                except OSError:
+                    status = None
+
+                if status == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+    async def send(self, url, request) -> int:
+        port = url.port or (443 if url.scheme == "https" else 80)
+        reader, writer = await asyncio.open_connection(
+            url.hostname,
+            port,
+            ssl=url.scheme == "https" or None,
+        )
+        try:
+            writer.write(request)
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+
+        return int(response.split(b" ", 2)[1])
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from search.backfill import pack_records
+from search.models import ManagedDatabase
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = "Переводит утечки на хранение упакованными записями"  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", type=int, default=None)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        databases = ManagedDatabase.objects.filter(
+            **{
+                ManagedDatabase.is_encrypted.field.name: True,
+                ManagedDatabase.storage.field.name: (
+                    ManagedDatabase.STORAGE_CELLS
+                ),
+            },
+        )
+        if options["database"] is not None:
+            databases = databases.filter(pk=options["database"])
+
+        for database_id in databases.values_list("pk", flat=True):
+            try:
+                packed = pack_records(
+                    database_id,
+                    batch_size=options["batch_size"],
+                )
+            except ValueError as e:
+                raise CommandError(f"{database_id}: {e}")
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{database_id}: packed {packed} records",
+                ),
+            )
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from search.models import ManagedDatabase
+from search.rotation import rotate_database_key, rotate_query_history
+from search.tasks import rotate_keys_task
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = "Перешифровывает утечки и историю текущим ключом"  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", type=int, default=None)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.BATCH_SIZE,
+        )
+        parser.add_argument(
+            "--async",
+            action="store_true",
+            dest="use_celery",
+            help="Перешифровать утечки параллельно задачами Celery",
+        )
+
+    def handle(self, *args, **options):
+        if options["use_celery"]:
+            result = rotate_keys_task.delay()
+            self.stdout.write(f"Queued task {result.id}")
+            return
+
+        databases = ManagedDatabase.objects.filter(
+            **{ManagedDatabase.is_encrypted.field.name: True},
+        ).exclude(
+            **{
+                ManagedDatabase.key_version.field.name: (
+                    settings.ENCRYPTION_KEY_VERSION
+                ),
+            },
+        )
+        if options["database"] is not None:
+            databases = databases.filter(pk=options["database"])
+
+        for database_id in databases.values_list("pk", flat=True):
+            try:
+                rotated = rotate_database_key(
+                    database_id,
+                    batch_size=options["batch_size"],
+                )
+            except ValueError as e:
+                raise CommandError(f"{database_id}: {e}")
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{database_id}: re-encrypted {rotated} records",
+                ),
+            )
+
+        if options["database"] is None:
+            updated = rotate_query_history(batch_size=options["batch_size"])
+            self.stdout.write(
+                self.style.SUCCESS(f"Re-encrypted {updated} history queries"),
+            )
@@ -1,91 +1,420 @@
 from django.db import models
 
+from search.encryptor import as_lookups
+from search.summaries import decode_columns, merge_masks
+
 __all__ = ()
 
 
-class DataMagager(models.Manager):
+class ActiveDatabaseMixin:
+    """Строки моделей с полем database только из активных утечек"""
+
     def _active(self):
-        from search.models import Data, ManagedDatabase
+        from search.models import ManagedDatabase
 
+        database = self.model.database.field.name
         return (
             self.get_queryset()
             .filter(
                 **{
-                    f"{Data.database.field.name}__"
-                    f"{ManagedDatabase.active.field.name}": True,
-                    f"{Data.database.field.name}__"
+                    f"{database}__{ManagedDatabase.active.field.name}": True,
+                    f"{database}__"
                     f"{ManagedDatabase.is_encrypted.field.name}": True,
                 },
             )
+            .order_by(f"{database}__{ManagedDatabase.name.field.name}")
+        )
+
+
+class DataMagager(ActiveDatabaseMixin, models.Manager):
+
+    def _search_value(self, lookup):
+        """
+        Совпадения ключа поиска в записи, на которую ссылается внешний
+        запрос: коррелированный подзапрос по (database, user_index)
+        """
+        from search.models import Data
+
+        return self.get_queryset().filter(
+            **{
+                f"{Data.lookup.field.name}__in": as_lookups(lookup),
+                Data.database.field.name: models.OuterRef(
+                    Data.database.field.name,
+                ),
+                Data.user_index.field.name: models.OuterRef(
+                    Data.user_index.field.name,
+                ),
+            },
+        )
+
+    def _search(self, matches):
+        from search.models import Data, ManagedDatabase
+
+        return (
+            self._active()
+            .filter(models.Exists(matches))
             .order_by(
                 f"{Data.database.field.name}__"
                 f"{ManagedDatabase.name.field.name}",
+                Data.user_index.field.name,
             )
         )
 
-    def _search_value(self, input_data):
-        from search.models import Data
+    def search(self, lookup):
+        """
+        Записи утечек, в которых есть значение с ключом поиска lookup.
+        Выполняется одним запросом: поиск записей и выборка их ячеек
+        объединены полусоединением EXISTS. Утечки, фильтр Блума которых
+        исключает ключ, не запрашиваются; если таких не осталось,
+        запрос к базе не выполняется. Ячейки есть только у утечек,
+        хранящихся по ячейкам: упакованные записи находит
+        DataRecord.objects.search. Во время ротации ключа шифрования
+        передаются ключи поиска значения на обеих версиях
+        (KeyRing.lookups).
+        """
+        from search.bloom import get_candidate_databases
+        from search.models import Data, ManagedDatabase
+
+        databases = get_candidate_databases(lookup)
+        if not databases:
+            return self.none()
+
+        return (
+            self._search(self._search_value(lookup))
+            .filter(**{f"{Data.database.field.name}__in": databases})
+            .select_related(Data.database.field.name)
+            .only(
+                f"{Data.database.field.name}__"
+                f"{ManagedDatabase.name.field.name}",
+                f"{Data.database.field.name}__"
+                f"{ManagedDatabase.history.field.name}",
+                Data.database.field.name,
+                Data.user_index.field.name,
+                f"{Data.database.field.name}__"
+                f"{ManagedDatabase.columns.field.name}",
+                Data.column_index.field.name,
+                Data.value.field.name,
+            )
+        )
+
+    def search_databases(self, lookup, bloom_filters=None):
+        """
+        Активные утечки, в которых есть значение с ключом поиска lookup,
+        по имени. Срез набора выполняется в базе (LIMIT/OFFSET), поэтому
+        результаты можно выводить постранично, не находя все записи.
+        """
+        from search.bloom import get_candidate_databases
+        from search.models import (
+            Data,
+            DataRecord,
+            ManagedDatabase,
+            RecordLookup,
+        )
+
+        databases = get_candidate_databases(lookup, bloom_filters)
+        if not databases:
+            return ManagedDatabase.objects.none()
 
+        matches = (
+            self.get_queryset()
+            .filter(
+                **{
+                    f"{Data.lookup.field.name}__in": as_lookups(lookup),
+                    f"{Data.database.field.name}__in": databases,
+                },
+            )
+            .values(Data.database.field.attname)
+            .union(
+                RecordLookup.objects.filter(
+                    **{
+                        f"{RecordLookup.lookup.field.name}__in": as_lookups(
+                            lookup,
+                        ),
+                        f"{RecordLookup.record.field.name}__"
+                        f"{DataRecord.database.field.name}__in": databases,
+                    },
+                ).values(
+                    f"{RecordLookup.record.field.name}__"
+                    f"{DataRecord.database.field.attname}",
+                ),
+                all=True,
+            )
+        )
         return (
+            ManagedDatabase.objects.filter(
+                pk__in=matches,
+                **{
+                    ManagedDatabase.active.field.name: True,
+                    ManagedDatabase.is_encrypted.field.name: True,
+                },
+            )
+            .order_by(ManagedDatabase.name.field.name, "pk")
+            .only(ManagedDatabase.name.field.name)
+        )
+
+    def search_many(self, lookups) -> dict:
+        """
+        Пакетный поиск: {lookup: {имя утечки: {столбцы записи}}}.
+        Два запроса на весь пакет независимо от его размера: совпадения
+        ключей (в ячейках и в упакованных записях) и сводки найденных
+        записей.
+        """
+        from search.bloom import get_bloom_filters, get_candidate_databases
+        from search.models import (
+            Data,
+            DataRecord,
+            ManagedDatabase,
+            RecordLookup,
+        )
+
+        bloom_filters = get_bloom_filters()
+        databases = set()
+        for lookup in set(lookups):
+            databases.update(get_candidate_databases(lookup, bloom_filters))
+
+        if not databases:
+            return {}
+
+        matches = (
             self._active()
             .filter(
                 **{
-                    f"{Data.value.field.name}__iexact": input_data,
+                    f"{Data.lookup.field.name}__in": lookups,
+                    f"{Data.database.field.name}__in": databases,
                 },
             )
-            .values(
-                Data.database.field.name,
-                Data.user_index.field.name,
+            .order_by()
+        )
+        record = RecordLookup.record.field.name
+        packed = RecordLookup.objects.filter(
+            **{
+                f"{RecordLookup.lookup.field.name}__in": lookups,
+                f"{record}__{DataRecord.database.field.name}__in": databases,
+            },
+        )
+        hits = {}
+        for lookup, database_id, user_index in matches.values_list(
+            Data.lookup.field.name,
+            Data.database.field.attname,
+            Data.user_index.field.name,
+        ).union(
+            packed.values_list(
+                RecordLookup.lookup.field.name,
+                f"{record}__{DataRecord.database.field.attname}",
+                f"{record}__{DataRecord.user_index.field.name}",
+            ),
+            all=True,
+        ):
+            hits.setdefault((database_id, user_index), set()).add(
+                bytes(lookup),
+            )
+
+        if not hits:
+            return {}
+
+        records = (
+            DataRecord.objects._active()
+            .filter(
+                pk__in=DataRecord.objects._matching(
+                    matches.filter(
+                        **{
+                            Data.database.field.name: models.OuterRef(
+                                DataRecord.database.field.name,
+                            ),
+                            Data.user_index.field.name: models.OuterRef(
+                                DataRecord.user_index.field.name,
+                            ),
+                        },
+                    ),
+                    lookups,
+                    databases,
+                ),
+            )
+            .values_list(
+                DataRecord.database.field.attname,
+                DataRecord.user_index.field.name,
+                f"{DataRecord.database.field.name}__"
+                f"{ManagedDatabase.name.field.name}",
+                f"{DataRecord.database.field.name}__"
+                f"{ManagedDatabase.columns.field.name}",
+                DataRecord.columns.field.name,
             )
-            .distinct()
+            .order_by()
         )
+        results = {}
+        for database_id, user_index, name, columns, mask in records:
+            column_names = decode_columns(columns or [], bytes(mask))
+            for lookup in hits[database_id, user_index]:
+                results.setdefault(lookup, {}).setdefault(
+                    name,
+                    set(),
+                ).update(column_names)
 
-    def _search(self, indexes):
-        from search.models import Data, ManagedDatabase
+        return results
+
+
+class DataRecordManager(ActiveDatabaseMixin, models.Manager):
+    def _matching(self, cell_matches, lookups, databases=None):
+        """
+        Идентификаторы записей с совпадениями: по ячейкам Data
+        (cell_matches коррелирован по database и user_index) и по ключам
+        упакованных записей в RecordLookup. Части объединяются UNION ALL,
+        чтобы каждая использовала свой индекс.
+        """
+        from search.models import DataRecord, RecordLookup
 
-        query = models.Q()
-        for index in indexes:
-            query |= models.Q(
+        cells = self.get_queryset().filter(models.Exists(cell_matches))
+        packed = RecordLookup.objects.filter(
+            **{f"{RecordLookup.lookup.field.name}__in": lookups},
+        )
+        if databases is not None:
+            cells = cells.filter(
+                **{f"{DataRecord.database.field.name}__in": databases},
+            )
+            packed = packed.filter(
                 **{
-                    Data.database.field.name: index[Data.database.field.name],
-                    Data.user_index.field.name: index[
-                        Data.user_index.field.name
-                    ],
+                    f"{RecordLookup.record.field.name}__"
+                    f"{DataRecord.database.field.name}__in": databases,
                 },
             )
 
-        if not indexes:
+        return cells.values("pk").union(
+            packed.values(RecordLookup.record.field.attname),
+            all=True,
+        )
+
+    def _summaries(self, queryset):
+        from search.models import DataRecord, ManagedDatabase
+
+        return queryset.select_related(DataRecord.database.field.name).only(
+            f"{DataRecord.database.field.name}__"
+            f"{ManagedDatabase.name.field.name}",
+            f"{DataRecord.database.field.name}__"
+            f"{ManagedDatabase.history.field.name}",
+            f"{DataRecord.database.field.name}__"
+            f"{ManagedDatabase.columns.field.name}",
+            DataRecord.database.field.name,
+            DataRecord.user_index.field.name,
+            DataRecord.columns.field.name,
+        )
+
+    def search(self, lookup, bloom_filters=None):
+        """
+        Сводки записей утечек, в которых есть значение с ключом поиска
+        lookup: одна строка на найденную запись вместо всех её ячеек.
+        Записи упакованных утечек находятся через RecordLookup.
+        bloom_filters — уже загруженные фильтры (для асинхронного пути).
+        """
+        from search.bloom import get_candidate_databases
+        from search.models import Data, DataRecord, ManagedDatabase
+
+        databases = get_candidate_databases(lookup, bloom_filters)
+        if not databases:
             return self.none()
 
-        return (
+        return self._summaries(
             self._active()
-            .filter(query)
+            .filter(
+                pk__in=self._matching(
+                    Data.objects._search_value(lookup),
+                    as_lookups(lookup),
+                    databases,
+                ),
+            )
             .order_by(
-                f"{Data.database.field.name}__"
+                f"{DataRecord.database.field.name}__"
                 f"{ManagedDatabase.name.field.name}",
-                Data.user_index.field.name,
+                DataRecord.user_index.field.name,
+            ),
+        )
+
+    def _domain_matching(self, domain_lookup):
+        """
+        Идентификаторы записей с email домена. Проверяются только утечки,
+        в которых ключ домена есть в частичном индексе Data или
+        в RecordLookup, а не все сводки.
+        """
+        from search.models import Data, DataRecord, RecordLookup
+
+        lookups = as_lookups(domain_lookup)
+        databases = (
+            Data.objects.filter(
+                **{f"{Data.domain_lookup.field.name}__in": lookups},
+            )
+            .values(Data.database.field.attname)
+            .union(
+                RecordLookup.objects.filter(
+                    **{f"{RecordLookup.lookup.field.name}__in": lookups},
+                ).values(
+                    f"{RecordLookup.record.field.name}__"
+                    f"{DataRecord.database.field.attname}",
+                ),
             )
         )
+        matches = Data.objects.filter(
+            **{
+                f"{Data.domain_lookup.field.name}__in": lookups,
+                Data.database.field.name: models.OuterRef(
+                    DataRecord.database.field.name,
+                ),
+                Data.user_index.field.name: models.OuterRef(
+                    DataRecord.user_index.field.name,
+                ),
+            },
+        )
+        return self._matching(matches, lookups, databases)
 
-    def search(self, input_data):
-        from search.models import Data, ManagedDatabase
+    def search_domain(self, domain_lookup):
+        """
+        Сводки записей активных утечек, в которых есть email с доменом
+        domain_lookup. Ячейки не читаются и не расшифровываются: записи
+        находятся по частичному индексу ключа домена.
+        """
+        return self._summaries(
+            self._active().filter(
+                pk__in=self._domain_matching(domain_lookup),
+            ),
+        )
 
-        indexes = list(self._search_value(input_data))
+    def count_domain(self, domain_lookup) -> dict:
+        """
+        Итоги поиска по домену по утечкам: {имя утечки: {"history",
+        "records", "columns"}}. Записи считаются в базе группировкой
+        по утечке и маске столбцов: строк результата столько, сколько
+        разных наборов столбцов, а не найденных записей. Маски одной
+        утечки объединяются после выборки.
+        """
+        from search.models import DataRecord, ManagedDatabase
 
-        if not indexes:
-            return self.none()
+        records = {}
+        masks = {}
+        for database_id, mask, count in (
+            self._active()
+            .filter(pk__in=self._domain_matching(domain_lookup))
+            .values_list(
+                DataRecord.database.field.attname,
+                DataRecord.columns.field.name,
+            )
+            .annotate(records=models.Count("pk"))
+            .order_by()
+        ):
+            records[database_id] = records.get(database_id, 0) + count
+            masks.setdefault(database_id, []).append(mask)
 
-        return (
-            self._search(indexes)
-            .select_related(Data.database.field.name)
+        return {
+            database.name: {
+                "history": database.history,
+                "records": records[database.pk],
+                "columns": decode_columns(
+                    database.columns or [],
+                    merge_masks(*masks[database.pk]),
+                ),
+            }
+            for database in ManagedDatabase.objects.filter(pk__in=records)
+            .order_by(ManagedDatabase.name.field.name)
             .only(
-                f"{Data.database.field.name}__"
-                f"{ManagedDatabase.name.field.name}",
-                f"{Data.database.field.name}__"
-                f"{ManagedDatabase.history.field.name}",
-                Data.database.field.name,
-                Data.user_index.field.name,
-                Data.column_name.field.name,
-                Data.value.field.name,
+                ManagedDatabase.name.field.name,
+                ManagedDatabase.history.field.name,
+                ManagedDatabase.columns.field.name,
             )
-        )
+        }
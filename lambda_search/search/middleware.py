@@ -1,5 +1,6 @@
 import re
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import Http404
 
 
@@ -7,12 +8,32 @@ __all__ = ()
 
 
 class ProtectedMediaMiddleware:
+    """
+    Закрывает прямой доступ к загруженным утечкам. Работает и в
+    синхронной, и в асинхронной цепочке, чтобы под ASGI асинхронные
+    представления не переключались в поток из-за этой прослойки.
+    """
+
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
         self.protected_path = re.compile(r"^/media/protected/")
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        if self.protected_path.match(request.path):
-            raise Http404("Доступ запрещен")
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
 
+        self._check_path(request)
         return self.get_response(request)
+
+    async def __acall__(self, request):
+        self._check_path(request)
+        return await self.get_response(request)
+
+    def _check_path(self, request):
+        if self.protected_path.match(request.path):
+            raise Http404("Доступ запрещен")
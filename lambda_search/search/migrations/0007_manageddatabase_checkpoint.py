@@ -0,0 +1,24 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0006_manageddatabase_encryption_started"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="manageddatabase",
+            name="checkpoint",
+            field=models.JSONField(
+                blank=True,
+                editable=False,
+                help_text="Позиция в исходном файле, до которой данные уже загружены",
+                null=True,
+                verbose_name="Контрольная точка шифрования",
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:19
+
+from django.db import migrations, models
+import search.models
+import search.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0007_manageddatabase_checkpoint"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="manageddatabase",
+            name="file",
+            field=models.FileField(
+                blank=True,
+                upload_to=search.models.database_upload_path,
+                validators=[
+                    search.validators.DatabaseFileExtensionValidator(
+                        [
+                            "csv",
+                            "sqlite",
+                            "db",
+                            "csv.gz",
+                            "csv.bz2",
+                            "csv.xz",
+                            "jsonl",
+                            "ndjson",
+                        ]
+                    )
+                ],
+                verbose_name="Файл базы данных",
+            ),
+        ),
+    ]
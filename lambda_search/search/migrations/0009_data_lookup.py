@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0008_alter_manageddatabase_file"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="data",
+            name="lookup",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="HMAC нормализованного значения для точного поиска",
+                max_length=32,
+                null=True,
+                verbose_name="Ключ поиска",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="data",
+            index=models.Index(
+                fields=["lookup", "database", "user_index"],
+                name="search_data_lookup_idx",
+            ),
+        ),
+    ]
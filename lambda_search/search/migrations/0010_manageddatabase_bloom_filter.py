@@ -0,0 +1,22 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0009_data_lookup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="manageddatabase",
+            name="bloom_filter",
+            field=models.BinaryField(
+                blank=True,
+                null=True,
+                verbose_name="Фильтр Блума ключей поиска",
+            ),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:28
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import search.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("search", "0010_manageddatabase_bloom_filter"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BulkSearchJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "file",
+                    models.FileField(
+                        help_text="По одному email или номеру телефона в строке",
+                        upload_to=search.models.bulk_search_upload_path,
+                        validators=[
+                            django.core.validators.FileExtensionValidator(
+                                ["txt", "csv"]
+                            )
+                        ],
+                        verbose_name="Список идентификаторов",
+                    ),
+                ),
+                (
+                    "result",
+                    models.FileField(
+                        blank=True,
+                        editable=False,
+                        upload_to=search.models.bulk_search_upload_path,
+                        verbose_name="Результаты",
+                    ),
+                ),
+                (
+                    "progress_task_id",
+                    models.CharField(
+                        blank=True,
+                        max_length=255,
+                        null=True,
+                        verbose_name="ID задачи поиска",
+                    ),
+                ),
+                (
+                    "identifiers_count",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Проверено идентификаторов"
+                    ),
+                ),
+                (
+                    "matches_count",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Найдено совпадений"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата создания"
+                    ),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Дата завершения"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="bulk_searches",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Пакетный поиск",
+                "verbose_name_plural": "Пакетные поиски",
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0011_bulksearchjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="manageddatabase",
+            name="columns",
+            field=models.JSONField(
+                blank=True,
+                editable=False,
+                help_text="Порядок столбцов в масках сводок записей",
+                null=True,
+                verbose_name="Столбцы утечки",
+            ),
+        ),
+        migrations.CreateModel(
+            name="DataRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "user_index",
+                    models.IntegerField(verbose_name="Индекс пользователя"),
+                ),
+                (
+                    "columns",
+                    models.BinaryField(
+                        help_text="Бит i — столбец ManagedDatabase.columns[i]",
+                        verbose_name="Маска столбцов",
+                    ),
+                ),
+                (
+                    "database",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="records",
+                        to="search.manageddatabase",
+                        verbose_name="Имя базы данных",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Сводка записи",
+                "verbose_name_plural": "Сводки записей",
+                "indexes": [
+                    models.Index(
+                        fields=["database", "user_index"],
+                        name="search_record_user_idx",
+                    )
+                ],
+            },
+        ),
+    ]
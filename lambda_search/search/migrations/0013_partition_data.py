@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from search.partitions import partition_data_table
+
+
+def partition_data(apps, schema_editor):
+    ManagedDatabase = apps.get_model("search", "ManagedDatabase")
+    partition_data_table(
+        schema_editor,
+        ManagedDatabase.objects.values_list("pk", flat=True),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0012_datarecord"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_data, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from search.partitions import attach_partitions_operations
+
+attach_partitions, sync_partitions = attach_partitions_operations()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("search", "0013_partition_data"),
+    ]
+
+    operations = [
+        attach_partitions,
+        migrations.CreateModel(
+            name="DomainOwnership",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "domain",
+                    models.CharField(max_length=255, verbose_name="Домен"),
+                ),
+                (
+                    "verified",
+                    models.BooleanField(
+                        default=False, verbose_name="Подтверждён"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Домен пользователя",
+                "verbose_name_plural": "Домены пользователей",
+            },
+        ),
+        migrations.AddField(
+            model_name="data",
+            name="domain_lookup",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="HMAC домена email-подобного значения",
+                max_length=32,
+                null=True,
+                verbose_name="Ключ поиска по домену",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="data",
+            index=models.Index(
+                condition=models.Q(("domain_lookup__isnull", False)),
+                fields=["domain_lookup", "database", "user_index"],
+                name="search_data_domain_idx",
+            ),
+        ),
+        migrations.AddField(
+            model_name="domainownership",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="domains",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="Пользователь",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="domainownership",
+            unique_together={("user", "domain")},
+        ),
+        sync_partitions,
+    ]
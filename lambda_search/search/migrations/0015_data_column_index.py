@@ -0,0 +1,135 @@
+from django.db import migrations, models, transaction
+
+from search.partitions import attach_partitions_operations
+
+attach_partitions, sync_partitions = attach_partitions_operations()
+
+CHUNK_SIZE = 100_000
+
+
+def _update_in_chunks(data, database, **values):
+    """UPDATE строк утечки окнами по первичному ключу, окно — транзакция"""
+    rows = data.objects.filter(database=database)
+    bounds = rows.aggregate(first=models.Min("id"), last=models.Max("id"))
+    if bounds["first"] is None:
+        return
+
+    for start in range(bounds["first"], bounds["last"] + 1, CHUNK_SIZE):
+        with transaction.atomic():
+            rows.filter(id__gte=start, id__lt=start + CHUNK_SIZE).update(
+                **values,
+            )
+
+
+def index_column_names(apps, schema_editor):
+    """
+    Дописывает имена столбцов ячеек в словарь утечки
+    ManagedDatabase.columns (порядок уже записанных сохраняется,
+    от него зависят маски сводок) и заменяет их номерами.
+    """
+    ManagedDatabase = apps.get_model("search", "ManagedDatabase")
+    Data = apps.get_model("search", "Data")
+    for database in ManagedDatabase.objects.only("columns"):
+        columns = list(database.columns or [])
+        names = (
+            Data.objects.filter(database=database)
+            .order_by()
+            .values_list("column_name", flat=True)
+            .distinct()
+        )
+        columns.extend(sorted(set(names) - set(columns)))
+        if not columns:
+            continue
+
+        ManagedDatabase.objects.filter(pk=database.pk).update(columns=columns)
+        _update_in_chunks(
+            Data,
+            database,
+            column_index=models.Case(
+                *(
+                    models.When(column_name=name, then=index)
+                    for index, name in enumerate(columns)
+                ),
+            ),
+        )
+
+
+def restore_column_names(apps, schema_editor):
+    ManagedDatabase = apps.get_model("search", "ManagedDatabase")
+    Data = apps.get_model("search", "Data")
+    for database in ManagedDatabase.objects.only("columns"):
+        _update_in_chunks(
+            Data,
+            database,
+            column_name=models.Case(
+                *(
+                    models.When(column_index=index, then=models.Value(name))
+                    for index, name in enumerate(database.columns or [])
+                ),
+            ),
+        )
+
+
+class Migration(migrations.Migration):
+    # Порции конвертации фиксируются по отдельности
+    atomic = False
+
+    dependencies = [
+        ("search", "0014_data_domain_lookup"),
+    ]
+
+    operations = [
+        attach_partitions,
+        migrations.AddField(
+            model_name="data",
+            name="column_index",
+            field=models.SmallIntegerField(
+                help_text="Позиция в словаре столбцов ManagedDatabase.columns",
+                null=True,
+                verbose_name="Номер колонки",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="data",
+            name="column_name",
+            field=models.CharField(
+                max_length=255,
+                null=True,
+                verbose_name="Название колонки",
+            ),
+        ),
+        migrations.RunPython(index_column_names, restore_column_names),
+        migrations.AlterUniqueTogether(
+            name="data",
+            unique_together={
+                ("database", "user_index", "column_index", "value"),
+            },
+        ),
+        migrations.RemoveField(
+            model_name="data",
+            name="column_name",
+        ),
+        migrations.AlterField(
+            model_name="data",
+            name="column_index",
+            field=models.SmallIntegerField(
+                help_text="Позиция в словаре столбцов ManagedDatabase.columns",
+                verbose_name="Номер колонки",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="manageddatabase",
+            name="columns",
+            field=models.JSONField(
+                blank=True,
+                editable=False,
+                help_text=(
+                    "Словарь столбцов: номер столбца в Data и бит в масках "
+                    "сводок"
+                ),
+                null=True,
+                verbose_name="Столбцы утечки",
+            ),
+        ),
+        sync_partitions,
+    ]
@@ -0,0 +1,223 @@
+from django.db import migrations, models, transaction
+
+from search.partitions import attach_partitions_operations
+
+attach_partitions, sync_partitions = attach_partitions_operations()
+
+CHUNK_SIZE = 100_000
+
+CONVERTED_FIELDS = (
+    ("value", "binary_value"),
+    ("lookup", "binary_lookup"),
+    ("domain_lookup", "binary_domain_lookup"),
+)
+
+
+def _from_hex(value):
+    # Усечённые при загрузке шифротексты могли иметь нечётную длину
+    if value is None:
+        return None
+
+    return bytes.fromhex(value[: len(value) // 2 * 2])
+
+
+def _to_hex(value):
+    return None if value is None else bytes(value).hex()
+
+
+def _windows(data):
+    bounds = data.objects.aggregate(
+        first=models.Min("id"),
+        last=models.Max("id"),
+    )
+    if bounds["first"] is None:
+        return
+
+    for start in range(bounds["first"], bounds["last"] + 1, CHUNK_SIZE):
+        yield start, start + CHUNK_SIZE
+
+
+def _convert(apps, schema_editor, fields, function, sql):
+    """
+    Переносит значения между текстовыми и двоичными столбцами окнами
+    по первичному ключу, каждое окно — отдельная транзакция.
+    На PostgreSQL окно конвертируется одним UPDATE.
+    """
+    Data = apps.get_model("search", "Data")
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    for start, stop in _windows(Data):
+        with transaction.atomic(using=connection.alias):
+            if connection.vendor == "postgresql":
+                assignments = ", ".join(
+                    f"{quote(target)} = {sql.format(quote(source))}"
+                    for source, target in fields
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"UPDATE {quote(Data._meta.db_table)} "
+                        f"SET {assignments} WHERE id >= %s AND id < %s",
+                        [start, stop],
+                    )
+
+                continue
+
+            rows = list(Data.objects.filter(id__gte=start, id__lt=stop))
+            for row in rows:
+                for source, target in fields:
+                    setattr(row, target, function(getattr(row, source)))
+
+            Data.objects.bulk_update(
+                rows,
+                [target for _, target in fields],
+                batch_size=1000,
+            )
+
+
+def values_to_binary(apps, schema_editor):
+    _convert(
+        apps,
+        schema_editor,
+        CONVERTED_FIELDS,
+        _from_hex,
+        "decode(left({0}, length({0}) / 2 * 2), 'hex')",
+    )
+
+
+def values_to_hex(apps, schema_editor):
+    _convert(
+        apps,
+        schema_editor,
+        [(target, source) for source, target in CONVERTED_FIELDS],
+        _to_hex,
+        "encode({0}, 'hex')",
+    )
+
+
+class Migration(migrations.Migration):
+    # Порции конвертации фиксируются по отдельности
+    atomic = False
+
+    dependencies = [
+        ("search", "0015_data_column_index"),
+    ]
+
+    operations = [
+        attach_partitions,
+        migrations.AddField(
+            model_name="data",
+            name="binary_value",
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name="data",
+            name="binary_lookup",
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name="data",
+            name="binary_domain_lookup",
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="data",
+            name="value",
+            field=models.CharField(
+                max_length=255,
+                null=True,
+                verbose_name="Значение",
+            ),
+        ),
+        migrations.RunPython(values_to_binary, values_to_hex),
+        migrations.RemoveIndex(
+            model_name="data",
+            name="search_data_lookup_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="data",
+            name="search_data_domain_idx",
+        ),
+        migrations.AlterUniqueTogether(
+            name="data",
+            unique_together=set(),
+        ),
+        migrations.RemoveField(
+            model_name="data",
+            name="value",
+        ),
+        migrations.RemoveField(
+            model_name="data",
+            name="lookup",
+        ),
+        migrations.RemoveField(
+            model_name="data",
+            name="domain_lookup",
+        ),
+        migrations.RenameField(
+            model_name="data",
+            old_name="binary_value",
+            new_name="value",
+        ),
+        migrations.RenameField(
+            model_name="data",
+            old_name="binary_lookup",
+            new_name="lookup",
+        ),
+        migrations.RenameField(
+            model_name="data",
+            old_name="binary_domain_lookup",
+            new_name="domain_lookup",
+        ),
+        migrations.AlterField(
+            model_name="data",
+            name="value",
+            field=models.BinaryField(
+                help_text="Шифротекст нормализованного значения",
+                verbose_name="Значение",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="data",
+            name="lookup",
+            field=models.BinaryField(
+                blank=True,
+                help_text="HMAC нормализованного значения для точного поиска",
+                max_length=16,
+                null=True,
+                verbose_name="Ключ поиска",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="data",
+            name="domain_lookup",
+            field=models.BinaryField(
+                blank=True,
+                help_text="HMAC домена email-подобного значения",
+                max_length=16,
+                null=True,
+                verbose_name="Ключ поиска по домену",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="data",
+            unique_together={
+                ("database", "user_index", "column_index", "value"),
+            },
+        ),
+        migrations.AddIndex(
+            model_name="data",
+            index=models.Index(
+                fields=["lookup", "database", "user_index"],
+                name="search_data_lookup_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="data",
+            index=models.Index(
+                condition=models.Q(("domain_lookup__isnull", False)),
+                fields=["domain_lookup", "database", "user_index"],
+                name="search_data_domain_idx",
+            ),
+        ),
+        sync_partitions,
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0016_data_binary_values"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datarecord",
+            name="payload",
+            field=models.BinaryField(
+                blank=True,
+                help_text="Шифротексты ячеек записи при хранении записями",
+                null=True,
+                verbose_name="Упакованные ячейки",
+            ),
+        ),
+        migrations.AddField(
+            model_name="manageddatabase",
+            name="storage",
+            field=models.CharField(
+                choices=[
+                    ("cells", "по ячейкам"),
+                    ("records", "упакованные записи"),
+                ],
+                default="cells",
+                editable=False,
+                help_text="Ячейки в Data или одна строка на запись с упакованными шифротекстами",
+                max_length=20,
+                verbose_name="Хранение",
+            ),
+        ),
+        migrations.CreateModel(
+            name="RecordLookup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "lookup",
+                    models.BinaryField(
+                        max_length=16, verbose_name="Ключ поиска"
+                    ),
+                ),
+                (
+                    "record",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lookups",
+                        to="search.datarecord",
+                        verbose_name="Запись",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Ключ поиска записи",
+                "verbose_name_plural": "Ключи поиска записей",
+                "indexes": [
+                    models.Index(
+                        fields=["lookup", "record"],
+                        name="search_recordlookup_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0017_record_storage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="manageddatabase",
+            name="key_version",
+            field=models.PositiveSmallIntegerField(
+                default=1,
+                editable=False,
+                help_text="Ключ, которым зашифрованы ячейки утечки",
+                verbose_name="Версия ключа шифрования",
+            ),
+        ),
+        migrations.AddField(
+            model_name="manageddatabase",
+            name="rotation_checkpoint",
+            field=models.IntegerField(
+                blank=True,
+                editable=False,
+                help_text="Записи с меньшим user_index уже перешифрованы текущим ключом",
+                null=True,
+                verbose_name="Контрольная точка ротации ключа",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0018_key_rotation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="manageddatabase",
+            name="is_deleting",
+            field=models.BooleanField(
+                default=False,
+                editable=False,
+                help_text="Утечка скрыта из поиска, строки удаляет фоновая задача",
+                verbose_name="Удаляется",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from search.partitions import attach_partitions_operations
+
+attach_partitions, sync_partitions = attach_partitions_operations()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0019_database_deletion"),
+    ]
+
+    operations = [
+        attach_partitions,
+        migrations.AlterUniqueTogether(
+            name="data",
+            unique_together={
+                ("database", "user_index", "column_index", "lookup"),
+            },
+        ),
+        sync_partitions,
+    ]
@@ -0,0 +1,67 @@
+import struct
+
+from django.db import migrations
+
+CHUNK_SIZE = 10_000
+
+SHORT_HEADER = struct.Struct(">HH")
+LONG_HEADER = struct.Struct(">HI")
+
+
+def _repack(payload, source, target):
+    payload = bytes(payload)
+    cells = []
+    position = 0
+    while position < len(payload):
+        column_index, size = source.unpack_from(payload, position)
+        position += source.size
+        cells.append(
+            target.pack(column_index, size)
+            + payload[position : position + size],
+        )
+        position += size
+
+    return b"".join(cells)
+
+
+def _convert(apps, schema_editor, source, target):
+    """
+    Переписывает заголовки ячеек упакованных записей порциями
+    по первичному ключу. Миграция выполняется в одной транзакции:
+    по упакованной строке не видно, какой у неё заголовок, и частично
+    переписанную таблицу нельзя было бы продолжить.
+    """
+    DataRecord = apps.get_model("search", "DataRecord")
+    records = DataRecord.objects.filter(payload__isnull=False).order_by("pk")
+    last_pk = 0
+    while True:
+        rows = list(
+            records.filter(pk__gt=last_pk).only("payload")[:CHUNK_SIZE]
+        )
+        if not rows:
+            return
+
+        last_pk = rows[-1].pk
+        for row in rows:
+            row.payload = _repack(row.payload, source, target)
+
+        DataRecord.objects.bulk_update(rows, ["payload"], batch_size=1000)
+
+
+def widen_cell_length(apps, schema_editor):
+    _convert(apps, schema_editor, SHORT_HEADER, LONG_HEADER)
+
+
+def narrow_cell_length(apps, schema_editor):
+    _convert(apps, schema_editor, LONG_HEADER, SHORT_HEADER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0020_data_unique_lookup"),
+    ]
+
+    operations = [
+        migrations.RunPython(widen_cell_length, narrow_cell_length),
+    ]
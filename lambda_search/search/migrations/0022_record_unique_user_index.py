@@ -0,0 +1,63 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+def _merge_masks(masks):
+    merged = 0
+    for mask in masks:
+        merged |= int.from_bytes(bytes(mask), "little")
+
+    return merged.to_bytes((merged.bit_length() + 7) // 8, "little")
+
+
+def merge_duplicate_records(apps, schema_editor):
+    """
+    Объединяет сводки одной записи, созданные в разных порциях загрузки:
+    остаётся упакованная сводка (или первая), маски объединяются.
+    Ключи поиска упакованных дубликатов совпадают с ключами оставшейся
+    сводки и удаляются вместе с ними.
+    """
+    DataRecord = apps.get_model("search", "DataRecord")
+    duplicates = list(
+        DataRecord.objects.values("database", "user_index")
+        .annotate(count=models.Count("pk"))
+        .filter(count__gt=1)
+        .values_list("database", "user_index"),
+    )
+    for database_id, user_index in duplicates:
+        records = sorted(
+            DataRecord.objects.filter(
+                database_id=database_id,
+                user_index=user_index,
+            ),
+            key=lambda record: (record.payload is None, record.pk),
+        )
+        kept, *removed = records
+        kept.columns = _merge_masks(record.columns for record in records)
+        kept.save(update_fields=["columns"])
+        DataRecord.objects.filter(
+            pk__in=[record.pk for record in removed],
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0021_record_payload_header"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_records,
+            migrations.RunPython.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name="datarecord",
+            unique_together={("database", "user_index")},
+        ),
+        migrations.RemoveIndex(
+            model_name="datarecord",
+            name="search_record_user_idx",
+        ),
+    ]
@@ -1,13 +1,21 @@
 from pathlib import Path
+import uuid
 
 from django.conf import settings
 from django.core.validators import FileExtensionValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
-from search.encryptor import UnifiedEncryptor
+from search.encryptor import (
+    get_file_extension,
+    KeyRing,
+    UnifiedEncryptor,
+)
 import search.managers
+from search.result_cache import bump_generation
+from search.summaries import decode_columns, unpack_cells
+from search.validators import DatabaseFileExtensionValidator
 
 __all__ = ()
 
@@ -19,12 +27,23 @@ def database_upload_path(instance, filename):
     """
     Генерирует безопасный путь для загрузки файла базы данных
     """
-    ext = Path(filename).suffix
+    ext = get_file_extension(filename) or Path(filename).suffix
     safe_name = slugify(instance.name)
     return f"protected/databases/{safe_name}{ext}"
 
 
+def bulk_search_upload_path(instance, filename):
+    ext = Path(filename).suffix
+    return f"protected/bulk_search/{uuid.uuid4().hex}{ext}"
+
+
 class ManagedDatabase(models.Model):
+    STORAGE_CELLS = "cells"
+    STORAGE_RECORDS = "records"
+    STORAGE_CHOICES = [
+        (STORAGE_CELLS, _("по ячейкам")),
+        (STORAGE_RECORDS, _("упакованные записи")),
+    ]
 
     name = models.CharField(
         _("Имя базы данных"),
@@ -35,7 +54,20 @@ class ManagedDatabase(models.Model):
         ("Файл базы данных"),
         upload_to=database_upload_path,
         blank=True,
-        validators=[FileExtensionValidator(["csv", "sqlite", "db"])],
+        validators=[
+            DatabaseFileExtensionValidator(
+                [
+                    "csv",
+                    "sqlite",
+                    "db",
+                    "csv.gz",
+                    "csv.bz2",
+                    "csv.xz",
+                    "jsonl",
+                    "ndjson",
+                ],
+            ),
+        ],
     )
 
     history = models.TextField(
@@ -66,6 +98,62 @@ class ManagedDatabase(models.Model):
         blank=True,
         null=True,
     )
+    checkpoint = models.JSONField(
+        _("Контрольная точка шифрования"),
+        help_text=_(
+            "Позиция в исходном файле, до которой данные уже загружены",
+        ),
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    columns = models.JSONField(
+        _("Столбцы утечки"),
+        help_text=_(
+            "Словарь столбцов: номер столбца в Data и бит в масках сводок",
+        ),
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    storage = models.CharField(
+        _("Хранение"),
+        help_text=_(
+            "Ячейки в Data или одна строка на запись "
+            "с упакованными шифротекстами",
+        ),
+        max_length=20,
+        choices=STORAGE_CHOICES,
+        default=STORAGE_CELLS,
+        editable=False,
+    )
+    is_deleting = models.BooleanField(
+        _("Удаляется"),
+        help_text=_("Утечка скрыта из поиска, строки удаляет фоновая задача"),
+        default=False,
+        editable=False,
+    )
+    key_version = models.PositiveSmallIntegerField(
+        _("Версия ключа шифрования"),
+        help_text=_("Ключ, которым зашифрованы ячейки утечки"),
+        default=1,
+        editable=False,
+    )
+    rotation_checkpoint = models.IntegerField(
+        _("Контрольная точка ротации ключа"),
+        help_text=_(
+            "Записи с меньшим user_index уже перешифрованы текущим ключом",
+        ),
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    bloom_filter = models.BinaryField(
+        _("Фильтр Блума ключей поиска"),
+        blank=True,
+        null=True,
+        editable=False,
+    )
     created_at = models.DateTimeField(
         _("Дата создания"),
         auto_now_add=True,
@@ -78,13 +166,19 @@ class ManagedDatabase(models.Model):
     )
 
     def save(self, *args, **kwargs):
+        from search.partitions import sync_partition
+
+        # Удаляемая утечка не возвращается в поиск
+        if self.is_deleting:
+            self.active = False
+
         super().save(*args, **kwargs)
+        sync_partition(self)
+        transaction.on_commit(bump_generation)
         if not self.is_encrypted and self.file and not self.encryption_started:
             from search.tasks import encrypt_database_task
 
             try:
-                from django.db import transaction
-
                 self.encryption_started = True
                 ManagedDatabase.objects.filter(pk=self.pk).update(
                     encryption_started=True,
@@ -100,17 +194,66 @@ class ManagedDatabase(models.Model):
                 )
 
     def encrypt_database(self):
-        key = settings.ENCRYPTION_KEY
+        key = self.start_ingestion()
         encryptor = UnifiedEncryptor(key, file_path=Path(self.file.path))
         encryptor.encrypt_database_cells()
         self.is_encrypted = True
         super().save(update_fields=["is_encrypted"])
 
+    def start_ingestion(self, keyring=None) -> bytes:
+        """
+        Ключ, которым шифруется загрузка утечки. Версия ключа
+        фиксируется, пока контрольной точки ещё нет; продолжение
+        загрузки шифрует тем же ключом, что и уже загруженные порции.
+        Если этого ключа больше нет, загруженные строки удаляются
+        и загрузка начинается заново текущим ключом.
+        """
+        from search.deletion import discard_loaded_rows
+
+        keyring = keyring or KeyRing.from_settings()
+        if self.checkpoint is not None:
+            try:
+                return keyring.get(self.key_version).key
+            except ValueError:
+                discard_loaded_rows(self)
+
+        self.checkpoint = None
+        self.key_version = keyring.version
+        ManagedDatabase.objects.filter(pk=self.pk).update(
+            checkpoint=None,
+            key_version=keyring.version,
+        )
+        return keyring.current.key
+
+    def schedule_deletion(self):
+        """
+        Скрывает утечку из поиска сразу, а её строки удаляет порциями
+        фоновая задача: каскад ORM собрал бы их все в одном запросе
+        """
+        from search.partitions import sync_partition
+        from search.tasks import delete_database_task
+
+        self.is_deleting = True
+        self.active = False
+        ManagedDatabase.objects.filter(pk=self.pk).update(
+            is_deleting=True,
+            active=False,
+        )
+        sync_partition(self)
+        transaction.on_commit(bump_generation)
+        transaction.on_commit(lambda: delete_database_task.delay(self.pk))
+
     def delete(self, *args, **kwargs):
+        from search.partitions import drop_partition
+        from search.staging import StagingTable
+
         if self.file and Path(self.file.path).exists():
             Path(self.file.path).unlink()
 
+        StagingTable(self).drop()
+        drop_partition(self)
         super().delete(*args, **kwargs)
+        transaction.on_commit(bump_generation)
 
     class Meta:
         verbose_name = _("База данных")
@@ -131,19 +274,218 @@ class Data(models.Model):
     user_index = models.IntegerField(
         _("Индекс пользователя"),
     )
-    column_name = models.CharField(
-        _("Название колонки"),
-        max_length=255,
+    column_index = models.SmallIntegerField(
+        _("Номер колонки"),
+        help_text=_("Позиция в словаре столбцов ManagedDatabase.columns"),
     )
-    value = models.CharField(
+    value = models.BinaryField(
         _("Значение"),
-        max_length=255,
+        help_text=_("Шифротекст нормализованного значения"),
+    )
+    lookup = models.BinaryField(
+        _("Ключ поиска"),
+        help_text=_("HMAC нормализованного значения для точного поиска"),
+        max_length=16,
+        blank=True,
+        null=True,
+    )
+    domain_lookup = models.BinaryField(
+        _("Ключ поиска по домену"),
+        help_text=_("HMAC домена email-подобного значения"),
+        max_length=16,
+        blank=True,
+        null=True,
     )
 
     class Meta:
-        unique_together = ("database", "user_index", "column_name", "value")
+        # Ключ поиска фиксированной длины вместо шифротекста: длинное
+        # значение не помещается в строку индекса B-дерева
+        unique_together = ("database", "user_index", "column_index", "lookup")
+        indexes = [
+            models.Index(
+                fields=["lookup", "database", "user_index"],
+                name="search_data_lookup_idx",
+            ),
+            models.Index(
+                fields=["domain_lookup", "database", "user_index"],
+                name="search_data_domain_idx",
+                condition=models.Q(domain_lookup__isnull=False),
+            ),
+        ]
         verbose_name = _("Данные")
         verbose_name_plural = _("Данные")
 
+    @property
+    def column_name(self) -> str:
+        return self.database.columns[self.column_index]
+
+    def __str__(self):
+        return str(self.pk)[:DEFAULT_STRING_LIMIT]
+
+
+class DataRecord(models.Model):
+    """
+    Сводка записи утечки: какие столбцы в ней заполнены. Поиск читает
+    одну сводку на найденную запись вместо всех её ячеек.
+    """
+
+    objects = search.managers.DataRecordManager()
+    database = models.ForeignKey(
+        ManagedDatabase,
+        on_delete=models.CASCADE,
+        related_name="records",
+        verbose_name=_("Имя базы данных"),
+    )
+    user_index = models.IntegerField(
+        _("Индекс пользователя"),
+    )
+    columns = models.BinaryField(
+        _("Маска столбцов"),
+        help_text=_("Бит i — столбец ManagedDatabase.columns[i]"),
+    )
+    payload = models.BinaryField(
+        _("Упакованные ячейки"),
+        help_text=_("Шифротексты ячеек записи при хранении записями"),
+        blank=True,
+        null=True,
+    )
+
+    @property
+    def column_names(self) -> list:
+        return decode_columns(self.database.columns or [], self.columns)
+
+    @property
+    def cells(self) -> list:
+        """[(имя столбца, шифротекст), ...] упакованной записи"""
+        columns = self.database.columns or []
+        return [
+            (columns[column_index], value)
+            for column_index, value in unpack_cells(self.payload or b"")
+        ]
+
+    class Meta:
+        unique_together = ("database", "user_index")
+        verbose_name = _("Сводка записи")
+        verbose_name_plural = _("Сводки записей")
+
+    def __str__(self):
+        return str(self.pk)[:DEFAULT_STRING_LIMIT]
+
+
+class RecordLookup(models.Model):
+    """
+    Ключи поиска упакованных записей: узкая таблица ключ → запись.
+    Хранит и ключи значений, и ключи доменов email: они считаются
+    на разных производных ключах HMAC и не совпадают.
+    """
+
+    record = models.ForeignKey(
+        DataRecord,
+        on_delete=models.CASCADE,
+        related_name="lookups",
+        verbose_name=_("Запись"),
+    )
+    lookup = models.BinaryField(
+        _("Ключ поиска"),
+        max_length=16,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["lookup", "record"],
+                name="search_recordlookup_idx",
+            ),
+        ]
+        verbose_name = _("Ключ поиска записи")
+        verbose_name_plural = _("Ключи поиска записей")
+
+    def __str__(self):
+        return str(self.pk)[:DEFAULT_STRING_LIMIT]
+
+
+class DomainOwnership(models.Model):
+    """Домен, которым владеет пользователь; поиск по нему — после проверки"""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="domains",
+        verbose_name=_("Пользователь"),
+    )
+    domain = models.CharField(
+        _("Домен"),
+        max_length=255,
+    )
+    verified = models.BooleanField(
+        _("Подтверждён"),
+        default=False,
+    )
+
+    class Meta:
+        unique_together = ("user", "domain")
+        verbose_name = _("Домен пользователя")
+        verbose_name_plural = _("Домены пользователей")
+
+    def __str__(self):
+        return self.domain[:DEFAULT_STRING_LIMIT]
+
+
+class BulkSearchJob(models.Model):
+    """Пакетный поиск по списку идентификаторов из файла"""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="bulk_searches",
+        verbose_name=_("Пользователь"),
+    )
+    file = models.FileField(
+        _("Список идентификаторов"),
+        help_text=_("По одному email или номеру телефона в строке"),
+        upload_to=bulk_search_upload_path,
+        validators=[FileExtensionValidator(["txt", "csv"])],
+    )
+    result = models.FileField(
+        _("Результаты"),
+        upload_to=bulk_search_upload_path,
+        blank=True,
+        editable=False,
+    )
+    progress_task_id = models.CharField(
+        _("ID задачи поиска"),
+        max_length=255,
+        blank=True,
+        null=True,
+    )
+    identifiers_count = models.PositiveIntegerField(
+        _("Проверено идентификаторов"),
+        default=0,
+    )
+    matches_count = models.PositiveIntegerField(
+        _("Найдено совпадений"),
+        default=0,
+    )
+    created_at = models.DateTimeField(
+        _("Дата создания"),
+        auto_now_add=True,
+    )
+    finished_at = models.DateTimeField(
+        _("Дата завершения"),
+        blank=True,
+        null=True,
+    )
+
+    def delete(self, *args, **kwargs):
+        for file in (self.file, self.result):
+            if file and Path(file.path).exists():
+                Path(file.path).unlink()
+
+        super().delete(*args, **kwargs)
+
+    class Meta:
+        verbose_name = _("Пакетный поиск")
+        verbose_name_plural = _("Пакетные поиски")
+
     def __str__(self):
         return str(self.pk)[:DEFAULT_STRING_LIMIT]
@@ -0,0 +1,425 @@
+from django.db import connections, IntegrityError, router, transaction
+
+__all__ = ()
+
+
+def _data_table():
+    from search.models import Data
+
+    return Data._meta.db_table
+
+
+def _partition_key():
+    from search.models import Data
+
+    return Data.database.field.column
+
+
+def partition_name(database_id) -> str:
+    return f"{_data_table()}_p{int(database_id)}"
+
+
+def get_connection():
+    from search.models import Data
+
+    return connections[router.db_for_write(Data)]
+
+
+def is_partitioned(connection=None) -> bool:
+    """
+    Data хранится секциями только на PostgreSQL после миграции
+    0013_partition_data; на остальных бэкендах таблица обычная.
+    """
+    connection = connection or get_connection()
+    if connection.vendor != "postgresql":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+            [_data_table()],
+        )
+        row = cursor.fetchone()
+
+    return bool(row) and row[0] == "p"
+
+
+def _partition_sql(database_id, quote) -> str:
+    database_id = int(database_id)
+    name = partition_name(database_id)
+    # CHECK позволяет присоединить секцию обратно без проверки всех строк
+    return (
+        f"CREATE TABLE IF NOT EXISTS {quote(name)} "
+        f"PARTITION OF {quote(_data_table())} ("
+        f"CONSTRAINT {quote(f'{name}_check')} "
+        f"CHECK ({quote(_partition_key())} = {database_id})"
+        f") FOR VALUES IN ({database_id})"
+    )
+
+
+def create_partition(managed_database):
+    """Создаёт секцию Data для утечки перед загрузкой"""
+    connection = get_connection()
+    if not is_partitioned(connection):
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            _partition_sql(managed_database.pk, connection.ops.quote_name),
+        )
+
+
+def create_loading_table(managed_database, name) -> bool:
+    """
+    Создаёт таблицу name, которая после загрузки станет секцией утечки
+    (attach_loading_table): столбцы и значения по умолчанию Data и CHECK
+    секции, но без индексов. Существующая таблица остаётся для
+    продолжения загрузки. False, если Data не секционирована.
+    """
+    connection = get_connection()
+    if not is_partitioned(connection):
+        return False
+
+    quote = connection.ops.quote_name
+    database_id = int(managed_database.pk)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote(name)} "
+            f"(LIKE {quote(_data_table())} INCLUDING DEFAULTS, "
+            f"CONSTRAINT {quote(f'{partition_name(database_id)}_check')} "
+            f"CHECK ({quote(_partition_key())} = {database_id}))",
+        )
+
+    return True
+
+
+def attach_loading_table(managed_database, name) -> bool:
+    """
+    Делает загруженную таблицу name (create_loading_table) секцией
+    утечки. Индексы строятся по определениям индексов Data, индексы
+    первичного ключа и уникальности оформляются ограничениями
+    (ADD CONSTRAINT ... USING INDEX): только такие ATTACH PARTITION
+    присоединяет к ограничениям Data без перестроения, а CHECK избавляет
+    от проверки строк. Строки не копируются, Data блокируется только
+    на замену пустой секции в конце транзакции. False, если Data
+    не секционирована или в секции утечки уже есть строки: тогда
+    их нужно переносить в Data.
+    """
+    connection = get_connection()
+    if not is_partitioned(connection):
+        return False
+
+    quote = connection.ops.quote_name
+    table = _data_table()
+    database_id = int(managed_database.pk)
+    partition = partition_name(database_id)
+    with connection.cursor() as cursor:
+        exists, _attached = _partition_state(cursor, database_id)
+        if exists:
+            cursor.execute(
+                f"SELECT EXISTS (SELECT 1 FROM {quote(partition)})",
+            )
+            if cursor.fetchone()[0]:
+                return False
+
+        cursor.execute(
+            "SELECT pg_get_indexdef(i.indexrelid), c.contype "
+            "FROM pg_index i LEFT JOIN pg_constraint c "
+            "ON c.conindid = i.indexrelid AND c.conrelid = i.indrelid "
+            "AND c.contype IN ('p', 'u') "
+            "WHERE i.indrelid = %s::regclass "
+            "ORDER BY c.contype NULLS LAST, i.indexrelid",
+            [table],
+        )
+        for position, (indexdef, contype) in enumerate(cursor.fetchall()):
+            # Определение без имени и таблицы: USING метод (столбцы) WHERE
+            _, _, definition = indexdef.partition(" USING ")
+            if contype is None:
+                cursor.execute(
+                    f"CREATE INDEX ON {quote(name)} USING {definition}",
+                )
+                continue
+
+            constraint = f"{name}_{'pkey' if contype == 'p' else position}"
+            try:
+                with transaction.atomic(using=connection.alias):
+                    _add_constraint(
+                        cursor,
+                        quote,
+                        name,
+                        constraint,
+                        contype,
+                        definition,
+                    )
+            except IntegrityError:
+                # Дубликаты в самом источнике: вместо ON CONFLICT
+                # при вставке в Data
+                _delete_duplicates(cursor, quote, name)
+                _add_constraint(
+                    cursor,
+                    quote,
+                    name,
+                    constraint,
+                    contype,
+                    definition,
+                )
+
+        cursor.execute(f"DROP TABLE IF EXISTS {quote(partition)}")
+        cursor.execute(
+            f"ALTER TABLE {quote(name)} RENAME TO {quote(partition)}",
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ATTACH PARTITION "
+            f"{quote(partition)} FOR VALUES IN ({database_id})",
+        )
+
+    return True
+
+
+def _add_constraint(cursor, quote, table, name, contype, definition):
+    cursor.execute(
+        f"CREATE UNIQUE INDEX {quote(name)} ON {quote(table)} "
+        f"USING {definition}",
+    )
+    cursor.execute(
+        f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} "
+        f"{'PRIMARY KEY' if contype == 'p' else 'UNIQUE'} "
+        f"USING INDEX {quote(name)}",
+    )
+
+
+def _delete_duplicates(cursor, quote, table):
+    """Оставляет первую строку каждого ключа уникальности Data"""
+    from search.models import Data
+
+    columns = [
+        quote(Data._meta.get_field(name).column)
+        for name in Data._meta.unique_together[0]
+    ]
+    cursor.execute(
+        f"DELETE FROM {quote(table)} WHERE ctid IN ("
+        "SELECT ctid FROM (SELECT ctid, ROW_NUMBER() OVER ("
+        f"PARTITION BY {', '.join(columns)} ORDER BY id) AS number "
+        f"FROM {quote(table)} "
+        f"WHERE {' AND '.join(f'{column} IS NOT NULL' for column in columns)}"
+        ") AS rows WHERE number > 1)",
+    )
+
+
+def drop_partition(managed_database):
+    """Удаляет строки утечки целиком вместе с секцией"""
+    connection = get_connection()
+    if not is_partitioned(connection):
+        return
+
+    name = partition_name(managed_database.pk)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DROP TABLE IF EXISTS {connection.ops.quote_name(name)}",
+        )
+
+
+def estimate_partition_rows(managed_database):
+    """
+    Примерное число строк в секции утечки по статистике планировщика,
+    без чтения строк; None, если Data не секционирована. Для ещё
+    не проанализированной секции строки считаются.
+    """
+    connection = get_connection()
+    if not is_partitioned(connection):
+        return None
+
+    name = partition_name(managed_database.pk)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)",
+            [name],
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+
+        if row[0] >= 0:
+            return int(row[0])
+
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {connection.ops.quote_name(name)}",
+        )
+        return cursor.fetchone()[0]
+
+
+def _partition_state(cursor, database_id):
+    """(существует ли секция, присоединена ли она к Data)"""
+    cursor.execute(
+        "SELECT to_regclass(%s) IS NOT NULL, EXISTS ("
+        "SELECT 1 FROM pg_inherits "
+        "WHERE inhrelid = to_regclass(%s) AND inhparent = to_regclass(%s))",
+        [
+            partition_name(database_id),
+            partition_name(database_id),
+            _data_table(),
+        ],
+    )
+    return cursor.fetchone()
+
+
+def sync_partition(managed_database):
+    """
+    Присоединяет секцию, пока утечка загружается или активна, и отсоединяет
+    её у выключенной загруженной утечки: её строки пропадают из Data
+    и индексов Data, но остаются на диске до повторного включения.
+    """
+    connection = get_connection()
+    if not is_partitioned(connection):
+        return
+
+    quote = connection.ops.quote_name
+    database_id = managed_database.pk
+    attach = managed_database.active or not managed_database.is_encrypted
+    with connection.cursor() as cursor:
+        exists, attached = _partition_state(cursor, database_id)
+        if not exists:
+            if attach:
+                cursor.execute(_partition_sql(database_id, quote))
+
+            return
+
+        if attach and not attached:
+            cursor.execute(
+                f"ALTER TABLE {quote(_data_table())} ATTACH PARTITION "
+                f"{quote(partition_name(database_id))} "
+                f"FOR VALUES IN ({int(database_id)})",
+            )
+        elif not attach and attached:
+            cursor.execute(
+                f"ALTER TABLE {quote(_data_table())} DETACH PARTITION "
+                f"{quote(partition_name(database_id))}",
+            )
+
+
+def attach_all_partitions(database_ids, connection=None):
+    """
+    Присоединяет все отсоединённые секции. Миграции, меняющие Data,
+    применяются только к присоединённым секциям: их нужно вызывать
+    после этой функции и затем снова отсоединить выключенные утечки
+    (sync_all_partitions).
+    """
+    connection = connection or get_connection()
+    if not is_partitioned(connection):
+        return []
+
+    detached = []
+    with connection.cursor() as cursor:
+        for database_id in database_ids:
+            exists, attached = _partition_state(cursor, database_id)
+            if exists and not attached:
+                cursor.execute(
+                    f"ALTER TABLE {connection.ops.quote_name(_data_table())} "
+                    "ATTACH PARTITION "
+                    f"{connection.ops.quote_name(partition_name(database_id))}"
+                    f" FOR VALUES IN ({int(database_id)})",
+                )
+                detached.append(database_id)
+
+    return detached
+
+
+def sync_all_partitions(managed_databases):
+    for managed_database in managed_databases:
+        sync_partition(managed_database)
+
+
+def attach_partitions_operations(app_label="search"):
+    """
+    Операции миграции вокруг изменения Data: (до, после). Перед
+    изменением присоединяют все секции, после — снова отсоединяют
+    выключенные утечки.
+    """
+    from django.db import migrations
+
+    def attach(apps, schema_editor):
+        managed_databases = apps.get_model(app_label, "ManagedDatabase")
+        attach_all_partitions(
+            managed_databases.objects.values_list("pk", flat=True),
+            schema_editor.connection,
+        )
+
+    def sync(apps, schema_editor):
+        managed_databases = apps.get_model(app_label, "ManagedDatabase")
+        sync_all_partitions(
+            managed_databases.objects.only("pk", "active", "is_encrypted"),
+        )
+
+    return (
+        migrations.RunPython(attach, sync),
+        migrations.RunPython(sync, attach),
+    )
+
+
+def partition_data_table(schema_editor, database_ids):
+    """
+    Перестраивает обычную таблицу Data в секционированную по database_id
+    (PostgreSQL): по секции на утечку, первичный ключ (id, database_id),
+    остальные ограничения и индексы пересоздаются с прежними именами.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql" or is_partitioned(connection):
+        return
+
+    quote = connection.ops.quote_name
+    table = _data_table()
+    old_table = f"{table}_unpartitioned"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype <> 'p'",
+            [table],
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = %s "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint "
+            "WHERE conrelid = %s::regclass)",
+            [table, table],
+        )
+        indexes = [indexdef for indexdef, in cursor.fetchall()]
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {quote(table)}")
+        (next_id,) = cursor.fetchone()
+
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} RENAME TO {quote(old_table)}",
+        )
+        cursor.execute(
+            f"CREATE TABLE {quote(table)} "
+            f"(LIKE {quote(old_table)} INCLUDING DEFAULTS) "
+            f"PARTITION BY LIST ({quote(_partition_key())})",
+        )
+        for database_id in database_ids:
+            cursor.execute(_partition_sql(database_id, quote))
+
+        cursor.execute(
+            f"INSERT INTO {quote(table)} SELECT * FROM {quote(old_table)}",
+        )
+        cursor.execute(f"DROP TABLE {quote(old_table)}")
+
+        sequence = f"{table}_id_seq"
+        cursor.execute(
+            f"CREATE SEQUENCE {quote(sequence)} START WITH {int(next_id)} "
+            f"OWNED BY {quote(table)}.id",
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ALTER COLUMN id "
+            f"SET DEFAULT nextval('{sequence}')",
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ADD PRIMARY KEY "
+            f"(id, {quote(_partition_key())})",
+        )
+        for name, definition in constraints:
+            cursor.execute(
+                f"ALTER TABLE {quote(table)} "
+                f"ADD CONSTRAINT {quote(name)} {definition}",
+            )
+
+        for indexdef in indexes:
+            cursor.execute(indexdef)
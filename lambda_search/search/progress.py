@@ -0,0 +1,131 @@
+import json
+import time
+
+from celery_progress.backend import BaseProgressRecorder
+from django.conf import settings
+from django.core.cache import cache
+
+__all__ = ()
+
+
+def progress_cache_key(task_id) -> str:
+    return f"task_progress_{task_id}"
+
+
+def build_progress(current, total, description="") -> dict:
+    percent = round(current / total * 100, 2) if total > 0 else 0
+    return {
+        "pending": False,
+        "current": current,
+        "total": total,
+        "percent": percent,
+        "description": description,
+    }
+
+
+def get_task_progress(task_id):
+    """
+    Возвращает текущий прогресс задачи: из кэша, пока задача выполняется,
+    иначе итоговое состояние из TaskResult. None, если задача не найдена.
+    """
+    progress = cache.get(progress_cache_key(task_id))
+    if progress:
+        return progress
+
+    from django_celery_results.models import TaskResult
+
+    task_result = TaskResult.objects.filter(task_id=task_id).first()
+    if not task_result:
+        return None
+
+    if isinstance(task_result.result, str):
+        return json.loads(task_result.result)
+
+    return task_result.result
+
+
+class CachedProgressRecorder(BaseProgressRecorder):
+    """
+    Хранит прогресс задачи в кэше (Redis) вместо TaskResult.
+    Обновления объединяются: запись происходит, только если с прошлой
+    прошло PROGRESS_UPDATE_INTERVAL секунд или PROGRESS_UPDATE_ROWS строк.
+    Итоговое состояние задача возвращает как результат в TaskResult.
+    """
+
+    def __init__(self, task_id, min_interval=None, min_step=None):
+        self.task_id = task_id
+        self.min_interval = (
+            settings.PROGRESS_UPDATE_INTERVAL
+            if min_interval is None
+            else min_interval
+        )
+        self.min_step = (
+            settings.PROGRESS_UPDATE_ROWS if min_step is None else min_step
+        )
+        self.stored_current = None
+        self.stored_at = 0
+
+    def set_progress(self, current, total, description="", force=False):
+        super().set_progress(current, total, description)
+        now = time.monotonic()
+        if not (
+            force
+            or self.stored_current is None
+            or current >= total
+            or now - self.stored_at >= self.min_interval
+            or current - self.stored_current >= self.min_step
+        ):
+            return False
+
+        cache.set(
+            progress_cache_key(self.task_id),
+            build_progress(current, total, self.description),
+            timeout=settings.PROGRESS_CACHE_TIMEOUT,
+        )
+        self.stored_current = current
+        self.stored_at = now
+        return True
+
+    def finish(self, result: dict) -> dict:
+        """
+        Записывает итоговое состояние в кэш и возвращает его, чтобы задача
+        вернула то же состояние в TaskResult.
+        """
+        cache.set(
+            progress_cache_key(self.task_id),
+            result,
+            timeout=settings.PROGRESS_CACHE_TIMEOUT,
+        )
+        return result
+
+
+class EstimatedRowProgress:
+    """
+    Прогресс построчной обработки по заранее оценённому числу строк:
+    total растёт, если оценка занижена, а complete() после последней
+    строки делает его точным, в том числе когда оценка завышена.
+    """
+
+    def __init__(self, recorder, estimate):
+        self.recorder = recorder
+        self.estimate = estimate
+
+    def __call__(self, processed):
+        total = max(self.estimate, processed)
+        self.recorder.set_progress(
+            processed,
+            total,
+            self._description(processed, total),
+        )
+
+    def complete(self, processed, description=None):
+        self.recorder.set_progress(
+            processed,
+            processed,
+            description or self._description(processed, processed),
+            force=True,
+        )
+
+    def _description(self, processed, total):
+        percent = int(processed / total * 100) if total else 100
+        return f"Processed {processed} of {total} records ({percent}%)"
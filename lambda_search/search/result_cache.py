@@ -0,0 +1,105 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+__all__ = ()
+
+
+GENERATION_KEY = "search_results_generation"
+HITS_KEY = "search_results_hits"
+MISSES_KEY = "search_results_misses"
+
+
+def get_generation() -> int:
+    """
+    Поколение набора активных утечек. Начальное значение берётся
+    из времени, чтобы после потери ключа в кэше не вернуться
+    к номеру, под которым ещё лежат старые результаты.
+    """
+    cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+    return cache.get(GENERATION_KEY)
+
+
+async def aget_generation() -> int:
+    await cache.aadd(GENERATION_KEY, time.time_ns(), timeout=None)
+    return await cache.aget(GENERATION_KEY)
+
+
+def bump_generation():
+    """Делает недействительными все закэшированные результаты поиска"""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def result_cache_key(query: str, generation: int) -> str:
+    digest = hashlib.sha256(query.encode()).hexdigest()
+    return f"search_results_{generation}_{digest}"
+
+
+def _count(key):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+async def _acount(key):
+    await cache.aadd(key, 0, timeout=None)
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        pass
+
+
+def get_cached_results(query: str, count=True):
+    """
+    Результаты поиска по зашифрованному запросу или None.
+    count=False — не учитывать обращение в счётчиках попаданий.
+    """
+    results = cache.get(result_cache_key(query, get_generation()))
+    if count:
+        _count(MISSES_KEY if results is None else HITS_KEY)
+
+    return results
+
+
+async def aget_cached_results(query: str):
+    results = await cache.aget(
+        result_cache_key(query, await aget_generation()),
+    )
+    await _acount(MISSES_KEY if results is None else HITS_KEY)
+    return results
+
+
+def cache_results(query: str, results):
+    cache.set(
+        result_cache_key(query, get_generation()),
+        results,
+        timeout=settings.SEARCH_CACHE_TIMEOUT,
+    )
+
+
+async def acache_results(query: str, results):
+    await cache.aset(
+        result_cache_key(query, await aget_generation()),
+        results,
+        timeout=settings.SEARCH_CACHE_TIMEOUT,
+    )
+
+
+def get_cache_stats() -> dict:
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = stats.get(HITS_KEY, 0)
+    misses = stats.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else 0,
+        "generation": get_generation(),
+    }
@@ -0,0 +1,269 @@
+from django.conf import settings
+from django.db import models, transaction
+
+from search.bloom import build_bloom_filter
+from search.encryptor import CellEncryptor, KeyRing
+from search.forms import get_email_domain
+from search.result_cache import bump_generation
+from search.summaries import pack_cells, unpack_cells
+
+__all__ = ()
+
+
+def rotate_database_key(
+    database_id,
+    batch_size=None,
+    progress_callback=None,
+    keyring=None,
+) -> int:
+    """
+    Перешифровывает утечку текущим ключом: значения расшифровываются
+    ключом версии утечки, шифруются заново, ключи поиска пересчитываются.
+    Записи обходятся по user_index порциями, порция фиксируется вместе
+    с контрольной точкой, поэтому прерванная ротация продолжается с места
+    остановки. Пока она идёт, записи утечки зашифрованы разными ключами:
+    фильтр Блума утечки отключён, а поиск проверяет ключи обеих версий.
+    progress_callback(сделано, всего) получает позицию по user_index.
+    Возвращает число перешифрованных записей.
+    """
+    from search.models import Data, DataRecord, ManagedDatabase
+    from search.partitions import attach_all_partitions, sync_partition
+
+    batch_size = batch_size or settings.BATCH_SIZE
+    keyring = keyring or KeyRing.from_settings()
+    database = ManagedDatabase.objects.get(pk=database_id)
+    if database.key_version == keyring.version:
+        return 0
+
+    if not database.is_encrypted:
+        raise ValueError("Утечка ещё не загружена")
+
+    old = keyring.get(database.key_version)
+    start = database.rotation_checkpoint
+    if start is None:
+        start = 0
+        with transaction.atomic():
+            ManagedDatabase.objects.filter(pk=database.pk).update(
+                bloom_filter=None,
+                rotation_checkpoint=start,
+            )
+            transaction.on_commit(bump_generation)
+
+    # Секция выключенной утечки отсоединена от Data
+    attach_all_partitions([database.pk])
+    if database.storage == ManagedDatabase.STORAGE_RECORDS:
+        model = DataRecord
+        rotate_chunk = _rotate_records
+        fields = (DataRecord.payload.field.name,)
+    else:
+        model = Data
+        rotate_chunk = _rotate_cells
+        fields = (Data.value.field.name,)
+
+    rows = model.objects.filter(
+        **{
+            model.database.field.name: database,
+            f"{model.user_index.field.name}__gte": start,
+        },
+    ).order_by(model.user_index.field.name)
+    total = (
+        rows.aggregate(last=models.Max(model.user_index.field.name))["last"]
+        or 0
+    ) + 1
+
+    rotated = 0
+    chunk = []
+    for row in rows.values_list(
+        "pk",
+        model.user_index.field.name,
+        *fields,
+    ).iterator(chunk_size=batch_size):
+        # Ячейки одной записи не разделяются между порциями
+        if len(chunk) >= batch_size and chunk[-1][1] != row[1]:
+            rotated += _commit_chunk(
+                database,
+                rotate_chunk,
+                chunk,
+                old,
+                keyring.current,
+                row[1],
+            )
+            if progress_callback:
+                progress_callback(row[1], total)
+
+            chunk = []
+
+        chunk.append(row)
+
+    if chunk:
+        rotated += _commit_chunk(
+            database,
+            rotate_chunk,
+            chunk,
+            old,
+            keyring.current,
+            chunk[-1][1] + 1,
+        )
+
+    with transaction.atomic():
+        ManagedDatabase.objects.filter(pk=database.pk).update(
+            key_version=keyring.version,
+            rotation_checkpoint=None,
+            bloom_filter=build_bloom_filter(database.pk).to_bytes(),
+        )
+        transaction.on_commit(bump_generation)
+
+    sync_partition(database)
+    if progress_callback:
+        progress_callback(total, total)
+
+    return rotated
+
+
+def rotate_query_history(batch_size=None, keyring=None) -> int:
+    """
+    Перешифровывает запросы истории, зашифрованные не текущим ключом.
+    Строки обходятся по первичному ключу порциями, каждая порция —
+    отдельная транзакция. Возвращает число обновлённых строк.
+    """
+    from history.models import QueryHistory
+
+    batch_size = batch_size or settings.BATCH_SIZE
+    keyring = keyring or KeyRing.from_settings()
+    queryset = QueryHistory.objects.exclude(
+        **{
+            f"{QueryHistory.query.field.name}__startswith": (
+                f"{keyring.version}{keyring.TOKEN_SEPARATOR}"
+            ),
+        },
+    ).order_by("pk")
+
+    updated = 0
+    last_pk = 0
+    while True:
+        rows = list(
+            queryset.filter(pk__gt=last_pk).only(
+                QueryHistory.query.field.name,
+            )[:batch_size],
+        )
+        if not rows:
+            return updated
+
+        last_pk = rows[-1].pk
+        for row, query in zip(
+            rows,
+            keyring.decrypt_tokens(row.query for row in rows),
+        ):
+            row.query = keyring.encrypt_token(query)
+
+        with transaction.atomic():
+            QueryHistory.objects.bulk_update(
+                rows,
+                [QueryHistory.query.field.name],
+            )
+
+        updated += len(rows)
+
+
+def _commit_chunk(database, rotate_chunk, rows, old, new, checkpoint) -> int:
+    from search.models import ManagedDatabase
+
+    with transaction.atomic():
+        rotate_chunk(rows, old, new)
+        ManagedDatabase.objects.filter(pk=database.pk).update(
+            rotation_checkpoint=checkpoint,
+        )
+
+    return len({user_index for _pk, user_index, _value in rows})
+
+
+def _reencrypt(old, new, encrypted_values) -> list:
+    """
+    [(шифротекст, ключ поиска, ключ домена), ...] для значений,
+    перешифрованных ключом new. Шифротексты, усечённые при загрузке
+    до перехода на двоичное хранение, расшифровать нельзя: вместо них
+    None, они остаются как есть.
+    """
+    encrypted_values = [bytes(value) for value in encrypted_values]
+    readable = [
+        bool(value) and len(value) % CellEncryptor.BLOCK_SIZE == 0
+        for value in encrypted_values
+    ]
+    values = old.decrypt_many(
+        value
+        for value, is_readable in zip(encrypted_values, readable)
+        if is_readable
+    )
+    reencrypted = zip(
+        new.encrypt_many(values),
+        new.lookup_many(values),
+        [
+            new.domain_lookup(domain) if domain else None
+            for domain in map(get_email_domain, values)
+        ],
+    )
+    return [
+        next(reencrypted) if is_readable else None for is_readable in readable
+    ]
+
+
+def _rotate_cells(rows, old, new):
+    from search.models import Data
+
+    cells = []
+    for (pk, _user_index, _value), result in zip(
+        rows,
+        _reencrypt(old, new, [value for *_, value in rows]),
+    ):
+        if result is not None:
+            value, lookup, domain_lookup = result
+            cells.append(
+                Data(
+                    pk=pk,
+                    value=value,
+                    lookup=lookup,
+                    domain_lookup=domain_lookup,
+                ),
+            )
+
+    Data.objects.bulk_update(
+        cells,
+        [
+            Data.value.field.name,
+            Data.lookup.field.name,
+            Data.domain_lookup.field.name,
+        ],
+    )
+
+
+def _rotate_records(rows, old, new):
+    from search.models import DataRecord, RecordLookup
+
+    records = []
+    lookups = []
+    for pk, _user_index, payload in rows:
+        cells = unpack_cells(payload or b"")
+        reencrypted = _reencrypt(old, new, [value for _, value in cells])
+        record = DataRecord(
+            pk=pk,
+            payload=pack_cells(
+                (column_index, value if result is None else result[0])
+                for (column_index, value), result in zip(cells, reencrypted)
+            ),
+        )
+        records.append(record)
+        keys = set()
+        for _value, lookup, domain_lookup in filter(None, reencrypted):
+            keys.add(lookup)
+            if domain_lookup is not None:
+                keys.add(domain_lookup)
+
+        lookups.extend(
+            RecordLookup(record=record, lookup=lookup) for lookup in keys
+        )
+
+    DataRecord.objects.bulk_update(records, [DataRecord.payload.field.name])
+    RecordLookup.objects.filter(
+        **{f"{RecordLookup.record.field.name}__in": records},
+    ).delete()
+    RecordLookup.objects.bulk_create(lookups)
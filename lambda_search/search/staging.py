@@ -0,0 +1,98 @@
+from django.db import connections, router, transaction
+from django.db.models.constants import OnConflict
+
+from search.loaders import get_loaded_columns, get_loaded_fields
+
+__all__ = ()
+
+
+class StagingTable:
+    """
+    Промежуточная таблица без индексов и ограничений, в которую
+    загружается новая утечка. Индексы Data не обновляются на каждую
+    порцию: после загрузки строки переносятся в Data целиком (publish)
+    в той же транзакции, что и публикация утечки.
+    """
+
+    def __init__(self, managed_database):
+        from search.models import Data
+
+        self.managed_database = managed_database
+        self.using = router.db_for_write(Data)
+        self.name = f"{Data._meta.db_table}_staging_{managed_database.pk}"
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def create(self):
+        """
+        Создаёт таблицу; существующая остаётся для продолжения загрузки.
+        На секционированной Data это будущая секция утечки
+        (create_loading_table), на остальных бэкендах — таблица только
+        с загружаемыми столбцами.
+        """
+        from search.partitions import create_loading_table
+
+        if create_loading_table(self.managed_database, self.name):
+            return
+
+        ops = self.connection.ops
+        columns = ", ".join(
+            f"{ops.quote_name(field.column)} "
+            f"{field.db_type(self.connection)}"
+            f"{'' if field.null else ' NOT NULL'}"
+            for field in get_loaded_fields()
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS "
+                f"{ops.quote_name(self.name)} ({columns})",
+            )
+
+    def drop(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "DROP TABLE IF EXISTS "
+                f"{self.connection.ops.quote_name(self.name)}",
+            )
+
+    def publish(self):
+        """
+        Переносит строки в Data и удаляет таблицу. Дубликаты, уже
+        присутствующие в Data, пропускаются. На секционированной Data
+        (PostgreSQL) сама таблица с построенными индексами становится
+        секцией утечки (attach_loading_table), строки не копируются.
+        На остальных бэкендах INSERT ... SELECT пишет в таблицу
+        с индексами и обновляет их построчно: сортировка по ключу
+        уникального индекса лишь делает вставку в B-дерево
+        последовательной.
+        """
+        from search.partitions import attach_loading_table
+
+        with transaction.atomic(using=self.using):
+            if not attach_loading_table(self.managed_database, self.name):
+                self._insert_into_data()
+
+            self.drop()
+
+    def _insert_into_data(self):
+        from search.models import Data
+
+        ops = self.connection.ops
+        fields = get_loaded_fields()
+        columns = get_loaded_columns(self.connection)
+        order = ", ".join(ops.quote_name(field.column) for field in fields)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"{ops.insert_statement(on_conflict=OnConflict.IGNORE)} "
+                f"{ops.quote_name(Data._meta.db_table)} ({columns}) "
+                f"SELECT {columns} FROM {ops.quote_name(self.name)} "
+                f"ORDER BY {order} "
+                + ops.on_conflict_suffix_sql(
+                    fields,
+                    OnConflict.IGNORE,
+                    None,
+                    None,
+                ),
+            )
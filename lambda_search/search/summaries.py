@@ -0,0 +1,136 @@
+import struct
+
+__all__ = ()
+
+# Номер столбца и длина шифротекста: значения не усекаются, ячейка
+# бывает длиннее 65535 байт
+CELL_HEADER = struct.Struct(">HI")
+
+
+def encode_mask(mask: int) -> bytes:
+    return mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+
+
+def merge_masks(*masks) -> bytes:
+    merged = 0
+    for mask in masks:
+        merged |= int.from_bytes(bytes(mask), "little")
+
+    return encode_mask(merged)
+
+
+def decode_columns(columns, mask: bytes) -> list:
+    """Имена столбцов утечки, биты которых установлены в маске"""
+    mask = int.from_bytes(mask, "little")
+    return [name for index, name in enumerate(columns) if mask >> index & 1]
+
+
+def pack_cells(cells) -> bytes:
+    """
+    Упаковывает ячейки записи [(column_index, шифротекст), ...]
+    в одну строку: номер столбца и длина, затем шифротекст
+    """
+    return b"".join(
+        CELL_HEADER.pack(column_index, len(value)) + bytes(value)
+        for column_index, value in cells
+    )
+
+
+def unpack_cells(payload) -> list:
+    payload = bytes(payload)
+    cells = []
+    position = 0
+    while position < len(payload):
+        column_index, size = CELL_HEADER.unpack_from(payload, position)
+        position += CELL_HEADER.size
+        cells.append((column_index, payload[position : position + size]))
+        position += size
+
+    return cells
+
+
+class RecordSummary:
+    """
+    Сводка записей утечки: список столбцов утечки и для каждой записи
+    битовая маска заполненных столбцов (бит i — столбец columns[i]).
+    Новые столбцы дописываются в конец, поэтому маски уже загруженных
+    записей остаются верными.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = list(columns or [])
+        self.positions = {
+            name: index for index, name in enumerate(self.columns)
+        }
+
+    def position(self, column_name) -> int:
+        if column_name not in self.positions:
+            self.positions[column_name] = len(self.columns)
+            self.columns.append(column_name)
+
+        return self.positions[column_name]
+
+    def index_cells(self, cells) -> list:
+        """
+        Заменяет имена столбцов в ячейках (user_index, column_name, ...)
+        их номерами в словаре утечки
+        """
+        return [
+            (user_index, self.position(column_name), *rest)
+            for user_index, column_name, *rest in cells
+        ]
+
+    def summarize(self, cells) -> list:
+        """
+        Маски записей порции ячеек (user_index, column_index, ...),
+        возвращает [(user_index, mask), ...] в порядке появления записей
+        """
+        masks = {}
+        for user_index, column_index, *_ in cells:
+            masks[user_index] = masks.get(user_index, 0) | (1 << column_index)
+
+        return [
+            (user_index, encode_mask(mask))
+            for user_index, mask in masks.items()
+        ]
+
+
+def save_record_summaries(database, summaries) -> int:
+    """
+    Записывает сводки порции [(user_index, mask), ...]. Запись может
+    встретиться в нескольких порциях (строки разных таблиц SQLite
+    с одним rowid): маска уже сохранённой сводки объединяется с новой.
+    Возвращает число созданных сводок.
+    """
+    from search.models import DataRecord
+
+    masks = dict(summaries)
+    if not masks:
+        return 0
+
+    existing = [
+        record
+        for record in DataRecord.objects.filter(
+            **{
+                DataRecord.database.field.name: database,
+                f"{DataRecord.user_index.field.name}__range": (
+                    min(masks),
+                    max(masks),
+                ),
+            },
+        ).only(DataRecord.user_index.field.name, DataRecord.columns.field.name)
+        if record.user_index in masks
+    ]
+    for record in existing:
+        record.columns = merge_masks(
+            record.columns,
+            masks.pop(record.user_index),
+        )
+
+    DataRecord.objects.bulk_update(existing, [DataRecord.columns.field.name])
+    return len(
+        DataRecord.objects.bulk_create(
+            DataRecord(database=database, user_index=user_index, columns=mask)
+            for user_index, mask in masks.items()
+        ),
+    )
@@ -1,17 +1,38 @@
 from pathlib import Path
 
-from celery import shared_task
-from celery_progress.backend import ProgressRecorder
+from celery import group, shared_task
 from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
 
+from history.models import QueryHistory
+from search.backfill import backfill_lookups
+from search.bloom import build_bloom_filter, IngestionBloomFilter
+from search.bulk import count_identifiers, run_bulk_search
+from search.deletion import delete_database
 from search.encryptor import UnifiedEncryptor
-from search.models import ManagedDatabase
+from search.models import BulkSearchJob, DataRecord, ManagedDatabase
+from search.partitions import create_partition, sync_partition
+from search.progress import CachedProgressRecorder, EstimatedRowProgress
+from search.result_cache import (
+    bump_generation,
+    cache_results,
+    get_cached_results,
+)
+from search.rotation import rotate_database_key, rotate_query_history
+from search.staging import StagingTable
 
 __all__ = ()
 
 
-@shared_task(bind=True)
+@shared_task(
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    max_retries=settings.ENCRYPTION_MAX_RETRIES,
+)
 def encrypt_database_task(self, db_id):
+    progress_recorder = CachedProgressRecorder(self.request.id)
     try:
         db_obj = ManagedDatabase.objects.get(pk=db_id)
         if not db_obj.is_encrypted:
@@ -20,60 +41,278 @@ def encrypt_database_task(self, db_id):
                 progress_task_id=self.request.id,
             )
 
-            progress_recorder = ProgressRecorder(self)
-
             progress_recorder.set_progress(
                 0,
                 100,
                 "The beginning of encryption...",
             )
 
-            key = settings.ENCRYPTION_KEY
+            # Повтор продолжает загрузку ключом уже загруженных порций
+            key = db_obj.start_ingestion()
             encryptor = UnifiedEncryptor(key, file_path=Path(db_obj.file.path))
 
-            handler = encryptor.handler
-            total_rows = handler.count_rows()
+            # Быстрая оценка: точное число строк станет известно по ходу
+            # загрузки, total растёт, если оценка оказалась занижена,
+            # и становится точным после последней порции
+            estimated_rows = encryptor.handler.count_rows()
+            progress = EstimatedRowProgress(progress_recorder, estimated_rows)
+            # Фильтр собирается из ключей порций по ходу загрузки. Порции,
+            # загруженные до повтора, в него уже не попадут: тогда фильтр
+            # строится по опубликованным строкам
+            lookup_filter = None
+            if db_obj.checkpoint is None:
+                lookup_filter = IngestionBloomFilter(estimated_rows)
+
+            create_partition(db_obj)
+            staging = None
+            if settings.DEFERRED_INDEX_BUILD:
+                staging = StagingTable(db_obj)
+                staging.create()
+
+            total_rows = encryptor.encrypt_database_cells(
+                progress_callback=progress,
+                table=staging.name if staging else None,
+                lookup_filter=lookup_filter,
+            )
+
+            progress.complete(total_rows, "Building indexes...")
 
-            def progress_callback(processed):
-                percent = int((processed / total_rows) * 100)
-                progress_recorder.set_progress(
-                    processed,
-                    total_rows,
-                    f"Processed {processed} \
-                        of {total_rows} records ({percent}%)",
+            # Утечка появляется в поиске только вместе со всеми строками
+            with transaction.atomic():
+                if staging:
+                    staging.publish()
+
+                bloom_filter = (
+                    lookup_filter.build()
+                    if lookup_filter is not None
+                    else build_bloom_filter(db_id)
+                )
+                ManagedDatabase.objects.filter(pk=db_id).update(
+                    bloom_filter=bloom_filter.to_bytes(),
+                    is_encrypted=True,
+                    encryption_started=False,
+                    checkpoint=None,
                 )
+                # Выключенная утечка после загрузки отсоединяется
+                sync_partition(ManagedDatabase.objects.get(pk=db_id))
+                transaction.on_commit(bump_generation)
 
-            encryptor.encrypt_database_cells(
-                progress_callback=progress_callback,
+            if Path(db_obj.file.path).exists():
+                Path(db_obj.file.path).unlink()
+
+            return progress_recorder.finish(
+                {
+                    "current": total_rows,
+                    "total": total_rows,
+                    "percent": 100,
+                    "description": "The task is completed!",
+                },
             )
 
+    except Exception as e:
+        # Уже загруженные порции сохранены вместе с контрольной точкой,
+        # повторный запуск продолжит с неё. Ошибки формата не повторяем.
+        if not isinstance(e, ValueError) and (
+            self.request.retries < self.max_retries
+        ):
+            raise self.retry(exc=e, countdown=settings.ENCRYPTION_RETRY_DELAY)
+
+        ManagedDatabase.objects.filter(pk=db_id).update(
+            encryption_started=False,
+        )
+        return progress_recorder.finish(
+            {
+                "current": 0,
+                "total": 100,
+                "percent": 0,
+                "description": f"Error: {str(e)}",
+            },
+        )
+
+
+@shared_task
+def backfill_lookups_task(db_id=None):
+    """Заполняет ключи поиска у ранее загруженных утечек"""
+    return {"updated": backfill_lookups(database_id=db_id)}
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def delete_database_task(self, db_id):
+    progress_recorder = CachedProgressRecorder(self.request.id)
+    try:
+        ManagedDatabase.objects.filter(pk=db_id).update(
+            progress_task_id=self.request.id,
+        )
+        progress_recorder.set_progress(0, 100, "Deleting...", force=True)
+
+        def progress_callback(deleted, total):
             progress_recorder.set_progress(
-                total_rows,
-                total_rows,
-                "Encryption is complete",
+                deleted,
+                total,
+                f"Deleted {deleted} of {total} rows",
             )
 
-            ManagedDatabase.objects.filter(pk=db_id).update(
-                is_encrypted=True,
-                encryption_started=False,
+        deleted = delete_database(db_id, progress_callback=progress_callback)
+        return progress_recorder.finish(
+            {
+                "current": deleted,
+                "total": deleted,
+                "percent": 100,
+                "description": f"The task is completed! {deleted} rows",
+            },
+        )
+
+    except Exception as e:
+        # Удалённые порции не возвращаются, повторный запуск продолжит
+        return progress_recorder.finish(
+            {
+                "current": 0,
+                "total": 100,
+                "percent": 0,
+                "description": f"Error: {str(e)}",
+            },
+        )
+
+
+@shared_task
+def rotate_keys_task():
+    """
+    Переводит все данные на текущий ключ шифрования: утечки
+    перешифровываются параллельно, по задаче на утечку, запросы
+    истории — отдельной задачей
+    """
+    databases = list(
+        ManagedDatabase.objects.filter(is_encrypted=True)
+        .exclude(key_version=settings.ENCRYPTION_KEY_VERSION)
+        .values_list("pk", flat=True),
+    )
+    group(
+        [rotate_database_key_task.s(db_id) for db_id in databases]
+        + [rotate_query_history_task.s()],
+    ).delay()
+    return {"databases": len(databases)}
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def rotate_database_key_task(self, db_id):
+    progress_recorder = CachedProgressRecorder(self.request.id)
+    try:
+        ManagedDatabase.objects.filter(pk=db_id).update(
+            progress_task_id=self.request.id,
+        )
+        progress_recorder.set_progress(
+            0,
+            100,
+            "Re-encrypting with the new key...",
+            force=True,
+        )
+
+        def progress_callback(processed, total):
+            progress_recorder.set_progress(
+                processed,
+                total,
+                f"Re-encrypted {processed} of {total} records",
             )
-            if Path(db_obj.file.path).exists():
-                Path(db_obj.file.path).unlink()
 
-            return {
-                "current": total_rows,
-                "total": total_rows,
+        rotated = rotate_database_key(
+            db_id,
+            progress_callback=progress_callback,
+        )
+        return progress_recorder.finish(
+            {
+                "current": rotated,
+                "total": rotated,
                 "percent": 100,
-                "description": "The task is completed!",
-            }
+                "description": (
+                    f"The task is completed! {rotated} records re-encrypted"
+                ),
+            },
+        )
 
     except Exception as e:
-        ManagedDatabase.objects.filter(pk=db_id).update(
-            encryption_started=False,
+        # Перешифрованные порции сохранены вместе с контрольной точкой,
+        # повторный запуск rotate_keys продолжит с неё
+        return progress_recorder.finish(
+            {
+                "current": 0,
+                "total": 100,
+                "percent": 0,
+                "description": f"Error: {str(e)}",
+            },
+        )
+
+
+@shared_task
+def rotate_query_history_task():
+    return {"updated": rotate_query_history()}
+
+
+@shared_task(acks_late=True)
+def save_search_history_task(user_id, query, lookups):
+    """
+    Сохраняет полный результат поиска в историю пользователя. Запрос
+    выводит только первую страницу, поэтому все утечки собираются здесь;
+    результат заодно кладётся в кэш для следующих страниц.
+    lookups — ключи поиска на всех версиях ключа в шестнадцатеричном
+    виде.
+    """
+    from search.views import SearchResultsMixin
+
+    results = get_cached_results(query, count=False)
+    if results is None:
+        results = SearchResultsMixin()._format_results(
+            DataRecord.objects.search(
+                [bytes.fromhex(lookup) for lookup in lookups],
+            ),
+        )
+        cache_results(query, results)
+
+    QueryHistory.objects.create(user_id=user_id, query=query, result=results)
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def bulk_search_task(self, job_id):
+    progress_recorder = CachedProgressRecorder(self.request.id)
+    try:
+        job = BulkSearchJob.objects.get(pk=job_id)
+        BulkSearchJob.objects.filter(pk=job_id).update(
+            progress_task_id=self.request.id,
+        )
+        total = count_identifiers(Path(job.file.path))
+        progress_recorder.set_progress(0, total, "Searching...", force=True)
+
+        def progress_callback(processed, matches):
+            progress_recorder.set_progress(
+                processed,
+                max(total, processed),
+                f"Checked {processed} of {total} identifiers, "
+                f"{matches} matches",
+            )
+
+        processed, matches, rate = run_bulk_search(job, progress_callback)
+        BulkSearchJob.objects.filter(pk=job_id).update(
+            identifiers_count=processed,
+            matches_count=matches,
+            finished_at=now(),
+        )
+        return progress_recorder.finish(
+            {
+                "current": processed,
+                "total": processed,
+                "percent": 100,
+                "description": (
+                    f"The task is completed! {matches} matches, "
+                    f"{rate:.0f} identifiers/s"
+                ),
+            },
+        )
+
+    except Exception as e:
+        return progress_recorder.finish(
+            {
+                "current": 0,
+                "total": 100,
+                "percent": 0,
+                "description": f"Error: {str(e)}",
+            },
         )
-        return {
-            "current": 0,
-            "total": 100,
-            "percent": 0,
-            "description": f"Error: {str(e)}",
-        }
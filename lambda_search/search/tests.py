@@ -0,0 +1,1733 @@
+import bz2
+import csv
+import gzip
+from http import HTTPStatus
+import json
+import lzma
+import multiprocessing
+from pathlib import Path
+import resource
+import sqlite3
+import tempfile
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.handlers.asgi import ASGIHandler
+from django.db import DatabaseError, transaction
+from django.test import override_settings, TestCase
+from django.urls import reverse
+from django.utils.timezone import now
+
+from history.models import QueryHistory
+from search.backfill import (
+    backfill_lookups,
+    backfill_record_summaries,
+    pack_records,
+)
+from search.bloom import (
+    BloomFilter,
+    build_bloom_filter,
+    get_bloom_filters,
+    IngestionBloomFilter,
+)
+from search.bulk import run_bulk_search
+from search.deletion import delete_database, estimate_row_count
+from search.encryptor import (
+    CellEncryptor,
+    get_file_extension,
+    KeyRing,
+    UnifiedEncryptor,
+)
+from search.handlers import (
+    CompressedCSVHandler,
+    CSVHandler,
+    JSONLinesHandler,
+    SQLiteHandler,
+)
+from search.loaders import (
+    BulkCreateDataLoader,
+    copy_escape,
+    get_data_loader,
+)
+from search.models import (
+    BulkSearchJob,
+    Data,
+    DataRecord,
+    DomainOwnership,
+    ManagedDatabase,
+    RecordLookup,
+)
+from search.partitions import (
+    is_partitioned,
+    partition_name,
+    sync_partition,
+)
+from search.progress import (
+    CachedProgressRecorder,
+    EstimatedRowProgress,
+    get_task_progress,
+    progress_cache_key,
+)
+from search.result_cache import (
+    cache_results,
+    get_cache_stats,
+    get_cached_results,
+    get_generation,
+)
+from search.rotation import rotate_database_key, rotate_query_history
+from search.staging import StagingTable
+from search.tasks import save_search_history_task
+from search.validators import DatabaseFileExtensionValidator
+
+__all__ = ()
+
+
+def _stream_rows(handler, queue):
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    total = handler.count_rows()
+    streamed = sum(1 for _ in handler.iter_rows())
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((total, streamed, (rss_after - rss_before) * 1024))
+
+
+class _ChunkSizes:
+    """Запоминает размеры порций, которые загрузка передаёт в фильтр"""
+
+    def __init__(self):
+        self.rows = []
+        self.cells = []
+
+    def add_chunk(self, rows_count, cells):
+        self.rows.append(rows_count)
+        self.cells.append(len(cells))
+
+
+class CSVHandlerTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+
+    def _write_csv(self, name, rows):
+        path = Path(self.tmp_dir.name) / name
+        with path.open("w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerows(rows)
+
+        return path
+
+    def test_encrypt_creates_data_per_cell(self):
+        path = self._write_csv(
+            "small.csv",
+            [
+                ["email", "phone"],
+                ["User@Mail.ru", "8 (999) 123-45-67"],
+                ["second@mail.ru", ""],
+            ],
+        )
+        database = ManagedDatabase.objects.create(
+            name="small",
+            file=f"protected/databases/{path.name}",
+        )
+        processed = []
+
+        CSVHandler(path, self.encryptor, workers=1).encrypt(processed.append)
+        database.refresh_from_db()
+
+        self.assertEqual(processed, [1, 2])
+        self.assertEqual(Data.objects.filter(database=database).count(), 3)
+        self.assertTrue(
+            Data.objects.filter(
+                database=database,
+                user_index=1,
+                column_index=database.columns.index("phone"),
+                value=self.encryptor.encrypt("79991234567"),
+                lookup=self.encryptor.lookup("79991234567"),
+            ).exists(),
+        )
+        self.assertEqual(
+            [
+                record.column_names
+                for record in DataRecord.objects.filter(
+                    database=database,
+                ).order_by("user_index")
+            ],
+            [["email", "phone"], ["email"]],
+        )
+        self.assertEqual(
+            Data.objects.filter(
+                database=database,
+                domain_lookup=self.encryptor.domain_lookup("mail.ru"),
+            ).count(),
+            2,
+        )
+
+    def test_long_cell_is_imported(self):
+        # Шифротекст больше предела строки индекса B-дерева PostgreSQL
+        value = "x" * 10_000
+        path = self._write_csv("long.csv", [["bio"], [value], [value]])
+        database = ManagedDatabase.objects.create(
+            name="long",
+            file=f"protected/databases/{path.name}",
+        )
+
+        CSVHandler(path, self.encryptor, workers=1).encrypt()
+
+        cells = Data.objects.filter(database=database)
+        self.assertEqual(cells.count(), 2)
+        self.assertEqual(
+            self.encryptor.decrypt(cells.first().value),
+            value,
+        )
+
+    def test_fast_count_rows(self):
+        rows = [["email"]] + [[f"user{i}@mail.ru"] for i in range(1000)]
+        path = self._write_csv("count.csv", rows)
+        handler = CSVHandler(path, self.encryptor)
+
+        self.assertEqual(handler.count_rows(), 1000)
+        self.assertEqual(handler.count_rows(exact=True), 1000)
+
+        with self.settings(ROW_COUNT_SAMPLE_THRESHOLD=0):
+            handler.SAMPLE_SIZE = 1024
+            handler.SAMPLES = 4
+            self.assertAlmostEqual(handler.count_rows(), 1000, delta=100)
+
+    def test_iter_rows_resumes_from_byte_offset(self):
+        path = self._write_csv(
+            "resume.csv",
+            [["email", "note"], ["a@mail.ru", "multi\nline"], ["b@mail.ru"]],
+        )
+        handler = CSVHandler(path, self.encryptor)
+        first, second = handler.iter_rows()
+
+        self.assertEqual(
+            list(handler.iter_rows(first[2])),
+            [second],
+        )
+        self.assertEqual(second[:2], (2, [("email", "b@mail.ru")]))
+
+    def test_encrypt_feeds_lookup_filter(self):
+        path = self._write_csv(
+            "filter.csv",
+            [["email", "phone"]]
+            + [[f"user{i}@mail.ru", ""] for i in range(50)],
+        )
+        database = ManagedDatabase.objects.create(
+            name="filter",
+            file=f"protected/databases/{path.name}",
+        )
+        lookup_filter = IngestionBloomFilter(10_000)
+
+        with self.settings(BATCH_SIZE=8):
+            CSVHandler(path, self.encryptor, workers=1).encrypt(
+                lookup_filter=lookup_filter,
+            )
+
+        bloom_filter = lookup_filter.build()
+
+        self.assertEqual(lookup_filter.count, 50)
+        self.assertTrue(
+            all(
+                lookup in bloom_filter
+                for lookup in Data.objects.filter(
+                    database=database,
+                ).values_list("lookup", flat=True)
+            ),
+        )
+        self.assertLess(len(bloom_filter), len(lookup_filter.bloom_filter))
+        self.assertLessEqual(
+            len(bloom_filter),
+            2 * len(build_bloom_filter(database.pk)),
+        )
+
+    def test_encrypt_resumes_from_checkpoint(self):
+        path = self._write_csv(
+            "retry.csv",
+            [["email"]] + [[f"user{i}@mail.ru"] for i in range(10)],
+        )
+        database = ManagedDatabase.objects.create(
+            name="retry",
+            file=f"protected/databases/{path.name}",
+        )
+        handler = CSVHandler(path, self.encryptor, workers=1)
+
+        def fail_after_first_chunk(processed):
+            if processed == 4:
+                raise RuntimeError("worker lost")
+
+        with self.settings(BATCH_SIZE=4):
+            with self.assertRaises(RuntimeError):
+                handler.encrypt(fail_after_first_chunk)
+
+            database.refresh_from_db()
+            self.assertEqual(database.checkpoint["processed"], 4)
+
+            processed = []
+            handler.encrypt(processed.append)
+
+        self.assertEqual(processed, list(range(5, 11)))
+        self.assertEqual(Data.objects.filter(database=database).count(), 10)
+
+    def _load_first_chunk(self, name, key):
+        path = self._write_csv(
+            name,
+            [["email"]] + [[f"user{i}@mail.ru"] for i in range(10)],
+        )
+        database = ManagedDatabase.objects.create(
+            name=name,
+            file=f"protected/databases/{path.name}",
+        )
+        handler = CSVHandler(
+            path,
+            CellEncryptor(database.start_ingestion(KeyRing({1: key}, 1))),
+            workers=1,
+        )
+
+        def fail_after_first_chunk(processed):
+            if processed == 4:
+                raise RuntimeError("worker lost")
+
+        with self.settings(BATCH_SIZE=4), self.assertRaises(RuntimeError):
+            handler.encrypt(fail_after_first_chunk)
+
+        database.refresh_from_db()
+        return path, database
+
+    def test_resume_keeps_key_of_loaded_chunks(self):
+        old_key = b"o" * 32
+        path, database = self._load_first_chunk("rekeyed.csv", old_key)
+
+        key = database.start_ingestion(
+            KeyRing({1: old_key, 2: settings.ENCRYPTION_KEY}, 2),
+        )
+        with self.settings(BATCH_SIZE=4):
+            CSVHandler(path, CellEncryptor(key), workers=1).encrypt()
+
+        database.refresh_from_db()
+        self.assertEqual(key, old_key)
+        self.assertEqual(database.key_version, 1)
+        self.assertEqual(
+            sorted(
+                CellEncryptor(old_key).decrypt_many(
+                    Data.objects.filter(database=database).values_list(
+                        "value",
+                        flat=True,
+                    ),
+                ),
+            ),
+            sorted(f"user{i}@mail.ru" for i in range(10)),
+        )
+
+    def test_resume_without_old_key_restarts_load(self):
+        path, database = self._load_first_chunk("restarted.csv", b"o" * 32)
+
+        key = database.start_ingestion(
+            KeyRing({2: settings.ENCRYPTION_KEY}, 2),
+        )
+
+        database.refresh_from_db()
+        self.assertEqual(key, settings.ENCRYPTION_KEY)
+        self.assertEqual(database.key_version, 2)
+        self.assertIsNone(database.checkpoint)
+        self.assertFalse(Data.objects.filter(database=database).exists())
+        self.assertFalse(DataRecord.objects.filter(database=database).exists())
+
+        processed = []
+        CSVHandler(path, CellEncryptor(key), workers=1).encrypt(
+            processed.append,
+        )
+        self.assertEqual(processed, list(range(1, 11)))
+        self.assertEqual(Data.objects.filter(database=database).count(), 10)
+
+    def test_pipeline_matches_serial_encryption(self):
+        path = self._write_csv(
+            "pipeline.csv",
+            [["email", "name"]]
+            + [[f"user{i}@mail.ru", f"Name{i}"] for i in range(3000)],
+        )
+        serial = CSVHandler(path, self.encryptor, workers=1)
+        pipeline = CSVHandler(path, self.encryptor, workers=2)
+
+        with self.settings(BATCH_SIZE=500):
+            self.assertEqual(
+                list(pipeline.iter_encrypted_chunks()),
+                list(serial.iter_encrypted_chunks()),
+            )
+
+    def _write_large_csv(self, name, rows_count):
+        path = Path(self.tmp_dir.name) / name
+        with path.open("w", newline="", encoding="utf-8") as file:
+            file.write("email,phone,name\n")
+            for i in range(rows_count):
+                file.write(f"user{i}@mail.ru,7999{i:07d},name{i}\n")
+
+        return path
+
+    def test_streaming_memory_ceiling(self):
+        rows_count = 2_000_000
+        path = self._write_large_csv("large.csv", rows_count)
+
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        process = context.Process(
+            target=_stream_rows,
+            args=(CSVHandler(path), queue),
+        )
+        process.start()
+        total, streamed, rss_growth = queue.get(timeout=300)
+        process.join()
+
+        self.assertEqual(total, rows_count)
+        self.assertEqual(streamed, rows_count)
+        self.assertLess(rss_growth, 16 * 1024 * 1024)
+
+    def test_encrypt_buffers_one_chunk(self):
+        rows_count = 100_000
+        path = self._write_large_csv("large_encrypt.csv", rows_count)
+        database = ManagedDatabase.objects.create(
+            name="large",
+            file=f"protected/databases/{path.name}",
+        )
+        chunks = _ChunkSizes()
+
+        with self.settings(ENCRYPTION_WORKERS=1):
+            processed = UnifiedEncryptor(
+                settings.ENCRYPTION_KEY,
+                file_path=path,
+            ).encrypt_database_cells(lookup_filter=chunks)
+
+        self.assertEqual(processed, rows_count)
+        self.assertEqual(sum(chunks.rows), rows_count)
+        self.assertEqual(
+            Data.objects.filter(database=database).count(),
+            3 * rows_count,
+        )
+        # В памяти одновременно только одна порция: не больше
+        # BATCH_SIZE ячеек, дополненных до конца последней строки
+        self.assertLessEqual(max(chunks.cells), settings.BATCH_SIZE + 2)
+        self.assertLessEqual(max(chunks.rows), settings.BATCH_SIZE // 3 + 1)
+
+
+class StreamingFormatsTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_compressed_csv_is_streamed(self):
+        content = "email,phone\n" + "".join(
+            f"user{i}@mail.ru,7999{i:07d}\n" for i in range(100)
+        )
+        for extension, opener in (
+            (".csv.gz", gzip.open),
+            (".csv.bz2", bz2.open),
+            (".csv.xz", lzma.open),
+        ):
+            with self.subTest(extension=extension):
+                path = Path(self.tmp_dir.name) / f"leak{extension}"
+                with opener(path, "wt", encoding="utf-8") as file:
+                    file.write(content)
+
+                handler = CompressedCSVHandler(path)
+                handler.validate()
+                rows = list(handler.iter_rows())
+
+                self.assertEqual(handler.count_rows(), 100)
+                self.assertEqual(
+                    rows[0][:2],
+                    (
+                        1,
+                        [("email", "user0@mail.ru"), ("phone", "79990000000")],
+                    ),
+                )
+                self.assertEqual(
+                    list(handler.iter_rows(rows[49][2])),
+                    rows[50:],
+                )
+
+    def test_json_lines_are_flattened(self):
+        path = Path(self.tmp_dir.name) / "leak.ndjson"
+        records = [
+            {"email": "a@mail.ru", "profile": {"phone": 79990000000}},
+            {"emails": ["b@mail.ru", "c@mail.ru"], "active": True},
+            "not an object",
+        ]
+        path.write_text(
+            "\n\n".join(json.dumps(record) for record in records) + "\n",
+        )
+        handler = JSONLinesHandler(path)
+        handler.validate()
+
+        self.assertEqual(
+            [row[:2] for row in handler.iter_rows()],
+            [
+                (
+                    1,
+                    [("email", "a@mail.ru"), ("profile.phone", "79990000000")],
+                ),
+                (2, [("emails", "b@mail.ru"), ("emails", "c@mail.ru")]),
+                (3, []),
+            ],
+        )
+        self.assertEqual(handler.count_rows(exact=True), 3)
+
+    def test_compound_extensions(self):
+        validator = DatabaseFileExtensionValidator(["csv", "csv.gz"])
+
+        self.assertEqual(get_file_extension("Leak.CSV.gz"), ".csv.gz")
+        self.assertEqual(get_file_extension("leak.v2.jsonl"), ".jsonl")
+        self.assertIsNone(get_file_extension("leak.sqlite.gz"))
+        validator(ContentFile(b"", name="leak.csv.gz"))
+        with self.assertRaises(ValidationError):
+            validator(ContentFile(b"", name="leak.sqlite.gz"))
+
+
+class SQLiteHandlerTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _create_database(self, rows_count):
+        path = Path(self.tmp_dir.name) / "leak.sqlite"
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE "user list" (email TEXT, age INTEGER)')
+        conn.executemany(
+            'INSERT INTO "user list" VALUES (?, ?)',
+            ((f"user{i}@mail.ru", i) for i in range(rows_count)),
+        )
+        conn.commit()
+        conn.close()
+        return path
+
+    def test_iter_rows_fetches_in_chunks(self):
+        path = self._create_database(25)
+        handler = SQLiteHandler(path, fetch_size=10)
+
+        rows = list(handler.iter_rows())
+
+        self.assertEqual(handler.count_rows(), 25)
+        self.assertEqual(
+            rows[0],
+            (
+                1,
+                [("email", "user0@mail.ru")],
+                {"table": "user list", "rowid": 1},
+            ),
+        )
+        self.assertEqual(len(rows), 25)
+
+    @override_settings(BATCH_SIZE=1)
+    def test_tables_share_record_summaries(self):
+        path = Path(self.tmp_dir.name) / "tables.sqlite"
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE users (email TEXT)")
+        conn.execute("CREATE TABLE passwords (password TEXT)")
+        conn.execute("INSERT INTO users VALUES ('user@mail.ru')")
+        conn.execute("INSERT INTO passwords VALUES ('secret')")
+        conn.commit()
+        conn.close()
+        database = ManagedDatabase.objects.create(
+            name="tables",
+            file=f"protected/databases/{path.name}",
+        )
+
+        SQLiteHandler(path, CellEncryptor(settings.ENCRYPTION_KEY)).encrypt()
+
+        record = DataRecord.objects.select_related("database").get()
+        self.assertEqual(record.column_names, ["email", "password"])
+        self.assertEqual(Data.objects.filter(database=database).count(), 2)
+
+    def test_fast_count_rows(self):
+        path = self._create_database(25)
+        conn = sqlite3.connect(path)
+        conn.execute('DELETE FROM "user list" WHERE rowid <= 5')
+        conn.commit()
+        handler = SQLiteHandler(path)
+
+        self.assertEqual(handler.count_rows(), 25)
+        self.assertEqual(handler.count_rows(exact=True), 20)
+
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.close()
+        self.assertEqual(handler.count_rows(), 20)
+
+    def test_iter_rows_resumes_after_checkpoint(self):
+        handler = SQLiteHandler(self._create_database(25), fetch_size=10)
+
+        rows = list(handler.iter_rows({"table": "user list", "rowid": 20}))
+
+        self.assertEqual([row[0] for row in rows], [21, 22, 23, 24, 25])
+
+    def test_source_is_opened_read_only(self):
+        conn = SQLiteHandler(self._create_database(1)).connect()
+        self.addCleanup(conn.close)
+
+        with self.assertRaises(sqlite3.Error):
+            conn.execute('DELETE FROM "user list"')
+
+    def test_streaming_memory_ceiling(self):
+        rows_count = 1_000_000
+        handler = SQLiteHandler(self._create_database(rows_count))
+        # Страницы mmap принадлежат файлу и учитываются в RSS,
+        # поэтому проверяем рост только собственной памяти процесса.
+        handler.MMAP_SIZE = 0
+
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        process = context.Process(target=_stream_rows, args=(handler, queue))
+        process.start()
+        total, streamed, rss_growth = queue.get(timeout=300)
+        process.join()
+
+        self.assertEqual(total, rows_count)
+        self.assertEqual(streamed, rows_count)
+        self.assertLess(rss_growth, 16 * 1024 * 1024)
+
+
+class CellEncryptorTest(TestCase):
+    def setUp(self):
+        self.encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        self.values = [
+            "",
+            "a",
+            "x" * 15,
+            "y" * 16,
+            "user@mail.ru",
+            "79991234567",
+            "пароль" * 10,
+        ]
+
+    def test_encrypt_many_matches_encrypt(self):
+        self.assertEqual(
+            self.encryptor.encrypt_many(self.values),
+            [self.encryptor.encrypt(value) for value in self.values],
+        )
+
+    def test_decrypt_many_roundtrip(self):
+        encrypted = [self.encryptor.encrypt(value) for value in self.values]
+
+        self.assertEqual(self.encryptor.decrypt_many(encrypted), self.values)
+
+    def test_empty_batches(self):
+        self.assertEqual(self.encryptor.encrypt_many([]), [])
+        self.assertEqual(self.encryptor.decrypt_many([]), [])
+
+    def test_lookup_is_keyed_and_fixed_width(self):
+        lookups = self.encryptor.lookup_many(self.values)
+
+        self.assertEqual(len(set(lookups)), len(self.values))
+        self.assertTrue(all(len(lookup) == 16 for lookup in lookups))
+        self.assertEqual(lookups[4], self.encryptor.lookup("user@mail.ru"))
+        self.assertNotEqual(
+            CellEncryptor(b"k" * 32).lookup("user@mail.ru"),
+            lookups[4],
+        )
+
+
+class BloomFilterTest(TestCase):
+    def test_false_positive_rate(self):
+        encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        bloom_filter = BloomFilter.for_capacity(10_000, 0.01)
+        added = encryptor.lookup_many(f"in{i}" for i in range(10_000))
+        for lookup in added:
+            bloom_filter.add(lookup)
+
+        restored = BloomFilter.from_bytes(bloom_filter.to_bytes())
+        false_positives = sum(
+            lookup in restored
+            for lookup in encryptor.lookup_many(
+                f"out{i}" for i in range(10_000)
+            )
+        )
+
+        self.assertTrue(all(lookup in restored for lookup in added))
+        self.assertLess(false_positives, 200)
+        self.assertLess(len(restored), 12_500)
+
+    def test_fold_keeps_lookups(self):
+        encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        bloom_filter = BloomFilter(1 << 20, 7)
+        added = encryptor.lookup_many(f"in{i}" for i in range(1000))
+        for lookup in added:
+            bloom_filter.add(lookup)
+
+        folded = bloom_filter.fold(1 << 14)
+
+        self.assertEqual(len(folded), (1 << 14) // 8)
+        self.assertTrue(all(lookup in folded for lookup in added))
+
+    def test_ingestion_filter_fits_overestimated_load(self):
+        encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        lookup_filter = IngestionBloomFilter(1_000_000, 0.01)
+        added = encryptor.lookup_many(f"in{i}" for i in range(10_000))
+        for start in range(0, len(added), 1000):
+            lookup_filter.add_chunk(
+                500,
+                [
+                    (index, 0, b"", lookup, None)
+                    for index, lookup in enumerate(
+                        added[start : start + 1000],
+                    )
+                ]
+                + [(0, 1, b"", None, None)],
+            )
+
+        bloom_filter = lookup_filter.build()
+        false_positives = sum(
+            lookup in bloom_filter
+            for lookup in encryptor.lookup_many(
+                f"out{i}" for i in range(10_000)
+            )
+        )
+
+        self.assertTrue(all(lookup in bloom_filter for lookup in added))
+        self.assertLess(false_positives, 200)
+        self.assertLess(len(bloom_filter), 2 * 12_500)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+)
+class SearchLookupTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        self.database = ManagedDatabase.objects.create(
+            name="lookup",
+            active=True,
+            is_encrypted=True,
+            columns=["email", "phone", "password"],
+        )
+
+    def _create(self, user_index, column_name, value, lookup=True):
+        return Data.objects.create(
+            database=self.database,
+            user_index=user_index,
+            column_index=self.database.columns.index(column_name),
+            value=self.encryptor.encrypt(value),
+            lookup=self.encryptor.lookup(value) if lookup else None,
+        )
+
+    def test_search_matches_lookup(self):
+        self._create(1, "email", "user@mail.ru")
+        self._create(1, "phone", "79991234567")
+        self._create(2, "email", "other@mail.ru")
+
+        results = Data.objects.search(self.encryptor.lookup("user@mail.ru"))
+
+        self.assertEqual(
+            sorted(item.column_name for item in results),
+            ["email", "phone"],
+        )
+        self.assertFalse(
+            Data.objects.search(self.encryptor.lookup("none@mail.ru")),
+        )
+
+    def test_search_is_a_single_query(self):
+        for user_index in range(50):
+            self._create(user_index, "email", "user@mail.ru")
+            self._create(user_index, "password", f"secret{user_index}")
+
+        get_bloom_filters()
+        with self.assertNumQueries(1):
+            results = list(
+                Data.objects.search(self.encryptor.lookup("user@mail.ru")),
+            )
+
+        self.assertEqual(len(results), 100)
+
+    def test_bloom_filter_skips_leaks_without_key(self):
+        self._create(1, "email", "user@mail.ru")
+        ManagedDatabase.objects.filter(pk=self.database.pk).update(
+            bloom_filter=build_bloom_filter(self.database.pk).to_bytes(),
+        )
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            self.assertFalse(
+                Data.objects.search(self.encryptor.lookup("none@mail.ru")),
+            )
+
+        self.assertTrue(
+            Data.objects.search(self.encryptor.lookup("user@mail.ru")),
+        )
+
+    def test_record_summaries_resume_after_last_chunk(self):
+        for user_index in range(3):
+            self._create(user_index, "email", f"user{user_index}@mail.ru")
+
+        backfill_record_summaries(batch_size=1)
+        DataRecord.objects.filter(user_index__gt=0).delete()
+
+        self.assertEqual(backfill_record_summaries(batch_size=1), 2)
+        self.assertEqual(
+            list(
+                DataRecord.objects.order_by("user_index").values_list(
+                    "user_index",
+                    flat=True,
+                ),
+            ),
+            [0, 1, 2],
+        )
+
+    def test_record_search_reads_one_row_per_record(self):
+        for user_index in range(3):
+            self._create(user_index, "email", f"user{user_index}@mail.ru")
+            self._create(user_index, "password", "secret")
+
+        self.assertEqual(backfill_record_summaries(), 3)
+        self.assertEqual(backfill_record_summaries(), 0)
+
+        get_bloom_filters()
+        with self.assertNumQueries(1):
+            records = list(
+                DataRecord.objects.search(self.encryptor.lookup("secret")),
+            )
+
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0].column_names, ["email", "password"])
+
+    def test_backfill_fills_missing_lookups(self):
+        self._create(1, "email", "user@mail.ru", lookup=False)
+        self._create(2, "email", "other@mail.ru")
+        Data.objects.create(
+            database=self.database,
+            user_index=3,
+            column_index=0,
+            value=b"\xff" * 127,
+        )
+
+        updated = backfill_lookups(batch_size=1)
+
+        self.assertEqual(updated, 1)
+        self.assertEqual(
+            Data.objects.get(user_index=1).lookup,
+            self.encryptor.lookup("user@mail.ru"),
+        )
+        self.assertIsNone(Data.objects.get(user_index=3).lookup)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+)
+class PackedStorageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        self.database = ManagedDatabase.objects.create(
+            name="packed",
+            active=True,
+            is_encrypted=True,
+            columns=["email", "password"],
+        )
+        for user_index, column_index, value in (
+            (1, 0, "first@corp.ru"),
+            (1, 1, "secret"),
+            (2, 0, "second@corp.ru"),
+            (2, 1, "secret"),
+        ):
+            Data.objects.create(
+                database=self.database,
+                user_index=user_index,
+                column_index=column_index,
+                value=self.encryptor.encrypt(value),
+                lookup=self.encryptor.lookup(value),
+                domain_lookup=(
+                    self.encryptor.domain_lookup("corp.ru")
+                    if column_index == 0
+                    else None
+                ),
+            )
+
+    def test_records_are_searchable_after_packing(self):
+        self.assertEqual(pack_records(self.database.pk, batch_size=1), 2)
+        self.assertEqual(pack_records(self.database.pk), 0)
+
+        self.database.refresh_from_db()
+        self.assertEqual(
+            self.database.storage,
+            ManagedDatabase.STORAGE_RECORDS,
+        )
+        self.assertFalse(Data.objects.exists())
+        self.assertEqual(RecordLookup.objects.count(), 6)
+
+        lookup = self.encryptor.lookup("secret")
+        records = list(DataRecord.objects.search(lookup))
+        self.assertEqual([record.user_index for record in records], [1, 2])
+        self.assertEqual(records[0].column_names, ["email", "password"])
+        record = DataRecord.objects.select_related("database").get(
+            user_index=2,
+        )
+        self.assertEqual(
+            [
+                (name, self.encryptor.decrypt(value))
+                for name, value in record.cells
+            ],
+            [("email", "second@corp.ru"), ("password", "secret")],
+        )
+        self.assertEqual(
+            Data.objects.search_many([lookup]),
+            {lookup: {"packed": {"email", "password"}}},
+        )
+        self.assertEqual(
+            list(Data.objects.search_databases(lookup)),
+            [self.database],
+        )
+        self.assertEqual(
+            DataRecord.objects.search_domain(
+                self.encryptor.domain_lookup("corp.ru"),
+            ).count(),
+            2,
+        )
+
+    def test_cell_longer_than_short_length_is_packed(self):
+        value = self.encryptor.encrypt("x" * 70_000)
+        Data.objects.filter(user_index=2, column_index=1).update(value=value)
+
+        pack_records(self.database.pk)
+
+        record = DataRecord.objects.select_related("database").get(
+            user_index=2,
+        )
+        self.assertEqual(record.cells[1], ("password", value))
+
+    def test_packing_finishes_deleting_cells(self):
+        pack_records(self.database.pk)
+        Data.objects.create(
+            database=self.database,
+            user_index=3,
+            column_index=0,
+            value=self.encryptor.encrypt("left@corp.ru"),
+        )
+
+        self.assertEqual(pack_records(self.database.pk, batch_size=1), 0)
+        self.assertFalse(Data.objects.exists())
+
+    def test_cells_without_lookups_are_not_packed(self):
+        Data.objects.filter(user_index=2).update(lookup=None)
+
+        with self.assertRaises(ValueError):
+            pack_records(self.database.pk)
+
+        self.assertEqual(Data.objects.count(), 4)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+)
+class KeyRotationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.keyring = KeyRing(
+            {1: b"o" * 32, 2: settings.ENCRYPTION_KEY},
+            2,
+        )
+        self.old = self.keyring.get(1)
+        self.database = ManagedDatabase.objects.create(
+            name="rotated",
+            active=True,
+            is_encrypted=True,
+            columns=["email", "password"],
+        )
+        for user_index, column_index, value in (
+            (1, 0, "first@corp.ru"),
+            (1, 1, "secret"),
+            (2, 0, "second@corp.ru"),
+            (2, 1, "secret"),
+        ):
+            Data.objects.create(
+                database=self.database,
+                user_index=user_index,
+                column_index=column_index,
+                value=self.old.encrypt(value),
+                lookup=self.old.lookup(value),
+                domain_lookup=(
+                    self.old.domain_lookup("corp.ru")
+                    if column_index == 0
+                    else None
+                ),
+            )
+
+        backfill_record_summaries()
+
+    def test_search_probes_both_versions_during_rotation(self):
+        rotated = Data.objects.filter(user_index=1)
+        for row in rotated:
+            value = self.old.decrypt(row.value)
+            row.value = self.keyring.current.encrypt(value)
+            row.lookup = self.keyring.current.lookup(value)
+            if row.domain_lookup:
+                row.domain_lookup = self.keyring.current.domain_lookup(
+                    "corp.ru",
+                )
+
+            row.save()
+
+        ManagedDatabase.objects.filter(pk=self.database.pk).update(
+            rotation_checkpoint=2,
+        )
+
+        self.assertEqual(
+            [
+                record.user_index
+                for record in DataRecord.objects.search(
+                    self.keyring.lookups("secret"),
+                )
+            ],
+            [1, 2],
+        )
+        self.assertEqual(
+            rotate_database_key(self.database.pk, keyring=self.keyring),
+            1,
+        )
+
+        self.database.refresh_from_db()
+        self.assertEqual(self.database.key_version, 2)
+        self.assertIsNone(self.database.rotation_checkpoint)
+        self.assertIn(
+            self.keyring.current.lookup("secret"),
+            BloomFilter.from_bytes(bytes(self.database.bloom_filter)),
+        )
+        self.assertEqual(
+            sorted(
+                self.keyring.current.decrypt(value)
+                for value in Data.objects.values_list("value", flat=True)
+            ),
+            ["first@corp.ru", "second@corp.ru", "secret", "secret"],
+        )
+        self.assertEqual(
+            DataRecord.objects.search_domain(
+                self.keyring.current.domain_lookup("corp.ru"),
+            ).count(),
+            2,
+        )
+
+    def test_packed_records_are_rotated(self):
+        pack_records(self.database.pk)
+        progress = []
+
+        self.assertEqual(
+            rotate_database_key(
+                self.database.pk,
+                batch_size=1,
+                progress_callback=lambda done, total: progress.append(done),
+                keyring=self.keyring,
+            ),
+            2,
+        )
+
+        self.assertEqual(progress, [2, 3])
+        self.assertEqual(RecordLookup.objects.count(), 6)
+        self.assertFalse(
+            DataRecord.objects.search(self.old.lookup("secret")).exists(),
+        )
+        record = DataRecord.objects.select_related("database").get(
+            user_index=1,
+        )
+        self.assertEqual(
+            [
+                (name, self.keyring.current.decrypt(value))
+                for name, value in record.cells
+            ],
+            [("email", "first@corp.ru"), ("password", "secret")],
+        )
+
+    def test_query_history_is_rotated(self):
+        user = get_user_model().objects.create_user(
+            username="rotation",
+            password="password",
+        )
+        history = QueryHistory.objects.create(
+            user=user,
+            query=self.old.encrypt("secret").hex(),
+            result=[],
+        )
+
+        self.assertEqual(rotate_query_history(keyring=self.keyring), 1)
+        self.assertEqual(rotate_query_history(keyring=self.keyring), 0)
+
+        history.refresh_from_db()
+        self.assertTrue(history.query.startswith("2-"))
+        self.assertEqual(self.keyring.decrypt_token(history.query), "secret")
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+)
+class DatabaseDeletionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        self.database = ManagedDatabase.objects.create(
+            name="deleted",
+            active=True,
+            is_encrypted=True,
+            columns=["email"],
+        )
+        for user_index in range(3):
+            value = f"user{user_index}@mail.ru"
+            Data.objects.create(
+                database=self.database,
+                user_index=user_index,
+                column_index=0,
+                value=self.encryptor.encrypt(value),
+                lookup=self.encryptor.lookup(value),
+            )
+
+        backfill_record_summaries()
+
+    def test_deletion_hides_leak_and_removes_rows_in_chunks(self):
+        self.assertEqual(
+            estimate_row_count(self.database),
+            {Data: 3, DataRecord: 3},
+        )
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.database.schedule_deletion()
+
+        self.assertEqual(len(callbacks), 2)
+        self.database.refresh_from_db()
+        self.assertTrue(self.database.is_deleting)
+        self.assertFalse(self.database.active)
+        self.assertFalse(
+            DataRecord.objects.search(
+                self.encryptor.lookup("user1@mail.ru"),
+            ).exists(),
+        )
+
+        progress = []
+        self.assertEqual(
+            delete_database(
+                self.database.pk,
+                batch_size=2,
+                progress_callback=lambda done, total: progress.append(done),
+            ),
+            6,
+        )
+
+        self.assertEqual(progress, [2, 3, 5, 6])
+        self.assertFalse(ManagedDatabase.objects.exists())
+        self.assertFalse(Data.objects.exists())
+        self.assertFalse(DataRecord.objects.exists())
+
+    @override_settings(ROW_COUNT_ESTIMATE_LIMIT=2)
+    def test_row_count_estimate_is_bounded(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                estimate_row_count(self.database),
+                {Data: 2, DataRecord: 2},
+            )
+
+    def test_unmarked_leak_is_not_deleted(self):
+        with self.assertRaises(ValueError):
+            delete_database(self.database.pk)
+
+        self.assertEqual(Data.objects.count(), 3)
+
+
+class DataLoaderTest(TestCase):
+    def test_copy_escape(self):
+        self.assertEqual(
+            copy_escape("a\tb\nc\\d\re"),
+            "a\\tb\\nc\\\\d\\re",
+        )
+        self.assertEqual(copy_escape(None), "\\N")
+        self.assertEqual(copy_escape(b"\x00\xff"), "\\\\x00ff")
+
+    def test_sqlite_falls_back_to_bulk_create(self):
+        database = ManagedDatabase.objects.create(name="loader")
+        loader = get_data_loader(database)
+
+        loader.load(
+            [
+                (1, 0, b"\x00\xff", b"\xa1", b"\xd1"),
+                (2, 0, b"\xff\x00", b"\xb2", None),
+            ],
+        )
+
+        self.assertIs(type(loader), BulkCreateDataLoader)
+        self.assertEqual(Data.objects.filter(database=database).count(), 2)
+
+
+class PartitionTest(TestCase):
+    def test_sqlite_keeps_data_unpartitioned(self):
+        database = ManagedDatabase.objects.create(
+            name="partition",
+            columns=["email"],
+        )
+        Data.objects.create(
+            database=database,
+            user_index=1,
+            column_index=0,
+            value=b"\x00\xff",
+        )
+        database.is_encrypted = True
+        database.save()
+
+        sync_partition(database)
+        database.delete()
+
+        self.assertFalse(is_partitioned())
+        self.assertEqual(partition_name(7), "search_data_p7")
+        self.assertFalse(Data.objects.exists())
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+)
+class CachedProgressRecorderTest(TestCase):
+    def test_updates_are_coalesced(self):
+        recorder = CachedProgressRecorder(
+            "task",
+            min_interval=3600,
+            min_step=100,
+        )
+
+        stored = [
+            recorder.set_progress(current, 1000, f"{current}")
+            for current in range(1, 1001)
+        ]
+
+        self.assertEqual(stored.count(True), 11)
+        self.assertEqual(
+            cache.get(progress_cache_key("task"))["current"],
+            1000,
+        )
+
+    def test_overestimated_total_is_corrected_after_last_row(self):
+        recorder = CachedProgressRecorder(
+            "estimated",
+            min_interval=3600,
+            min_step=100,
+        )
+        progress = EstimatedRowProgress(recorder, 1000)
+
+        for processed in range(1, 11):
+            progress(processed)
+
+        self.assertEqual(
+            cache.get(progress_cache_key("estimated"))["total"],
+            1000,
+        )
+
+        progress.complete(10)
+
+        state = cache.get(progress_cache_key("estimated"))
+        self.assertEqual((state["current"], state["total"]), (10, 10))
+        self.assertEqual(state["percent"], 100)
+
+    def test_final_state_is_readable_from_cache(self):
+        recorder = CachedProgressRecorder("finished")
+        result = recorder.finish({"percent": 100})
+
+        self.assertEqual(get_task_progress("finished"), result)
+        self.assertIsNone(get_task_progress("unknown"))
+
+
+class StagingTableTest(TestCase):
+    def test_rows_appear_in_data_only_after_publish(self):
+        database = ManagedDatabase.objects.create(name="staging")
+        staging = StagingTable(database)
+        staging.create()
+        loader = get_data_loader(database, staging.name)
+
+        loader.load(
+            [
+                (2, 0, b"\xff\x00", b"\xb2", None),
+                (1, 0, b"\x00\xff", b"\xa1", b"\xd1"),
+            ],
+        )
+        loader.load([(1, 0, b"\x00\xff", b"\xa1", b"\xd1")])
+
+        self.assertFalse(Data.objects.filter(database=database).exists())
+
+        staging.publish()
+
+        self.assertEqual(
+            list(
+                Data.objects.filter(database=database)
+                .order_by("user_index")
+                .values_list("user_index", "value"),
+            ),
+            [(1, b"\x00\xff"), (2, b"\xff\x00")],
+        )
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            get_data_loader(database, staging.name).load(
+                [(3, "a", "b", "c", None)],
+            )
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+)
+class SearchResultCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_hits_and_misses_are_counted(self):
+        self.assertIsNone(get_cached_results("query"))
+
+        cache_results("query", [{"database": "leak"}])
+
+        self.assertEqual(get_cached_results("query"), [{"database": "leak"}])
+        self.assertEqual(
+            {
+                key: value
+                for key, value in get_cache_stats().items()
+                if key != "generation"
+            },
+            {"hits": 1, "misses": 1, "hit_rate": 0.5},
+        )
+
+    def test_leak_changes_invalidate_results(self):
+        cache_results("query", [])
+        generation = get_generation()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            database = ManagedDatabase.objects.create(name="cache")
+
+        self.assertIsNone(get_cached_results("query"))
+
+        cache_results("query", [])
+        with self.captureOnCommitCallbacks(execute=True):
+            database.delete()
+
+        self.assertIsNone(get_cached_results("query"))
+        self.assertEqual(get_generation(), generation + 2)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+)
+class BulkSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        media = override_settings(MEDIA_ROOT=self.tmp_dir.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        self.user = get_user_model().objects.create_user(
+            username="bulk",
+            password="password",
+        )
+        database = ManagedDatabase.objects.create(
+            name="leak",
+            active=True,
+            is_encrypted=True,
+            columns=["email", "phone", "password"],
+        )
+        for user_index, column_name, value in (
+            (1, "email", "user@mail.ru"),
+            (1, "phone", "79991234567"),
+            (1, "password", "secret"),
+            (2, "email", "other@mail.ru"),
+        ):
+            Data.objects.create(
+                database=database,
+                user_index=user_index,
+                column_index=database.columns.index(column_name),
+                value=self.encryptor.encrypt(value),
+                lookup=self.encryptor.lookup(value),
+            )
+
+        backfill_record_summaries()
+
+    def test_results_are_written_per_match(self):
+        job = BulkSearchJob.objects.create(
+            user=self.user,
+            file=ContentFile(
+                b"user@mail.ru\n\n8 (999) 123-45-67\nnone@mail.ru\n",
+                name="list.txt",
+            ),
+        )
+
+        get_bloom_filters()
+        # Файл результатов и по два запроса на порцию, во второй
+        # порции совпадений нет
+        with self.assertNumQueries(4):
+            processed, matches, _ = run_bulk_search(job, batch_size=2)
+
+        job.refresh_from_db()
+        with job.result.open("r") as file:
+            rows = list(csv.reader(file))
+
+        self.assertEqual((processed, matches), (3, 2))
+        self.assertEqual(
+            rows,
+            [
+                ["identifier", "database", "columns"],
+                ["user@mail.ru", "leak", "email;password;phone"],
+                ["8 (999) 123-45-67", "leak", "email;password;phone"],
+            ],
+        )
+
+    def test_results_are_private(self):
+        job = BulkSearchJob.objects.create(
+            user=self.user,
+            file=ContentFile(b"user@mail.ru\n", name="list.txt"),
+        )
+        run_bulk_search(job)
+        BulkSearchJob.objects.filter(pk=job.pk).update(finished_at=now())
+        other = get_user_model().objects.create_user(
+            username="other",
+            password="password",
+        )
+
+        self.client.force_login(other)
+        response = self.client.get(
+            reverse("search:bulk_search_download", args=[job.pk]),
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse("search:bulk_search_download", args=[job.pk]),
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+    CAPTCHA_ENABLED=False,
+    ITEMS_PER_PAGE=5,
+)
+class SearchPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        for index in range(7):
+            database = ManagedDatabase.objects.create(
+                name=f"leak{index}",
+                active=True,
+                is_encrypted=True,
+                columns=["email"],
+            )
+            Data.objects.create(
+                database=database,
+                user_index=1,
+                column_index=0,
+                value=self.encryptor.encrypt("user@mail.ru"),
+                lookup=self.encryptor.lookup("user@mail.ru"),
+            )
+
+        backfill_record_summaries()
+        self.user = get_user_model().objects.create_user(
+            username="pages",
+            password="password",
+        )
+        self.client.force_login(self.user)
+
+    def test_results_are_paginated_over_leaks(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                reverse("search:search"),
+                {"search_query": "user@mail.ru"},
+            )
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(
+            [result["database"] for result in response.context["results"]],
+            [f"leak{index}" for index in range(5)],
+        )
+        self.assertEqual(response.context["page_obj"].paginator.count, 7)
+        self.assertFalse(self.user.query_histories.exists())
+
+        response = self.client.get(
+            reverse("search:search"),
+            {"query": response.context["query"], "page": 2},
+        )
+
+        self.assertEqual(
+            [result["database"] for result in response.context["results"]],
+            ["leak5", "leak6"],
+        )
+
+    def test_history_is_saved_in_background(self):
+        query = self.encryptor.encrypt("user@mail.ru").hex()
+
+        save_search_history_task(
+            self.user.pk,
+            query,
+            [self.encryptor.lookup("user@mail.ru").hex()],
+        )
+
+        self.assertEqual(
+            len(self.user.query_histories.get(query=query).result),
+            7,
+        )
+        self.assertEqual(len(get_cached_results(query)), 7)
+
+    def test_stream_returns_all_leaks(self):
+        response = self.client.post(
+            reverse("search:search_stream"),
+            {"search_query": "user@mail.ru"},
+        )
+
+        results = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(
+            [result["database"] for result in results["results"]],
+            [f"leak{index}" for index in range(7)],
+        )
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+    CAPTCHA_ENABLED=False,
+)
+class AsyncSearchViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        database = ManagedDatabase.objects.create(
+            name="leak",
+            active=True,
+            is_encrypted=True,
+            columns=["email", "password"],
+        )
+        for column_name, value in (
+            ("email", "user@mail.ru"),
+            ("password", "secret"),
+        ):
+            Data.objects.create(
+                database=database,
+                user_index=1,
+                column_index=database.columns.index(column_name),
+                value=encryptor.encrypt(value),
+                lookup=encryptor.lookup(value),
+            )
+
+        backfill_record_summaries()
+        self.user = get_user_model().objects.create_user(
+            username="async",
+            password="password",
+        )
+
+    def test_search_returns_categories_and_saves_history(self):
+        self.client.force_login(self.user)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            for _ in range(2):
+                response = self.client.post(
+                    reverse("search:search_api"),
+                    {"search_query": "user@mail.ru"},
+                )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {
+                    "database": "leak",
+                    "history": "История об этой базе не найдена",
+                    "data": {
+                        "critical": ["email", "password"],
+                        "medium": [],
+                        "low": [],
+                    },
+                },
+            ],
+        )
+        # История сохраняется задачей, а не в запросе
+        self.assertEqual(len(callbacks), 2)
+        self.assertFalse(self.user.query_histories.exists())
+        self.assertEqual(get_cache_stats()["hits"], 1)
+
+    def test_async_request_resolves_user_in_view(self):
+        self.async_client.force_login(self.user)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = async_to_sync(self.async_client.post)(
+                reverse("search:search_api"),
+                {"search_query": "user@mail.ru"},
+            )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.json()["results"]), 1)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_anonymous_request_is_rejected(self):
+        response = self.client.post(
+            reverse("search:search_api"),
+            {"search_query": "user@mail.ru"},
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_middleware_chain_stays_async(self):
+        # Панель отладки подключается только при DEBUG
+        with self.settings(
+            MIDDLEWARE=[
+                middleware
+                for middleware in settings.MIDDLEWARE
+                if not middleware.startswith("debug_toolbar.")
+            ],
+        ):
+            handler = ASGIHandler()
+
+        # Синхронная прослойка разорвала бы цепочку адаптером SyncToAsync
+        middleware = handler._middleware_chain
+        while hasattr(middleware, "get_response"):
+            self.assertTrue(iscoroutinefunction(middleware), middleware)
+            middleware = middleware.get_response
+
+        self.assertEqual(middleware.__wrapped__, handler._get_response_async)
+
+    def test_protected_media_is_hidden_from_async_requests(self):
+        response = async_to_sync(self.async_client.get)(
+            "/media/protected/databases/leak.csv",
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class DomainSearchViewTest(TestCase):
+    def setUp(self):
+        encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        database = ManagedDatabase.objects.create(
+            name="leak",
+            active=True,
+            is_encrypted=True,
+            columns=["email", "password"],
+        )
+        for user_index, column_name, value in (
+            (1, "email", "first@corp.ru"),
+            (1, "password", "secret"),
+            (2, "email", "second@corp.ru"),
+            (3, "email", "third@other.ru"),
+        ):
+            domain = value.rsplit("@", 1)[-1] if "@" in value else None
+            Data.objects.create(
+                database=database,
+                user_index=user_index,
+                column_index=database.columns.index(column_name),
+                value=encryptor.encrypt(value),
+                lookup=encryptor.lookup(value),
+                domain_lookup=(
+                    encryptor.domain_lookup(domain) if domain else None
+                ),
+            )
+
+        backfill_record_summaries()
+        self.user = get_user_model().objects.create_user(
+            username="owner",
+            password="password",
+        )
+        self.client.force_login(self.user)
+
+    def _search(self, domain):
+        return self.client.post(
+            reverse("search:domain_search"),
+            {"domain": domain},
+        )
+
+    def test_unverified_owner_is_rejected(self):
+        DomainOwnership.objects.create(user=self.user, domain="corp.ru")
+
+        response = self._search("corp.ru")
+
+        self.assertFalse(response.context.get("results"))
+        self.assertTrue(response.context["form"].errors)
+
+    def test_verified_owner_gets_counts_and_categories(self):
+        DomainOwnership.objects.create(
+            user=self.user,
+            domain="corp.ru",
+            verified=True,
+        )
+
+        response = self._search("CORP.ru")
+
+        self.assertEqual(
+            [
+                (result["database"], result["records"], result["data"])
+                for result in response.context["results"]
+            ],
+            [
+                (
+                    "leak",
+                    2,
+                    {
+                        "critical": ["email", "password"],
+                        "medium": [],
+                        "low": [],
+                    },
+                ),
+            ],
+        )
+
+    def test_counts_are_aggregated_in_database(self):
+        database = ManagedDatabase.objects.get(name="leak")
+        encryptor = CellEncryptor(settings.ENCRYPTION_KEY)
+        for user_index in range(4, 54):
+            Data.objects.create(
+                database=database,
+                user_index=user_index,
+                column_index=0,
+                value=encryptor.encrypt(f"user{user_index}@corp.ru"),
+                lookup=encryptor.lookup(f"user{user_index}@corp.ru"),
+                domain_lookup=encryptor.domain_lookup("corp.ru"),
+            )
+            DataRecord.objects.create(
+                database=database,
+                user_index=user_index,
+                columns=b"\x01",
+            )
+
+        with self.assertNumQueries(2):
+            results = DataRecord.objects.count_domain(
+                [encryptor.domain_lookup("corp.ru")],
+            )
+
+        self.assertEqual(
+            results,
+            {
+                "leak": {
+                    "history": database.history,
+                    "records": 52,
+                    "columns": ["email", "password"],
+                },
+            },
+        )
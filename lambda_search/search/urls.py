@@ -1,13 +1,46 @@
 from django.urls import path
 
 from search.admin import ManagedDatabaseAdmin
-from search.views import SearchView, TaskProgressView
+from search.views import (
+    AsyncSearchView,
+    BulkSearchDownloadView,
+    BulkSearchProgressView,
+    BulkSearchView,
+    DomainSearchView,
+    SearchCacheStatsView,
+    SearchStreamView,
+    SearchView,
+    TaskProgressView,
+)
 
 app_name = "search"
 
 urlpatterns = [
     path("", SearchView.as_view(), name="search"),
+    path("api/", AsyncSearchView.as_view(), name="search_api"),
+    path(
+        "api/stream/",
+        SearchStreamView.as_view(),
+        name="search_stream",
+    ),
+    path("domain/", DomainSearchView.as_view(), name="domain_search"),
+    path("bulk/", BulkSearchView.as_view(), name="bulk_search"),
+    path(
+        "bulk/<int:pk>/progress/",
+        BulkSearchProgressView.as_view(),
+        name="bulk_search_progress",
+    ),
+    path(
+        "bulk/<int:pk>/download/",
+        BulkSearchDownloadView.as_view(),
+        name="bulk_search_download",
+    ),
     path("task-progress/", TaskProgressView.as_view(), name="task_progress"),
+    path(
+        "cache-stats/",
+        SearchCacheStatsView.as_view(),
+        name="cache_stats",
+    ),
     path(
         "admin/search/manageddatabase/upload-progress/",
         ManagedDatabaseAdmin.get_upload_progress,
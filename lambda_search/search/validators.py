@@ -0,0 +1,31 @@
+from django.core.exceptions import ValidationError
+from django.core.validators import FileExtensionValidator
+from django.utils.deconstruct import deconstructible
+
+__all__ = ()
+
+
+@deconstructible
+class DatabaseFileExtensionValidator(FileExtensionValidator):
+    """
+    FileExtensionValidator, допускающий составные расширения (csv.gz):
+    имя файла проверяется по окончанию, а не по последнему суффиксу.
+    """
+
+    def __call__(self, value):
+        name = value.name.lower()
+        if self.allowed_extensions is None or any(
+            name.endswith(f".{extension}")
+            for extension in self.allowed_extensions
+        ):
+            return
+
+        raise ValidationError(
+            self.message,
+            code=self.code,
+            params={
+                "extension": name.rsplit(".", 1)[-1] if "." in name else "",
+                "allowed_extensions": ", ".join(self.allowed_extensions),
+                "value": value,
+            },
+        )
@@ -1,19 +1,45 @@
+from http import HTTPStatus
+import itertools
 import json
+from operator import attrgetter
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse, JsonResponse
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import (
+    FileResponse,
+    Http404,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404
+from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
 from django.utils.translation import gettext_lazy as _
 from django.views import View
 from django.views.generic.edit import FormView
-from django_celery_results.models import TaskResult
 
-from history.models import QueryHistory
-from search.encryptor import CellEncryptor
-from search.forms import SearchForm
-from search.models import Data, ManagedDatabase
+from search.bloom import aget_bloom_filters
+from search.encryptor import KeyRing
+from search.forms import BulkSearchForm, DomainSearchForm, SearchForm
+from search.models import (
+    BulkSearchJob,
+    Data,
+    DataRecord,
+    DomainOwnership,
+    ManagedDatabase,
+)
+from search.progress import get_task_progress
+from search.result_cache import (
+    acache_results,
+    aget_cached_results,
+    get_cache_stats,
+    get_cached_results,
+)
+from search.tasks import bulk_search_task, save_search_history_task
 
 __all__ = ()
 
@@ -69,41 +95,8 @@ DANGER_LEVELS = {
 }
 
 
-class SearchView(LoginRequiredMixin, FormView):
-    template_name = "search/search.html"
-    form_class = SearchForm
-    key = settings.ENCRYPTION_KEY
-    encryptor = CellEncryptor(key)
-
-    def get(self, request, *args, **kwargs):
-        req = request.GET.get("search_query", "")
-        search_query = self.encryptor.decrypt(req) if req else ""
-        form = self.form_class(initial={"search_query": search_query})
-        return self.render_to_response(
-            self.get_context_data(form=form, results=None),
-        )
-
-    def form_valid(self, form):
-        query = self.encryptor.encrypt(form.cleaned_data["search_query"])
-        search_results = Data.objects.search(query)
-        formatted_results = self._format_results(search_results)
-        QueryHistory.objects.create(
-            user=self.request.user,
-            query=query,
-            result=formatted_results,
-        )
-        form = self.form_class()
-        return self.render_to_response(
-            self.get_context_data(results=formatted_results, form=form),
-        )
-
-    def form_invalid(self, form):
-        return self.render_to_response(
-            self.get_context_data(
-                results=None,
-                errors=form.errors,
-            ),
-        )
+class SearchResultsMixin:
+    keyring = KeyRing.from_settings()
 
     def _format_results(self, raw_results):
         unique_databases = self._merge_results_by_database(raw_results)
@@ -123,16 +116,18 @@ class SearchView(LoginRequiredMixin, FormView):
     def _merge_results_by_database(self, results):
         grouped_data = {}
 
-        for item in results:
-            db_name = item.database.name
+        for record in results:
+            db_name = record.database.name
 
             if db_name not in grouped_data:
                 grouped_data[db_name] = {
-                    "history": item.database.history,
+                    "history": record.database.history,
                     "columns": [],
+                    "records": 0,
                 }
 
-            grouped_data[db_name]["columns"].append(item.column_name)
+            grouped_data[db_name]["columns"].extend(record.column_names)
+            grouped_data[db_name]["records"] += 1
 
         return grouped_data
 
@@ -163,12 +158,262 @@ class SearchView(LoginRequiredMixin, FormView):
             NORMALIZATION_MAP.get(col.strip().lower(), col) for col in columns
         ]
 
+
+class SearchView(LoginRequiredMixin, SearchResultsMixin, FormView):
+    template_name = "search/search.html"
+    form_class = SearchForm
+    paginate_by = settings.ITEMS_PER_PAGE
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get("query")
+        if query:
+            try:
+                search_query = self.keyring.decrypt_token(query)
+            except ValueError:
+                raise Http404
+
+            return self.render_to_response(
+                self.get_context_data(
+                    form=self.form_class(),
+                    **self.get_results_page(
+                        query,
+                        self.keyring.lookups(search_query),
+                        request.GET.get("page"),
+                    ),
+                ),
+            )
+
+        req = request.GET.get("search_query", "")
+        search_query = self.keyring.decrypt_token(req) if req else ""
+        form = self.form_class(initial={"search_query": search_query})
+        return self.render_to_response(
+            self.get_context_data(form=form, results=None),
+        )
+
+    def get_results_page(self, query, lookups, page_number) -> dict:
+        """
+        Страница результатов: утечки берутся из базы срезом LIMIT/OFFSET,
+        записи читаются только для утечек страницы. Если полный результат
+        уже в кэше, страница вырезается из него.
+        """
+        formatted_results = get_cached_results(query)
+        if formatted_results is not None:
+            page = Paginator(
+                formatted_results,
+                self.paginate_by,
+            ).get_page(page_number)
+        else:
+            page = Paginator(
+                Data.objects.search_databases(lookups),
+                self.paginate_by,
+            ).get_page(page_number)
+            page.object_list = self._format_results(
+                DataRecord.objects.search(lookups).filter(
+                    **{
+                        f"{DataRecord.database.field.name}__in": [
+                            database.pk for database in page
+                        ],
+                    },
+                ),
+            )
+
+        return {
+            "query": query,
+            "page_obj": page,
+            "is_paginated": page.has_other_pages(),
+            "results": page.object_list,
+        }
+
+    def form_valid(self, form):
+        search_query = form.cleaned_data["search_query"]
+        query = self.keyring.encrypt_token(search_query)
+        lookups = self.keyring.lookups(search_query)
+        user_id = self.request.user.pk
+        transaction.on_commit(
+            lambda: save_search_history_task.delay(
+                user_id,
+                query,
+                [lookup.hex() for lookup in lookups],
+            ),
+        )
+        return self.render_to_response(
+            self.get_context_data(
+                form=self.form_class(),
+                **self.get_results_page(query, lookups, 1),
+            ),
+        )
+
+    def form_invalid(self, form):
+        return self.render_to_response(
+            self.get_context_data(
+                results=None,
+                errors=form.errors,
+            ),
+        )
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["title"] = _("Search")
         return context
 
 
+class SearchStreamView(SearchResultsMixin, View):
+    """
+    Streamed JSON search endpoint. Each leak is sent as soon as its
+    records have been read, before the whole result is assembled.
+    """
+
+    http_method_names = ["post"]
+    chunk_size = 500
+
+    def post(self, request):
+        if not request.user.is_authenticated:
+            return JsonResponse(
+                {"error": "Authentication required"},
+                status=HTTPStatus.UNAUTHORIZED,
+            )
+
+        form = SearchForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse(
+                {"errors": form.errors},
+                status=HTTPStatus.BAD_REQUEST,
+            )
+
+        search_query = form.cleaned_data["search_query"]
+        query = self.keyring.encrypt_token(search_query)
+        lookups = self.keyring.lookups(search_query)
+        user_id = request.user.pk
+        transaction.on_commit(
+            lambda: save_search_history_task.delay(
+                user_id,
+                query,
+                [lookup.hex() for lookup in lookups],
+            ),
+        )
+
+        formatted_results = get_cached_results(query)
+        if formatted_results is None:
+            formatted_results = self._iter_results(lookups)
+
+        return StreamingHttpResponse(
+            self._stream(formatted_results),
+            content_type="application/json",
+        )
+
+    def _iter_results(self, lookups):
+        records = DataRecord.objects.search(lookups).iterator(
+            chunk_size=self.chunk_size,
+        )
+        for _database_id, database_records in itertools.groupby(
+            records,
+            key=attrgetter(DataRecord.database.field.attname),
+        ):
+            yield from self._format_results(database_records)
+
+    def _stream(self, formatted_results):
+        yield '{"results": ['
+        for index, result in enumerate(formatted_results):
+            yield ("," if index else "") + json.dumps(result)
+
+        yield "]}"
+
+
+class DomainSearchView(LoginRequiredMixin, SearchResultsMixin, FormView):
+    """
+    Organisation-wide exposure check: leaks containing any email
+    at a domain. Available to staff and to verified domain owners.
+    """
+
+    template_name = "search/domain_search.html"
+    form_class = DomainSearchForm
+
+    def form_valid(self, form):
+        domain = form.cleaned_data["domain"]
+        user = self.request.user
+        if not (
+            user.is_staff
+            or DomainOwnership.objects.filter(
+                user=user,
+                domain=domain,
+                verified=True,
+            ).exists()
+        ):
+            form.add_error(
+                "domain",
+                _("Поиск доступен только подтверждённому владельцу домена."),
+            )
+            return self.form_invalid(form)
+
+        results = [
+            {
+                "database": database,
+                "history": data["history"],
+                "records": data["records"],
+                "data": self._categorize_data(data["columns"]),
+            }
+            for database, data in DataRecord.objects.count_domain(
+                self.keyring.domain_lookups(domain),
+            ).items()
+        ]
+        return self.render_to_response(
+            self.get_context_data(form=form, domain=domain, results=results),
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = _("Domain search")
+        return context
+
+
+class AsyncSearchView(SearchResultsMixin, View):
+    """
+    JSON search endpoint. Database and cache access are awaited,
+    so under ASGI a pending search does not hold a worker thread.
+    """
+
+    http_method_names = ["post"]
+
+    async def post(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse(
+                {"error": "Authentication required"},
+                status=HTTPStatus.UNAUTHORIZED,
+            )
+
+        form = SearchForm(request.POST)
+        # Проверка капчи выполняет сетевой запрос
+        if not await sync_to_async(form.is_valid)():
+            return JsonResponse(
+                {"errors": form.errors},
+                status=HTTPStatus.BAD_REQUEST,
+            )
+
+        search_query = form.cleaned_data["search_query"]
+        query = self.keyring.encrypt_token(search_query)
+        formatted_results = await aget_cached_results(query)
+        if formatted_results is None:
+            search_results = DataRecord.objects.search(
+                self.keyring.lookups(search_query),
+                await aget_bloom_filters(),
+            )
+            formatted_results = self._format_results(
+                [record async for record in search_results],
+            )
+            await acache_results(query, formatted_results)
+
+        # История пишется в фоне из кэша, как в SearchView; постановка
+        # задачи — сетевой вызов, он выполняется не в цикле событий
+        lookups = [
+            lookup.hex() for lookup in self.keyring.lookups(search_query)
+        ]
+        await sync_to_async(transaction.on_commit)(
+            lambda: save_search_history_task.delay(user.pk, query, lookups),
+        )
+        return JsonResponse({"results": formatted_results})
+
+
 @method_decorator(staff_member_required, name="dispatch")
 class TaskProgressView(View):
     """View for getting the progress of the task."""
@@ -178,7 +423,7 @@ class TaskProgressView(View):
         if not task_id:
             return JsonResponse(
                 {"error": "The issue ID is not specified"},
-                status=HttpResponse.status_code.HTTP_400_BAD_REQUEST,
+                status=HTTPStatus.BAD_REQUEST,
             )
 
         try:
@@ -188,21 +433,83 @@ class TaskProgressView(View):
             if not database:
                 return JsonResponse({"error": "Issue not found"}, status=404)
 
-            task_result = TaskResult.objects.get(task_id=task_id)
-            result_data = task_result.result
-
-            if isinstance(result_data, str):
-                result_data = json.loads(result_data)
+            result_data = get_task_progress(task_id)
+            if result_data is None:
+                return JsonResponse(
+                    {"error": "Issue result not found"},
+                    status=HTTPStatus.NOT_FOUND,
+                )
 
             return JsonResponse(result_data)
 
-        except TaskResult.DoesNotExist:
-            return JsonResponse(
-                {"error": "Issue result not found"},
-                status=HttpResponse.status_code.HTTP_404_NOT_FOUND,
-            )
         except json.JSONDecodeError:
             return JsonResponse(
                 {"error": "Incorrect result data"},
-                status=HttpResponse.status_code.HTTP_500_INTERNAL_SERVER_ERROR,
+                status=HTTPStatus.INTERNAL_SERVER_ERROR,
             )
+
+
+@method_decorator(staff_member_required, name="dispatch")
+class SearchCacheStatsView(View):
+    """Hit and miss counters of the search result cache."""
+
+    def get(self, request):
+        return JsonResponse(get_cache_stats())
+
+
+class BulkSearchView(LoginRequiredMixin, FormView):
+    template_name = "search/bulk_search.html"
+    form_class = BulkSearchForm
+    success_url = reverse_lazy("search:bulk_search")
+
+    def form_valid(self, form):
+        job = BulkSearchJob.objects.create(
+            user=self.request.user,
+            file=form.cleaned_data["file"],
+        )
+        transaction.on_commit(lambda: bulk_search_task.delay(job.pk))
+        return super().form_valid(form)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = _("Bulk search")
+        context["jobs"] = self.request.user.bulk_searches.order_by(
+            f"-{BulkSearchJob.created_at.field.name}",
+        )
+        return context
+
+
+class BulkSearchProgressView(LoginRequiredMixin, View):
+    """Progress of the user's bulk search job."""
+
+    def get(self, request, pk):
+        job = get_object_or_404(BulkSearchJob, pk=pk, user=request.user)
+        result_data = (
+            get_task_progress(job.progress_task_id)
+            if job.progress_task_id
+            else None
+        )
+        if result_data is None:
+            result_data = {
+                "current": 0,
+                "total": 0,
+                "percent": 0,
+                "description": "Waiting...",
+            }
+
+        return JsonResponse(result_data)
+
+
+class BulkSearchDownloadView(LoginRequiredMixin, View):
+    """Download of the finished bulk search results."""
+
+    def get(self, request, pk):
+        job = get_object_or_404(BulkSearchJob, pk=pk, user=request.user)
+        if not job.finished_at or not job.result:
+            raise Http404
+
+        return FileResponse(
+            job.result.open("rb"),
+            as_attachment=True,
+            filename=f"bulk_search_{job.pk}.csv",
+        )
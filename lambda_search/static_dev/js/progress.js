@@ -7,7 +7,9 @@ window.addEventListener('load', function() {
         progressContainers.forEach(function(container) {
             const taskId = container.dataset.taskId;
             
-            fetch('/search/task-progress/?task_id=' + taskId)
+            const url = container.dataset.progressUrl || '/search/task-progress/?task_id=' + taskId;
+
+            fetch(url)
                 .then(response => response.json())
                 .then(data => {
                     const progressBar = container.querySelector('.progress-bar-fill');
@@ -61,14 +61,12 @@ class EmailOrUsernameModelBackend(django.contrib.auth.backends.BaseBackend):
                     ),
                 )
 
-                cell = search.encryptor.CellEncryptor(
-                    django.conf.settings.ENCRYPTION_KEY,
-                )
+                keyring = search.encryptor.KeyRing.from_settings()
 
                 activation_path = django.urls.reverse(
                     "users:activate",
                     args=[
-                        cell.encrypt(username),
+                        keyring.encrypt_token(username),
                     ],
                 )
                 confirmation_link = _(
@@ -1,17 +1,59 @@
+import functools
+
+from asgiref.sync import (
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async,
+)
 import django.contrib.auth
-from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
 
 from users.models import User
 
 __all__ = []
 
 
-class ProxyUserMiddleware(MiddlewareMixin):
-    def process_request(self, request):
-        if request.user.is_authenticated:
-            try:
-                User.create_profile(request.user)
-                profile = User.objects.get_queryset()
-                request.user = profile.get(pk=request.user.pk)
-            except AttributeError:
-                request.user = django.contrib.auth.get_user_model()
+async def _resolved(user):
+    return user
+
+
+class ProxyUserMiddleware:
+    """
+    Подменяет request.user профилем пользователя. В асинхронной цепочке
+    профиль загружается лениво: запрос не переключается в поток ради
+    сессии и профиля, асинхронное представление получает пользователя
+    через await request.auser().
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        request.user = self.get_profile(request.user)
+        request.auser = functools.partial(_resolved, request.user)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        user = request.user
+        profile = functools.cache(lambda: self.get_profile(user))
+        request.user = SimpleLazyObject(profile)
+        request.auser = sync_to_async(profile)
+        return await self.get_response(request)
+
+    def get_profile(self, user):
+        if not user.is_authenticated:
+            return user
+
+        try:
+            User.create_profile(user)
+            return User.objects.get_queryset().get(pk=user.pk)
+        except AttributeError:
+            return django.contrib.auth.get_user_model()
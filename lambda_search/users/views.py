@@ -15,7 +15,7 @@ from django.utils.translation import gettext as _
 from django.views import View
 from django.views.generic import FormView
 
-from search.encryptor import CellEncryptor
+from search.encryptor import KeyRing
 import users.forms
 from users.models import Profile
 
@@ -35,10 +35,9 @@ class CustomLoginView(LoginView):
 
 class ActivateUserView(View):
     def get(self, request, username):
-        cell = CellEncryptor(settings.ENCRYPTION_KEY)
         user = get_object_or_404(
             User,
-            username=cell.decrypt(username),
+            username=KeyRing.from_settings().decrypt_token(username),
         )
         now = timezone.now()
 
@@ -92,9 +91,7 @@ class SignupView(FormView):
         return redirect(reverse("users:login"))
 
     def send_activation_email(self, user):
-        cell = CellEncryptor(settings.ENCRYPTION_KEY)
-
-        encr_username = cell.encrypt(user.username)
+        encr_username = KeyRing.from_settings().encrypt_token(user.username)
 
         activation_link = f"{settings.SITE_URL}/auth/activate/{encr_username}"
 